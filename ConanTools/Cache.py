@@ -0,0 +1,135 @@
+"""Support module for pruning the local conan cache by age and size.
+
+The references in the cache are listed by scanning the storage folder (i.e., without invoking
+conan for every reference). The size of each reference is determined in parallel and the
+creation date is taken from the export manifest. Based on an age and/or size budget,
+:func:`select_evictions` chooses the oldest references which are then removed in parallel via
+``conan remove``.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+import subprocess as sp
+from typing import List, Optional
+
+from ConanTools import Conan, DiskUsage
+
+
+class CacheEntry():
+    def __init__(self, ref: Conan.Reference, path: str, size: int, created: datetime):
+        self.ref = ref
+        self.path = path
+        self.size = size
+        self.created = created
+
+    def __repr__(self):
+        return "CacheEntry({}, size={}, created={})".format(self.ref, self.size,
+                                                            self.created.isoformat())
+
+
+def storage_path(session: Optional[Conan.ConanSession] = None) -> str:
+    """Queries the folder that contains the packages of the local cache."""
+    result = Conan.run(["config", "get", "storage.path"], stdout=sp.PIPE, session=session)
+    return os.path.abspath(os.path.expanduser(result.stdout))
+
+
+def _creation_date(path: str) -> datetime:
+    # The first line of the export manifest holds the time of the export.
+    try:
+        with open(os.path.join(path, "export", "conanmanifest.txt")) as f:
+            return datetime.fromtimestamp(int(f.readline().strip()))
+    except (OSError, ValueError):
+        return datetime.fromtimestamp(os.stat(path).st_mtime)
+
+
+def _subfolders(folder: str) -> List[str]:
+    try:
+        return [x.name for x in os.scandir(folder) if x.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
+
+
+def _ref_string(ref: Conan.Reference) -> str:
+    # References without user and channel are stored as "_/_".
+    if ref.user == "_" and ref.channel == "_":
+        return "{}/{}@".format(ref.name, ref.version)
+    return str(ref)
+
+
+def list_references(storage: str) -> List[Conan.Reference]:
+    """Lists the references in the storage folder (i.e., name/version/user/channel)."""
+    refs = []
+    for name in sorted(_subfolders(storage)):
+        for version in sorted(_subfolders(os.path.join(storage, name))):
+            for user in sorted(_subfolders(os.path.join(storage, name, version))):
+                for channel in sorted(_subfolders(os.path.join(storage, name, version, user))):
+                    refs.append(Conan.Reference(name, version, user, channel))
+    return refs
+
+
+def entries(storage: Optional[str] = None, max_workers: Optional[int] = None,
+            session: Optional[Conan.ConanSession] = None) -> List[CacheEntry]:
+    """Determines the size and creation date of all references in the cache in parallel.
+
+    :param storage: The storage folder of the cache. (None -> queried via conan)
+    """
+    storage = storage or storage_path(session)
+    paths = OrderedDict((ref, os.path.join(storage, ref.name, ref.version, ref.user, ref.channel))
+                        for ref in list_references(storage))
+    # Files that are hardlinked between references are only counted for the first one.
+    sizes = DiskUsage.Scanner(max_workers).scan(paths)
+    return [CacheEntry(ref, path, sizes[ref], _creation_date(path)) for ref, path in paths.items()]
+
+
+def select_evictions(cache_entries: List[CacheEntry], max_size: Optional[int] = None,
+                     max_age: Optional[timedelta] = None,
+                     now: Optional[datetime] = None) -> List[CacheEntry]:
+    """Chooses the entries that have to be removed to satisfy the age and size budget.
+
+    All entries that are older than max_age are evicted. Afterwards, the oldest remaining
+    entries are evicted until the total size does not exceed max_size (in bytes).
+    """
+    now = now or datetime.now()
+    ordered = sorted(cache_entries, key=lambda x: (x.created, str(x.ref)))
+    evicted = [x for x in ordered if max_age is not None and now - x.created > max_age]
+    if max_size is not None:
+        remaining = ordered[len(evicted):]
+        total = sum(x.size for x in remaining)
+        for x in remaining:
+            if total <= max_size:
+                break
+            evicted.append(x)
+            total -= x.size
+    return evicted
+
+
+def format_report(evicted: List[CacheEntry], cache_entries: List[CacheEntry]) -> str:
+    lines = ["{:>12}  {:19}  {}".format(x.size, x.created.strftime('%Y-%m-%d %H:%M:%S'), x.ref)
+             for x in evicted]
+    freed = sum(x.size for x in evicted)
+    total = sum(x.size for x in cache_entries)
+    lines.append("Evicting {} of {} references frees {} of {} bytes.".format(
+        len(evicted), len(cache_entries), freed, total))
+    return "\n".join(lines)
+
+
+def prune(max_size: Optional[int] = None, max_age: Optional[timedelta] = None,
+          dry_run: bool = False, storage: Optional[str] = None, max_workers: Optional[int] = None,
+          session: Optional[Conan.ConanSession] = None) -> List[CacheEntry]:
+    """Removes the oldest references from the local cache to satisfy the age and size budget.
+
+    :param dry_run: Only print the report but do not remove anything.
+    :param max_workers: Number of concurrent conan remove calls and size computations.
+    :returns: The evicted (or in dry run mode the to be evicted) entries.
+    """
+    cache_entries = entries(storage, max_workers=max_workers, session=session)
+    evicted = select_evictions(cache_entries, max_size=max_size, max_age=max_age)
+    Conan.log(format_report(evicted, cache_entries), session=session)
+    if dry_run or len(evicted) == 0:
+        return evicted
+    cancel = Conan.CancellationToken()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda x: Conan.run(["remove", "-f", _ref_string(x.ref)],
+                                              cancel=cancel, session=session), evicted))
+    return evicted
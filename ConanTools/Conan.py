@@ -1,17 +1,24 @@
-import configparser
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+import hashlib
 import json
 import os
 import re
 import shlex
 import shutil
+import signal
 import stat
 import subprocess as sp
 import sys
 import tempfile
-from typing import Any, Dict, List, Optional, Union
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import ConanTools
+from ConanTools import Metrics
 
 CONAN_CMD = os.environ.get("CT_CONAN_CMD", "conan")
 
@@ -58,58 +65,475 @@ def cmd_to_string(cmd: List[str]) -> str:
 
 
 def create_stamp_file(path: str):
-    with open(path, 'a'):
+    # Create the stamp under a temporary name first such that it either exists completely or
+    # not at all, even when several stamps are written concurrently.
+    tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'a'):
         pass
+    os.replace(tmp_path, path)
 
 
-def _run_json(args: List[str]):
+def _record_command(args: List[str], outcome: str, start: float):
+    labels = {"subcommand": args[0] if args else ""}
+    Metrics.REGISTRY.observe("ct_conan_command_duration_seconds", labels,
+                             time.monotonic() - start)
+    Metrics.REGISTRY.inc("ct_conan_commands", dict(labels, result=outcome))
+
+
+@contextmanager
+def _json_output(args: List[str], session: Optional['ConanSession'] = None):
+    """Executes conan with the given arguments and yields the opened JSON output file."""
+    session = session or ConanSession()
     try:
         tmpfile = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
         tmpfile.close()
-        sp.check_call([CONAN_CMD] + args + ["--json", tmpfile.name],
-                      stdin=sp.DEVNULL, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        start = time.monotonic()
+        try:
+            sp.check_call([session.conan_cmd] + args + ["--json", tmpfile.name],
+                          stdin=sp.DEVNULL, stdout=sp.DEVNULL, stderr=sp.DEVNULL,
+                          cwd=session.cwd, env=session.env)
+        except sp.CalledProcessError:
+            _record_command(args, "failure", start)
+            raise
+        _record_command(args, "success", start)
         with open(tmpfile.name) as f:
-            return json.load(f)
+            yield f
     finally:
         if tmpfile and os.path.exists(tmpfile.name):
             os.unlink(tmpfile.name)
 
 
-# TODO use the check argument of sp.run (requires larger test updates)
-def run(args: List[str], cwd: Optional[str] = None, stdout: Optional[int] = None,
-        stderr: Optional[int] = None, check: bool = True, conan_cmd: str = CONAN_CMD):
-    cmd = [conan_cmd] + args
-    cmd_str = cmd_to_string(cmd)
-
-    # ensure that the current working directory exists
-    cwd = os.path.abspath(cwd if cwd is not None else os.getcwd())
-    os.makedirs(cwd, exist_ok=True)
-
-    # execute the actual command
-    print("[{}] $ {}".format(cwd, cmd_str))
-    sys.stdout.flush()
-    result = sp.run(cmd, stdout=stdout, stderr=stderr, cwd=cwd)
-    if stdout == sp.PIPE:
-        result.stdout = result.stdout.decode().strip()
-    if stderr == sp.PIPE:
-        result.stderr = result.stderr.decode().strip()
-    if check and result.returncode != 0:
+def _run_json(args: List[str], session: Optional['ConanSession'] = None):
+    with _json_output(args, session=session) as f:
+        return json.load(f)
+
+
+class _JsonReader():
+    """Minimal pull parser that decodes a JSON document piecewise from a text stream.
+
+    Containers are traversed via :meth:`keys` and :meth:`items` while all other values (and
+    containers that are not traversed) are decoded via :meth:`value`. Hence, only the currently
+    decoded value and a small read buffer are kept in memory.
+    """
+    _WHITESPACE = " \t\n\r"
+
+    def __init__(self, f, chunk_size: int = 64 * 1024):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size: int) -> bool:
+        if self._eof:
+            return False
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        data = self._f.read(size)
+        if not data:
+            self._eof = True
+            return False
+        self._buf += data
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill(self._chunk_size):
+                raise ValueError("Unexpected end of JSON data!")
+
+    def _next(self, expected: str) -> str:
+        ch = self._peek()
+        if ch not in expected:
+            raise ValueError("Expected one of '{}' but got '{}' in JSON data!".format(
+                expected, ch))
+        self._pos += 1
+        return ch
+
+    def value(self) -> Any:
+        """Decodes the next value completely."""
+        self._peek()
+        size = self._chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # Numbers may continue in the next chunk (e.g., "2" of "2.5") unless they are
+                # followed by a delimiter.
+                number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if self._eof or (end < len(self._buf) and (
+                        not number or self._buf[end] in self._WHITESPACE + ",]}")):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill(size)
+            size *= 2
+
+    def items(self):
+        """Iterates over an array. The caller has to consume each element."""
+        self._next("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self._next(",]") == "]":
+                return
+
+    def keys(self):
+        """Iterates over the keys of an object. The caller has to consume each value."""
+        self._next("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self._next(":")
+            yield key
+            if self._next(",}") == "}":
+                return
+
+
+class CommandAborted(ValueError):
+    """Raised when a command is aborted via a cancellation token or its timeout.
+
+    Derives from ValueError, like the errors of failing commands, such that existing error
+    handling keeps working while the abort can still be told apart from the actual failure.
+    """
+
+
+class CancellationToken():
+    """Token that cancels all conan processes which have been started with it.
+
+    The token can be cancelled explicitly, expires after the optional global timeout, and, in
+    fail-fast mode, gets cancelled automatically when one of the commands using it fails. This
+    permits stopping all concurrently running commands shortly after the first failure.
+    """
+    def __init__(self, timeout: Optional[float] = None, fail_fast: bool = True):
+        self._deadline = time.monotonic() + timeout if timeout is not None else None
+        self._fail_fast = fail_fast
+        self._event = threading.Event()
+        self._reason = None
+
+    @property
+    def fail_fast(self) -> bool:
+        return self._fail_fast
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self._deadline is not None and \
+                time.monotonic() >= self._deadline:
+            self.cancel("global timeout expired")
+        return self._event.is_set()
+
+    @property
+    def reason(self) -> Optional[str]:
+        return self._reason
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+
+def _kill_process_group(proc: sp.Popen, grace_period: float = 5.0):
+    if os.name == "posix":
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(grace_period)
+        except sp.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        proc.kill()
+    proc.wait()
+
+
+def _run_cancellable(cmd: List[str], stdout: Optional[int], stderr: Optional[int], cwd: str,
+                     env: Optional[Dict[str, str]], timeout: Optional[float],
+                     cancel: Optional[CancellationToken]) -> sp.CompletedProcess:
+    # Start the command in a new process group to be able to kill all its child processes too.
+    if os.name == "posix":
+        kwargs = {"start_new_session": True}
+    else:
+        kwargs = {"creationflags": sp.CREATE_NEW_PROCESS_GROUP}
+    proc = sp.Popen(cmd, stdout=stdout, stderr=stderr, cwd=cwd, env=env, **kwargs)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    reason = None
+    try:
+        while True:
+            try:
+                out, err = proc.communicate(timeout=0.1)
+                break
+            except sp.TimeoutExpired:
+                pass
+            if cancel is not None and cancel.cancelled:
+                reason = cancel.reason
+            elif deadline is not None and time.monotonic() >= deadline:
+                reason = "timeout of {}s expired".format(timeout)
+            if reason is not None:
+                _kill_process_group(proc)
+                raise CommandAborted("Executing command \"{}\" has been aborted! ({})".format(
+                    cmd_to_string(cmd), reason))
+    except BaseException:
+        if proc.poll() is None:
+            _kill_process_group(proc)
+        raise
+    return sp.CompletedProcess(cmd, proc.returncode, out, err)
+
+
+class ConanSession():
+    """Execution context of conan commands which does not depend on process-global state.
+
+    A session owns the conan command, the environment (including ``CONAN_USER_HOME``), the
+    working directory, and the log sink of the commands that are executed with it. Hence,
+    several sessions can be used concurrently within one process, for example, to build
+    independent configurations with separate conan caches in a thread pool.
+
+    Unspecified values fall back to the process-wide defaults (``CT_CONAN_CMD``,
+    ``os.environ``, ``os.getcwd()``, and ``sys.stdout``) at the time a command is executed.
+
+    The lockfile of the session (see :class:`Lockfile`) is passed to all commands that are
+    formatted via :func:`fmt_build_args` with the session. Unlike the other values, it can be
+    replaced (e.g., via :func:`use_lockfile`) once the graph has been resolved.
+    """
+    def __init__(self, conan_cmd: Optional[str] = None, env: Optional[Dict[str, str]] = None,
+                 user_home: Optional[str] = None, log=None, cwd: Optional[str] = None,
+                 lockfile: Optional['Lockfile'] = None):
+        """Creates the session.
+
+        :param conan_cmd: The conan executable. (None -> CT_CONAN_CMD or "conan")
+        :param env: Variables that extend the environment of the current process.
+        :param user_home: The CONAN_USER_HOME, i.e., the location of the conan cache.
+        :param log: Text file object that receives the executed commands and their output.
+        :param cwd: Default working directory of the commands.
+        :param lockfile: Lockfile that is passed to the build commands of the session.
+        """
+        self.lockfile = lockfile
+        self._conan_cmd = conan_cmd
+        self._env = None
+        if env is not None or user_home is not None:
+            # Take a snapshot such that later modifications of os.environ do not leak in.
+            self._env = dict(os.environ, **(env or {}))
+            if user_home is not None:
+                self._env["CONAN_USER_HOME"] = os.path.abspath(user_home)
+        self._log = log
+        self._log_lock = threading.Lock()
+        self._cwd = os.path.abspath(cwd) if cwd is not None else None
+
+    @property
+    def conan_cmd(self) -> str:
+        return self._conan_cmd or CONAN_CMD
+
+    @property
+    def env(self) -> Optional[Dict[str, str]]:
+        return dict(self._env) if self._env is not None else None
+
+    @property
+    def user_home(self) -> Optional[str]:
+        return (self._env or {}).get("CONAN_USER_HOME")
+
+    @property
+    def cwd(self) -> Optional[str]:
+        return self._cwd
+
+    def _write_log(self, text: str, file=None):
+        log = self._log or file or sys.stdout
+        with self._log_lock:
+            print(text, file=log)
+            log.flush()
+
+    def log(self, text: str):
+        """Writes the message to the log sink of the session (None -> ``sys.stdout``)."""
+        self._write_log(text)
+
+    def _log_fileno(self) -> Optional[int]:
+        try:
+            return self._log.fileno() if self._log is not None else None
+        except (AttributeError, OSError, ValueError):
+            # E.g., io.StringIO which raises io.UnsupportedOperation.
+            return None
+
+    # TODO use the check argument of sp.run (requires larger test updates)
+    def run(self, args: List[str], cwd: Optional[str] = None, stdout: Optional[int] = None,
+            stderr: Optional[int] = None, check: bool = True,
+            env: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+            cancel: Optional[CancellationToken] = None) -> sp.CompletedProcess:
+        """Executes conan with the given arguments (see :func:`run`)."""
+        cmd = [self.conan_cmd] + args
+        cmd_str = cmd_to_string(cmd)
+        if timeout is None and os.environ.get("CT_CONAN_TIMEOUT"):
+            timeout = float(os.environ["CT_CONAN_TIMEOUT"])
+        if cancel is not None and cancel.cancelled:
+            raise CommandAborted("Executing command \"{}\" has been aborted! ({})".format(
+                cmd_str, cancel.reason))
+
+        # ensure that the current working directory exists
+        cwd = os.path.abspath(cwd or self._cwd or os.getcwd())
+        os.makedirs(cwd, exist_ok=True)
+
+        # the additional environment variables extend the one of the session
+        if env is not None:
+            env = dict(self._env if self._env is not None else os.environ, **env)
+        else:
+            env = self._env
+
+        # Route the output of the command to the log sink. File objects without a file
+        # descriptor receive the output after the command finished.
+        captured = False
+        if self._log is not None and stdout is None:
+            fileno = self._log_fileno()
+            if fileno is not None:
+                stdout = fileno
+                stderr = stderr if stderr is not None else fileno
+            else:
+                captured = True
+                stdout = sp.PIPE
+                stderr = stderr if stderr is not None else sp.STDOUT
+
+        # execute the actual command
+        self._write_log("[{}] $ {}".format(cwd, cmd_str))
+        start = time.monotonic()
+        try:
+            if timeout is None and cancel is None:
+                result = sp.run(cmd, stdout=stdout, stderr=stderr, cwd=cwd, env=env)
+            else:
+                result = _run_cancellable(cmd, stdout, stderr, cwd, env, timeout, cancel)
+        except CommandAborted:
+            _record_command(args, "aborted", start)
+            raise
+        _record_command(args, "success" if result.returncode == 0 else "failure", start)
+        if captured:
+            output = result.stdout.decode(errors="replace").rstrip()
+            if output:
+                self._write_log(output)
+            result.stdout = None
+            stdout = None
         if stdout == sp.PIPE:
-            print(result.stdout, file=sys.stdout)
+            result.stdout = result.stdout.decode().strip()
         if stderr == sp.PIPE:
-            print(result.stderr, file=sys.stderr)
-        raise ValueError(
-            "Executing command \"{}\" failed! (returncode={})".format(cmd_str, result.returncode))
-    return result
+            result.stderr = result.stderr.decode().strip()
+        if check and result.returncode != 0:
+            if stdout == sp.PIPE:
+                self._write_log(result.stdout, file=sys.stdout)
+            if stderr == sp.PIPE:
+                self._write_log(result.stderr, file=sys.stderr)
+            if cancel is not None and cancel.fail_fast:
+                cancel.cancel("command \"{}\" failed".format(cmd_str))
+            raise ValueError("Executing command \"{}\" failed! (returncode={})".format(
+                cmd_str, result.returncode))
+        return result
+
+
+def run(args: List[str], cwd: Optional[str] = None, stdout: Optional[int] = None,
+        stderr: Optional[int] = None, check: bool = True, conan_cmd: Optional[str] = None,
+        env: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+        cancel: Optional[CancellationToken] = None, session: Optional[ConanSession] = None):
+    """Executes conan with the given arguments.
+
+    When a timeout (by default ``CT_CONAN_TIMEOUT`` seconds if defined) or a cancellation token
+    is given, the command is started in its own process group which gets killed as a whole when
+    the timeout expires or the token gets cancelled. Failing commands cancel fail-fast tokens.
+
+    :param session: Execution context of the command. (None -> process-wide defaults)
+    """
+    session = session or ConanSession(conan_cmd=conan_cmd)
+    return session.run(args, cwd=cwd, stdout=stdout, stderr=stderr, check=check, env=env,
+                       timeout=timeout, cancel=cancel)
+
+
+def log(text: str, session: Optional[ConanSession] = None):
+    """Writes the message to the log sink of the session (None -> ``sys.stdout``)."""
+    (session or ConanSession()).log(text)
+
+
+class CpuPool():
+    """Token pool that shares the available cores between concurrently running builds.
+
+    Each build acquires its share of the cores which depends on the number of builds that are
+    expected to run in parallel. The share gets passed to the build via the ``CONAN_CPU_COUNT``
+    environment variable. When a build finishes, its cores are returned to the pool and are
+    handed to the builds that start afterwards. Builds block while no core is free.
+
+    The share of a running build cannot change anymore. Hence, callers should lower ``parallel``
+    (the attribute is writable) while their queue drains such that the last builds get larger
+    shares.
+    """
+    def __init__(self, parallel: int, total: Optional[int] = None):
+        """Creates the pool.
+
+        :param parallel: Number of builds which are expected to run concurrently, i.e.,
+                         usually the number of workers of the caller.
+        :param total: Number of cores (None -> ``CONAN_CPU_COUNT`` or the number of CPUs).
+        """
+        if parallel < 1:
+            raise ValueError("At least one parallel build is required!")
+        self._total = total or int(os.environ.get("CONAN_CPU_COUNT", 0)) or os.cpu_count() or 1
+        self._free = self._total
+        self._active = 0
+        self.parallel = parallel
+        self._cond = threading.Condition()
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    @property
+    def free(self) -> int:
+        with self._cond:
+            return self._free
+
+    @contextmanager
+    def acquire(self):
+        """Context manager which reserves a share of the cores and yields its size."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._free > 0)
+            # Split the free cores between this build and the others that are expected to start.
+            expected = max(1, self.parallel - self._active)
+            share = max(1, self._free // expected)
+            self._free -= share
+            self._active += 1
+        try:
+            yield share
+        finally:
+            with self._cond:
+                self._free += share
+                self._active -= 1
+                self._cond.notify_all()
+
+    @staticmethod
+    def env(share: int) -> Dict[str, str]:
+        """Returns the environment variables that limit a build to the share of cores."""
+        return {"CONAN_CPU_COUNT": str(share), "CMAKE_BUILD_PARALLEL_LEVEL": str(share)}
+
+
+def conan_sh_file_path(filedir: str, basename: str) -> str:
+    return os.path.join(filedir, "ct_{}.sh".format(basename))
 
 
 def write_conan_sh_file(filedir: str, basename: str, args: List[str], cmd_cwd: Optional[str],
-                        env: Optional[dict] = None, conan_cmd: str = CONAN_CMD):
+                        env: Optional[dict] = None, conan_cmd: Optional[str] = None,
+                        session: Optional['ConanSession'] = None):
+    """Writes a shell script which replays the conan command.
+
+    Unspecified values are taken from the session (i.e., its conan command, environment
+    including ``CONAN_USER_HOME``, and working directory) or the process-wide defaults.
+    """
     os.makedirs(filedir, exist_ok=True)
-    filepath = os.path.join(filedir, "ct_{}.sh".format(basename))
-    cmd_cwd = os.path.abspath(cmd_cwd if cmd_cwd is not None else os.getcwd())
+    filepath = conan_sh_file_path(filedir, basename)
+    if cmd_cwd is None:
+        cmd_cwd = (session.cwd if session is not None else None) or os.getcwd()
+    cmd_cwd = os.path.abspath(cmd_cwd)
+    if conan_cmd is None:
+        conan_cmd = session.conan_cmd if session is not None else CONAN_CMD
     if env is None:
-        env = os.environ
+        env = (session.env if session is not None else None) or os.environ
     with open(filepath, 'w') as f:
         f.write('#!/bin/sh\n')
         for k, v in env.items():
@@ -140,8 +564,100 @@ def fmt_arg_list(values: Union[List[Optional[str]], Optional[str]], key: str) ->
     return args
 
 
+def resolve_remote(remote) -> Optional[str]:
+    """Returns the name of the remote and resolves selectors to their fastest mirror."""
+    if remote is not None and hasattr(remote, "fastest"):
+        return remote.fastest()
+    return remote
+
+
+class Lockfile():
+    """Conan lockfile that captures a resolved dependency graph for reuse by later commands.
+
+    Lockfiles are cached by a fingerprint of the root recipe, the profiles, the options, and the
+    remote. Hence, the graph gets only resolved once per pipeline. When a lockfile is set on a
+    :class:`ConanSession`, :func:`fmt_build_args` passes it to all commands of the session instead
+    of the profiles and options (which conan does not accept in combination with a lockfile).
+    """
+    def __init__(self, path: str):
+        self._path = os.path.abspath(path)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @staticmethod
+    def fingerprint(path_or_ref: str, profiles: List[str] = [], options: Dict[str, str] = {},
+                    remote: Optional[str] = None, session: Optional[ConanSession] = None) -> str:
+        from ConanTools import Profile
+        h = hashlib.sha256()
+        if os.path.isfile(path_or_ref):
+            with open(path_or_ref, 'rb') as f:
+                h.update(f.read())
+        else:
+            h.update(path_or_ref.encode())
+        for profile in profiles:
+            path = Profile.resolve_path(profile, session=session)
+            content = Profile.Profile.load(path, session=session).dumps() if path else profile
+            h.update(b"\0profile:" + content.encode())
+        for k, v in sorted(options.items()):
+            h.update("\0option:{}={}".format(k, v).encode())
+        h.update("\0remote:{}".format(remote).encode())
+        return h.hexdigest()
+
+    @classmethod
+    def create(cls, path_or_ref: str, profiles: List[str] = [], options: Dict[str, str] = {},
+               remote: Optional[str] = None, folder: Optional[str] = None,
+               session: Optional[ConanSession] = None) -> 'Lockfile':
+        """Resolves the graph via ``conan lock create`` unless a matching lockfile exists.
+
+        :param path_or_ref: Path of the root recipe or reference of the root package.
+        :param folder: Folder where the lockfiles are cached. (None -> current dir)
+        """
+        folder = os.path.abspath(folder or (session.cwd if session else None) or os.getcwd())
+        fingerprint = cls.fingerprint(path_or_ref, profiles, options, remote, session=session)
+        path = os.path.join(folder, "ct-{}.lock".format(fingerprint[:16]))
+        hit = os.path.isfile(path)
+        Metrics.count_cache("lockfile", hit)
+        if hit:
+            return cls(path)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        args = fmt_build_args("lock", ["create", path_or_ref], remote=remote, profiles=profiles,
+                              build=[], options=options, lockfile=False, session=session)
+        run(args + ["--lockfile-out=" + tmp_path], cwd=folder, session=session)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+
+@contextmanager
+def use_lockfile(lockfile: Optional[Lockfile], session: ConanSession):
+    """Passes the lockfile to the commands of the session that are formatted in the block.
+
+    Only the given session is affected. Hence, other sessions (e.g., of concurrently built
+    configurations) keep resolving their own graphs.
+    """
+    previous = session.lockfile
+    session.lockfile = lockfile
+    try:
+        yield lockfile
+    finally:
+        session.lockfile = previous
+
+
 def fmt_build_args(cmd: str, args: List[str], remote: Optional[str], profiles: List[str],
-                   build: List[Optional[str]], options: Dict[str, str]) -> List[str]:
+                   build: List[Optional[str]], options: Dict[str, str],
+                   lockfile: bool = True, session: Optional[ConanSession] = None) -> List[str]:
+    remote = resolve_remote(remote)
+    active = session.lockfile if session is not None else None
+    if lockfile and active is not None:
+        # The lockfile already contains the profile and options.
+        profiles = []
+        options = {}
+        args = args + ["--lockfile", active.path]
+    if isinstance(profiles, list) and ConanTools.env_flag("CT_MERGE_PROFILES"):
+        # Pass a single, already flattened profile to conan instead of the whole include chain.
+        from ConanTools import Profile
+        profiles = Profile.merged(profiles, session=session)
     profile_args = fmt_arg_list(profiles, "--profile")
     build_args = fmt_arg_list(build, "--build")
     remote_args = fmt_arg_list(remote or [], "--remote")
@@ -149,32 +665,89 @@ def fmt_build_args(cmd: str, args: List[str], remote: Optional[str], profiles: L
     return [cmd] + args + profile_args + build_args + remote_args + option_args
 
 
-def get_recipe_field(recipe_path, field_name, cwd=None):
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class RecipeFieldCache():
+    """Thread-safe LRU cache for the fields of recipe files.
+
+    Entries are invalidated when the modification time, size, or inode of the recipe file
+    changes. Recipes that can not be stat-ed are not cached.
+    """
+    def __init__(self, maxsize: int = 128):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, recipe_path: str, field_name: str, default: Any = None,
+            session: Optional[ConanSession] = None) -> Any:
+        try:
+            st = os.stat(recipe_path)
+            stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            stamp = None
+        key = (recipe_path, field_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = stamp is not None and entry is not None and entry[0] == stamp
+            if hit:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+        Metrics.count_cache("recipe_field", hit)
+        if hit:
+            return entry[1]
+        # Do not hold the lock while conan inspects the recipe.
+        value = inspect(recipe_path, attribute=field_name, default=default, session=session)
+        if stamp is not None and self._maxsize > 0:
+            with self._lock:
+                self._entries[key] = (stamp, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._maxsize, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hits = 0
+            self._misses = 0
+
+
+recipe_field_cache = RecipeFieldCache(int(os.environ.get("CT_RECIPE_FIELD_CACHE_SIZE", 256)))
+
+
+def get_recipe_field(recipe_path, field_name, cwd=None, session: Optional[ConanSession] = None):
     # make the recipe path absolute
-    cwd = cwd or os.getcwd()
+    cwd = cwd or (session.cwd if session is not None else None) or os.getcwd()
     if not os.path.isabs(recipe_path):
         recipe_path = os.path.normpath(os.path.join(cwd, recipe_path))
 
     if not os.path.exists(recipe_path):
         return None
-
-    get_recipe_field._recipe_cache = getattr(get_recipe_field, "_recipe_cache", {})
-    recipe = get_recipe_field._recipe_cache.setdefault(recipe_path, Recipe(recipe_path))
-    return recipe.get_field(field_name)
+    return recipe_field_cache.get(recipe_path, field_name, session=session)
 
 
 class Reference():
-    def __init__(self, name, version, user, channel):
+    def __init__(self, name, version, user, channel, session: Optional[ConanSession] = None):
         self._name = name
         self._version = version
         self._user = user
         self._channel = channel
+        self._session = session
 
     @classmethod
-    def from_string(cls, ref: str) -> 'Reference':
+    def from_string(cls, ref: str, session: Optional[ConanSession] = None) -> 'Reference':
         # FIXME support new conan center convention without user and channel
         reference_regex = re.compile(r'([\w\.\+\-]+)/([\w\.\+\-]+)@([\w\.\+\-]+)/([\w\.\+\-]+)')
-        return cls(*reference_regex.match(ref).group(1, 2, 3, 4))
+        return cls(*reference_regex.match(ref).group(1, 2, 3, 4), session=session)
 
     @property
     def name(self):
@@ -192,11 +765,16 @@ class Reference():
     def channel(self):
         return self._channel
 
+    @property
+    def session(self) -> Optional[ConanSession]:
+        return self._session
+
     def clone(self, name=None, version=None, user=None, channel=None):
         return Reference(name=name or self.name,
                          version=version or self.version,
                          user=user or self.user,
-                         channel=channel or self.channel)
+                         channel=channel or self.channel,
+                         session=self._session)
 
     def __str__(self):
         return "{}/{}@{}/{}".format(self.name, self.version, self.user, self.channel)
@@ -206,41 +784,42 @@ class Reference():
 
     def in_local_cache(self):
         # check if the recipe is known locally
-        result = run(["search", str(self)], check=False)
+        result = run(["search", str(self)], check=False, session=self._session)
         if result.returncode == 0:
             return True
         return False
 
     def in_remote(self, remote):
         # check if the recipe is known on the remote
-        result = run(["search", str(self), "--remote", remote], check=False)
+        result = run(["search", str(self), "--remote", resolve_remote(remote)], check=False,
+                     session=self._session)
         if result.returncode == 0:
             return True
         return False
 
     def get_creation_date(self, remote: Optional[str] = None) -> datetime:
-        json_result = info(str(self), remote)
+        json_result = info(str(self), remote, session=self._session)
         return datetime.strptime(json_result['creation_date'], '%Y-%m-%d %H:%M:%S')
 
     def download_recipe(self, remote=None):
-        remote_args = fmt_arg_list(remote or [], "--remote")
-        run(["download", str(self), "--recipe"] + remote_args)
+        remote_args = fmt_arg_list(resolve_remote(remote) or [], "--remote")
+        run(["download", str(self), "--recipe"] + remote_args, session=self._session)
 
     def install(self, remote=None, profiles=[], build=["outdated"], options={}, cwd=None):
         args = fmt_build_args("install", [str(self)], remote=remote, profiles=profiles,
-                              options=options, build=build)
-        run(args, cwd=cwd)
+                              options=options, build=build, session=self._session)
+        run(args, cwd=cwd, session=self._session)
 
     def set_remote(self, remote):
-        run(["remote", "add_ref", str(self), remote])
+        run(["remote", "add_ref", str(self), remote], session=self._session)
 
     def create_alias(self, name=None, version=None, user=None, channel=None):
         alias_ref = self.clone(name=name, version=version, user=user, channel=channel)
-        run(["alias", str(alias_ref), str(self)])
+        run(["alias", str(alias_ref), str(self)], session=self._session)
         return alias_ref
 
     def upload_all(self, remote):
-        run(["upload", str(self), "--remote", remote, "--all", "-c"])
+        run(["upload", str(self), "--remote", remote, "--all", "-c"], session=self._session)
 
 
 class PkgLayout():
@@ -277,6 +856,21 @@ class RelativePkgLayout(PkgLayout):
         self._build_dir = build_dir
         self._pkg_dir = pkg_dir
 
+    def to_dict(self) -> Dict[str, Optional[str]]:
+        """Returns the constructor arguments, e.g., to recreate the layout in another process."""
+        return {"root": self._root, "offset": self._offset, "src_dir": self._src_dir,
+                "build_dir": self._build_dir, "pkg_dir": self._pkg_dir}
+
+    def with_name(self, name: Optional[str]) -> 'RelativePkgLayout':
+        """Returns an equivalent layout which does not inspect the recipe to get its name.
+
+        Only a layout with explicit root and without offset falls back to the package name.
+        Hence, all other layouts are returned unchanged.
+        """
+        if self._root is None or self._offset is not None or name is None:
+            return self
+        return RelativePkgLayout(**dict(self.to_dict(), offset=name))
+
     def root(self, recipe: 'Recipe') -> str:
         if self._root is None:
             # No root has been defined, use the recipe path directory as root and apply the offset
@@ -339,9 +933,12 @@ class TempPkgLayout(PkgLayout):
 
 class Recipe():
     def __init__(self, path: str, external_source: bool = False,
-                 layout: Optional[PkgLayout] = None, cwd: Optional[str] = None):
+                 layout: Optional[PkgLayout] = None, cwd: Optional[str] = None,
+                 session: Optional[ConanSession] = None):
+        self._session = session
+
         # Make the recipe path absolute.
-        cwd = cwd or os.getcwd()
+        cwd = cwd or (session.cwd if session is not None else None) or os.getcwd()
         if not os.path.isabs(path):
             path = os.path.normpath(os.path.join(cwd, path))
         self._path = path
@@ -360,54 +957,76 @@ class Recipe():
     def external_source(self):
         return self._external_source
 
+    @property
+    def layout(self) -> PkgLayout:
+        return self._layout
+
+    @property
+    def session(self) -> Optional[ConanSession]:
+        return self._session
+
     def get_field(self, field_name: str, default: Any = None):
-        return inspect(self.path, attribute=field_name, default=default)
+        return inspect(self.path, attribute=field_name, default=default, session=self._session)
 
     def reference(self, user: str, channel: str, name=None, version=None):
         name = name or self.get_field("name")
         version = version or self.get_field("version")
-        return Reference(name=name, version=version, user=user, channel=channel)
+        return Reference(name=name, version=version, user=user, channel=channel,
+                         session=self._session)
 
+    @Metrics.timed_stage("export")
     def export(self, user, channel, name=None, version=None):
         ref = self.reference(name=name, version=version, user=user, channel=channel)
-        run(["export", self.path, str(ref)])
+        run(["export", self.path, str(ref)], session=self._session)
         return ref
 
+    @Metrics.timed_stage("create")
     def create(self, user, channel, name=None, version=None, remote=None,
-               profiles=[], options={}, build=["outdated"], cwd=None):
+               profiles=[], options={}, build=["outdated"], cwd=None,
+               cpu_pool: Optional[CpuPool] = None):
         ref = self.reference(name=name, version=version, user=user, channel=channel)
         args = fmt_build_args("create", [self.path, str(ref)], remote=remote, profiles=profiles,
-                              options=options, build=build)
-        run(args, cwd=cwd)
+                              options=options, build=build, session=self._session)
+        if cpu_pool is None:
+            run(args, cwd=cwd, session=self._session)
+            return ref
+        with cpu_pool.acquire() as share:
+            run(args, cwd=cwd, env=CpuPool.env(share), session=self._session)
         return ref
 
     def create_local(self, user, channel, name=None, version=None, remote=None,
                      profiles=[], options={}, build=["outdated"], layout=None,
-                     src_folder=None, build_folder=None, pkg_folder=None, add_script=False):
+                     src_folder=None, build_folder=None, pkg_folder=None, add_script=False,
+                     cpu_pool: Optional[CpuPool] = None):
         self.install(layout=layout, build_folder=build_folder, profiles=profiles, options=options,
                      build=build, remote=remote, add_script=add_script)
         if self.external_source:
             self.source(layout=layout, src_folder=src_folder, build_folder=build_folder,
                         add_script=add_script)
         self.build(layout=layout, src_folder=src_folder, build_folder=build_folder,
-                   pkg_folder=pkg_folder, add_script=add_script)
+                   pkg_folder=pkg_folder, add_script=add_script, cpu_pool=cpu_pool)
         self.package(layout=layout, src_folder=src_folder, build_folder=build_folder,
                      pkg_folder=pkg_folder, add_script=add_script)
         return self.export_pkg(user=user, channel=channel, name=name, version=version,
                                profiles=profiles, options=options, layout=layout,
                                pkg_folder=pkg_folder, add_script=add_script)
 
+    @Metrics.timed_stage("install")
     def install(self, layout=None, build_folder=None, profiles=[], options={}, build=["outdated"],
                 remote=None, add_script=False):
         layout = layout or self._layout
         build_folder = build_folder or layout.build_folder(self)
         args = fmt_build_args("install", [self.path], remote=remote, profiles=profiles,
-                              options=options, build=build)
+                              options=options, build=build, session=self._session)
         if add_script:
-            write_conan_sh_file(layout.root(self), 'install', args, build_folder)
-        run(args, cwd=build_folder)
-
-    def source(self, layout=None, src_folder=None, build_folder=None, add_script=False):
+            write_conan_sh_file(layout.root(self), 'install', args, build_folder,
+                                session=self._session)
+        run(args, cwd=build_folder, session=self._session)
+
+    @Metrics.timed_stage("source")
+    def source(self, layout=None, src_folder=None, build_folder=None, add_script=False,
+               store: Optional['ConanTools.SourceStore.SourceStore'] = None,
+               cancel: Optional[CancellationToken] = None):
         layout = layout or self._layout
         src_folder = src_folder or layout.src_folder(self)
         stamp_file = os.path.join(src_folder, ".ct_source_finished")
@@ -418,13 +1037,24 @@ class Recipe():
         build_folder = build_folder or layout.build_folder(self)
         args = ["source", self.path, "--source-folder=" + src_folder]
         if add_script:
-            write_conan_sh_file(layout.root(self), 'source', args, build_folder)
-        run(args, cwd=build_folder)
+            write_conan_sh_file(layout.root(self), 'source', args, build_folder,
+                                session=self._session)
+        if store is None and os.environ.get("CT_SOURCE_STORE"):
+            from ConanTools.SourceStore import SourceStore
+            store = SourceStore()
+        if store is None:
+            run(args, cwd=build_folder, cancel=cancel, session=self._session)
+        else:
+            # Only fetch the sources when they are not yet available in the shared store.
+            store.populate(self, src_folder, lambda folder: run(
+                ["source", self.path, "--source-folder=" + folder], cwd=build_folder,
+                cancel=cancel, session=self._session))
         # Create the stamp file after successfully executing conan source.
         create_stamp_file(stamp_file)
 
+    @Metrics.timed_stage("build")
     def build(self, layout=None, src_folder=None, build_folder=None, pkg_folder=None,
-              add_script=False):
+              add_script=False, cpu_pool: Optional[CpuPool] = None):
         layout = layout or self._layout
         src_folder = src_folder or layout.src_folder(self)
         build_folder = build_folder or layout.build_folder(self)
@@ -436,21 +1066,48 @@ class Recipe():
             # folder automatically. We have to perform this copy because recipes depend on it.
             copytree(src_folder, build_folder)
         if add_script:
-            write_conan_sh_file(layout.root(self), 'build', args, build_folder)
-        run(args, cwd=build_folder)
+            write_conan_sh_file(layout.root(self), 'build', args, build_folder,
+                                session=self._session)
+        if cpu_pool is None:
+            run(args, cwd=build_folder, session=self._session)
+            return
+        with cpu_pool.acquire() as share:
+            run(args, cwd=build_folder, env=CpuPool.env(share), session=self._session)
 
+    @Metrics.timed_stage("package")
     def package(self, layout=None, src_folder=None, build_folder=None, pkg_folder=None,
-                add_script=False):
+                add_script=False, incremental: Optional[bool] = None):
+        """Executes the package stage of the recipe.
+
+        In incremental mode (enabled via the ``CT_INCREMENTAL_PACKAGE`` environment variable by
+        default), conan packages into a staging folder first. Afterwards, only files whose
+        content changed are copied into the pkg_folder and stale files are deleted. Hence, the
+        timestamps of unchanged files are preserved.
+        """
         layout = layout or self._layout
         src_folder = src_folder or layout.src_folder(self)
         build_folder = build_folder or layout.build_folder(self)
         pkg_folder = pkg_folder or layout.pkg_folder(self)
+        if incremental is None:
+            incremental = ConanTools.env_flag("CT_INCREMENTAL_PACKAGE")
         args = ["package", self.path, "--source-folder=" + src_folder,
                 "--package-folder=" + pkg_folder]
         if add_script:
-            write_conan_sh_file(layout.root(self), 'package', args, build_folder)
-        run(args, cwd=build_folder)
-
+            write_conan_sh_file(layout.root(self), 'package', args, build_folder,
+                                session=self._session)
+        if not incremental:
+            run(args, cwd=build_folder, session=self._session)
+            return
+        out_folder = os.path.join(build_folder, "_ct_package_staging")
+        shutil.rmtree(out_folder, ignore_errors=True)
+        run(args[:-1] + ["--package-folder=" + out_folder], cwd=build_folder,
+            session=self._session)
+        from ConanTools import Manifest
+        Manifest.sync_folder(out_folder, pkg_folder, manifest_path=os.path.join(
+            build_folder, ".ct_package_manifest.json"))
+        shutil.rmtree(out_folder, ignore_errors=True)
+
+    @Metrics.timed_stage("export-pkg")
     def export_pkg(self, user: str, channel: str, name: Optional[str] = None,
                    version: Optional[str] = None, force: bool = True, profiles: List[str] = [],
                    options: Dict[str, str] = {}, layout: Optional[PkgLayout] = None,
@@ -460,33 +1117,135 @@ class Recipe():
         pkg_folder = pkg_folder or layout.pkg_folder(self)
         ref = self.reference(name=name, version=version, user=user, channel=channel)
         args = fmt_build_args("export-pkg", [self.path, str(ref), "--package-folder=" + pkg_folder],
-                              remote=None, profiles=profiles, options=options, build=[])
+                              remote=None, profiles=profiles, options=options, build=[],
+                              session=self._session)
         if force:
             args.append("--force")
         if add_script:
-            write_conan_sh_file(layout.root(self), 'export-pkg', args, cwd)
-        run(args, cwd=cwd)
+            write_conan_sh_file(layout.root(self), 'export-pkg', args, cwd,
+                                session=self._session)
+        run(args, cwd=cwd, session=self._session)
         return ref
 
 
 class Workspace():
-    def __init__(self, recipes: List[Recipe]):
+    def __init__(self, recipes: List[Recipe], session: Optional[ConanSession] = None):
+        """Creates the workspace.
+
+        :param session: Execution context of the workspace-level commands (e.g., conan
+                        workspace install). The stages of the recipes use their own sessions.
+        """
         self._recipes = recipes
+        self._session = session
+
+    @property
+    def recipes(self) -> List[Recipe]:
+        return self._recipes
+
+    @property
+    def session(self) -> Optional[ConanSession]:
+        return self._session
+
+    def references(self, user: str, channel: str,
+                   max_workers: Optional[int] = None) -> List[Reference]:
+        """Queries the references of all recipes concurrently (in recipe order)."""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda x: x.reference(user=user, channel=channel),
+                                     self._recipes))
+
+    def dependencies(self, max_workers: Optional[int] = None) -> Dict[Recipe, List[Recipe]]:
+        """Determines the workspace recipes that each recipe directly depends on.
+
+        The dependencies are deduced from the ``requires`` and ``build_requires`` attributes of
+        the recipes. Requirements which are only added in methods (e.g., ``requirements()``) can
+        not be queried via conan inspect and are, therefore, not considered.
+        """
+        def query(recipe):
+            requires = []
+            for field in ["requires", "build_requires"]:
+                value = recipe.get_field(field) or []
+                if isinstance(value, str):
+                    value = [value]
+                for req in value:
+                    if isinstance(req, (list, tuple)):
+                        req = req[0]
+                    requires.extend(x.split("/")[0].strip() for x in req.split(",") if x.strip())
+            return recipe.get_field("name"), requires
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            queried = list(executor.map(query, self._recipes))
+        by_name = {name: recipe for recipe, (name, _) in zip(self._recipes, queried)}
+        result = {}
+        for recipe, (_, requires) in zip(self._recipes, queried):
+            deps = [by_name[x] for x in requires if x in by_name and by_name[x] is not recipe]
+            result[recipe] = list(OrderedDict.fromkeys(deps))
+        return result
+
+    def graph_dependencies(self, refs: List[Reference], profiles: List[str] = [],
+                           options: Dict[str, str] = {}, remote: Optional[str] = None,
+                           max_workers: Optional[int] = None) -> Dict[Recipe, List[Recipe]]:
+        """Determines the workspace recipes that each recipe depends on via the conan graph.
+
+        Unlike :meth:`dependencies`, this also considers requirements that are added in methods
+        (e.g., ``requirements()``) or depend on the configuration. All recipes are exported first
+        such that conan info can resolve the workspace packages that have not been created yet.
+        The graphs are resolved concurrently and the result contains the transitive dependencies.
+
+        :param refs: The references of the recipes (see :meth:`references`).
+        """
+        def query(item):
+            recipe, ref = item
+            names = set()
+            for node in graph(recipe.path, remote=remote, profiles=profiles, options=options,
+                              session=recipe.session):
+                if node.get("is_ref", True) and node.get("reference"):
+                    names.add(node["reference"].split("/")[0])
+                names.update(x.split("/")[0] for x in node.get("build_requires", []))
+            return names
+
+        items = list(zip(self._recipes, refs))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda x: x[0].export(x[1].user, x[1].channel, name=x[1].name,
+                                                    version=x[1].version), items))
+            queried = list(executor.map(query, items))
+        by_name = {ref.name: recipe for recipe, ref in items}
+        result = {}
+        for recipe, names in zip(self._recipes, queried):
+            result[recipe] = [x for x in self._recipes if x is not recipe and
+                              any(by_name.get(name) is x for name in names)]
+        return result
 
-    def references(self, user: str, channel: str):
-        return [recipe.reference(user=user, channel=channel) for recipe in self._recipes]
+    def _resolve(self, user: str, channel: str, max_workers: Optional[int] = None):
+        """Queries the reference and the layout folders of all recipes concurrently.
+
+        Each recipe is inspected only once (i.e., all fields are fetched with a single conan
+        invocation) and the results are returned in recipe order as
+        (recipe, reference, build_folder, src_folder) tuples.
+        """
+        def resolve(recipe):
+            fields = inspect(recipe.path, session=recipe.session)
+            ref = recipe.reference(user, channel, name=fields.get("name"),
+                                   version=fields.get("version"))
+            layout = recipe.layout
+            if isinstance(layout, RelativePkgLayout):
+                # Reuse the inspected name instead of querying it again for every folder.
+                layout = layout.with_name(fields.get("name"))
+            return (recipe, ref, layout.build_folder(recipe), layout.src_folder(recipe))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(resolve, self._recipes))
 
     def install(self, user: str, channel: str, ws_build_folder: Optional[str] = None,
                 profiles: List[str] = [], options: Dict[str, str] = {},
                 build: List[Optional[str]] = ["outdated"], remote: Optional[str] = None,
-                add_script: bool = False):
+                add_script: bool = False, max_workers: Optional[int] = None):
+        import configparser
+        resolved = self._resolve(user, channel, max_workers=max_workers)
         config = configparser.ConfigParser(allow_no_value=True)
         config.optionxform = str
-        for recipe in self._recipes:
-                ref = recipe.reference(user, channel)
-                layout = recipe._layout  # FIXME add accessor
-                config["{}:build_folder".format(ref)] = {layout.build_folder(recipe): None}
-                config["{}:source_folder".format(ref)] = {layout.src_folder(recipe): None}
+        for recipe, ref, build_folder, src_folder in resolved:
+            config["{}:build_folder".format(ref)] = {build_folder: None}
+            config["{}:source_folder".format(ref)] = {src_folder: None}
 
         ws_build_folder = ws_build_folder or os.getcwd()
         os.makedirs(ws_build_folder, exist_ok=True)
@@ -497,67 +1256,235 @@ class Workspace():
         ws_file = os.path.join(ws_build_folder, "ws.yml")
         with open(ws_file, 'w') as f:
             f.write("editables:\n")
-            for recipe in self._recipes:
-                f.write("    {}:\n".format(recipe.reference(user, channel)))
+            for recipe, ref, _, _ in resolved:
+                f.write("    {}:\n".format(ref))
                 f.write("        path: {}\n".format(os.path.dirname(recipe.path)))
             f.write("layout: layout.txt\n")
             # f.write("workspace_generator: cmake\n")
             f.write("root:\n")
-            for recipe in self._recipes:
-                f.write("  - {}\n".format(recipe.reference(user, channel)))
+            for _, ref, _, _ in resolved:
+                f.write("  - {}\n".format(ref))
 
         args = ["workspace"]
         args += fmt_build_args("install", [ws_file], remote=remote, profiles=profiles,
-                               options=options, build=build)
+                               options=options, build=build, session=self._session)
         if add_script:
-            write_conan_sh_file(ws_build_folder, 'ws-install', args, ws_build_folder)
-        run(args, cwd=ws_build_folder)
-
-    def source(self, add_script: bool = False):
+            write_conan_sh_file(ws_build_folder, 'ws-install', args, ws_build_folder,
+                                session=self._session)
+        run(args, cwd=ws_build_folder, session=self._session)
+
+    def outdated(self, base: Optional[str] = None, state_file: Optional[str] = None,
+                 config: Optional[str] = None) -> List[Recipe]:
+        """Determines the recipes that changed since the base revision and their dependents.
+
+        A recipe is considered changed when git reports a modified or untracked file inside the
+        directory of the recipe. Without explicit base, the state recorded in the state_file
+        (see :meth:`record_state`) is used instead. Then, a recipe is only considered changed
+        when the content of its modified and untracked files differs from the recorded one.
+        Recipes for which no base revision is known, or that are not inside a git repository,
+        are always considered outdated. The same holds for all recipes when the recorded build
+        configuration differs from config.
+
+        :param config: Fingerprint of the build configuration (see :func:`build_config`).
+        """
+        from ConanTools import Git
+        state = {}
+        if base is None and state_file is not None and os.path.isfile(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+            if config is not None and state.get("config") != config:
+                state = {}
+
+        changed_cache = {}
+        outdated = set()
         for recipe in self._recipes:
-            if recipe.external_source:
-                recipe.source(add_script=add_script)
+            # git reports symlink-resolved paths. Hence, the recipe directory is resolved too.
+            recipe_dir = os.path.realpath(os.path.dirname(recipe.path))
+            top = Git.toplevel(recipe_dir)
+            rev = base or state.get("revisions", {}).get(top)
+            if top is None or rev is None:
+                outdated.add(recipe)
+                continue
+            if (top, rev) not in changed_cache:
+                changed_cache[(top, rev)] = Git.changed_files(rev, cwd=top)
+            changed = changed_cache[(top, rev)]
+            if changed is None:
+                outdated.add(recipe)
+                continue
+            changed = [x for x in changed if x.startswith(recipe_dir + os.sep)]
+            if base is not None:
+                if changed:
+                    outdated.add(recipe)
+            elif _files_digest(recipe_dir, changed) != state.get("dirty", {}).get(recipe.path):
+                outdated.add(recipe)
+
+        # Everything that (transitively) depends on an outdated recipe is outdated too.
+        if outdated:
+            deps = self.dependencies()
+            modified = True
+            while modified:
+                modified = False
+                for recipe in self._recipes:
+                    if recipe not in outdated and any(x in outdated for x in deps[recipe]):
+                        outdated.add(recipe)
+                        modified = True
+        return [x for x in self._recipes if x in outdated]
+
+    def record_state(self, state_file: str, config: Optional[str] = None):
+        """Stores the current state of the repositories which contain the recipes.
+
+        The state consists of the revisions of the repositories, the content of the modified
+        and untracked files in the recipe directories, and the build configuration.
+
+        :param config: Fingerprint of the build configuration (see :func:`build_config`).
+        """
+        from ConanTools import Git
+        revisions = {}
+        dirty = {}
+        for recipe in self._recipes:
+            recipe_dir = os.path.realpath(os.path.dirname(recipe.path))
+            top = Git.toplevel(recipe_dir)
+            if top is None:
+                continue
+            if top not in revisions:
+                revisions[top] = Git.revision(cwd=top)
+            changed = Git.changed_files(revisions[top], cwd=top) if revisions[top] else None
+            if changed is not None:
+                dirty[recipe.path] = _files_digest(
+                    recipe_dir, [x for x in changed if x.startswith(recipe_dir + os.sep)])
+        state = {"config": config, "revisions": revisions, "dirty": dirty}
+        with open(state_file, 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+
+    def source(self, add_script: bool = False, max_workers: Optional[int] = None):
+        """Fetches the sources of all recipes with external sources concurrently.
+
+        The first failing fetch aborts all others. Since the stamp file of a recipe is only
+        created after its source step succeeded, aborted recipes are fetched again next time.
+
+        :param max_workers: Maximum number of concurrent fetches. (None -> ``CT_SOURCE_JOBS``
+                            or the ThreadPoolExecutor default)
+        """
+        if max_workers is None and os.environ.get("CT_SOURCE_JOBS"):
+            max_workers = int(os.environ["CT_SOURCE_JOBS"])
+        recipes = [x for x in self._recipes if x.external_source]
+        if len(recipes) == 0:
+            return
+        cancel = CancellationToken()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(x.source, add_script=add_script, cancel=cancel)
+                       for x in recipes]
+            errors = [x.exception() for x in futures]
+        # Prefer the error of the failing command over the ones of the aborted commands.
+        errors = [x for x in errors if x is not None]
+        if errors:
+            raise next((x for x in errors if not isinstance(x, CommandAborted)), errors[0])
 
     def create_local(self, user: str, channel: str, ws_build_folder: Optional[str] = None,
                      profiles: List[str] = [], options: Dict[str, str] = {},
                      build: List[Optional[str]] = ["outdated"], remote: Optional[str] = None,
                      pkg_folder: Optional[str] = None, pkg_folder_override: Dict[Recipe, str] = {},
-                     add_script: bool = False):
+                     add_script: bool = False, incremental: bool = False,
+                     base: Optional[str] = None, cpu_pool: Optional[CpuPool] = None):
+        """Builds all recipes of the workspace using the local flow.
+
+        In incremental mode, only the recipes that changed since the base revision (or since the
+        last successful build in the ws_build_folder) and their dependents are rebuilt. All other
+        recipes reuse their existing pkg_folder output.
+
+        :param cpu_pool: Shares the cores with builds that run concurrently (e.g., of other
+                         workspaces or configurations).
+        """
+        ws_build_folder = ws_build_folder or os.getcwd()
+        state_file = os.path.join(ws_build_folder, ".ct_build_state.json")
+        config = build_config(profiles, options, user, channel, session=self._session)
+        rebuild = self.outdated(base, state_file, config) if incremental else self._recipes
         self.install(user, channel, ws_build_folder=ws_build_folder, profiles=profiles,
                      options=options, build=build, remote=remote, add_script=add_script)
         self.source(add_script=add_script)
         # FIXME extract dependency information for correct build ordering
         for recipe in self._recipes:
             recipe_pkg_folder = pkg_folder_override.get(recipe, pkg_folder)
-            recipe.build(pkg_folder=recipe_pkg_folder, add_script=add_script)
+            if recipe not in rebuild and \
+                    os.path.isdir(recipe_pkg_folder or recipe.layout.pkg_folder(recipe)):
+                continue
+            recipe.build(pkg_folder=recipe_pkg_folder, add_script=add_script, cpu_pool=cpu_pool)
             recipe.package(pkg_folder=recipe_pkg_folder, add_script=add_script)
             if recipe_pkg_folder is None:
                 recipe.export_pkg(user=user, channel=channel, profiles=profiles,
                                   options=options, add_script=add_script)
+        self.record_state(state_file, config)
 
 
-def search(pattern: str = "*", remote: Optional[str] = None) -> List[Reference]:
-    json_result = _run_json(["search", pattern] + fmt_arg_list(remote or [], "--remote"))
+def search(pattern: str = "*", remote: Optional[str] = None,
+           session: Optional[ConanSession] = None) -> List[Reference]:
+    remote = resolve_remote(remote)
+    json_result = _run_json(["search", pattern] + fmt_arg_list(remote or [], "--remote"),
+                            session=session)
     # FIXME check the json_result['error'] field
     # FIXME support multiple remotes
     assert len(json_result['results']) == 1
     assert json_result['results'][0]['remote'] == remote
-    return [Reference.from_string(x['recipe']['id']) for x in json_result['results'][0]['items']]
+    return [Reference.from_string(x['recipe']['id'], session=session)
+            for x in json_result['results'][0]['items']]
 
 
-def info(path_or_ref: str, remote: Optional[str] = None):
+def iter_search(pattern: str = "*", remote: Optional[str] = None,
+                session: Optional[ConanSession] = None) -> Iterator[Reference]:
+    """Like :func:`search` but parses the result incrementally and yields one reference at a time.
+
+    The memory usage is, therefore, independent of the number of found references.
+    """
+    remote = resolve_remote(remote)
+    args = ["search", pattern] + fmt_arg_list(remote or [], "--remote")
+    with _json_output(args, session=session) as f:
+        reader = _JsonReader(f)
+        for key in reader.keys():
+            if key != "results":
+                reader.value()
+                continue
+            for _ in reader.items():
+                for key in reader.keys():
+                    if key == "remote":
+                        assert reader.value() == remote
+                    elif key == "items":
+                        for _ in reader.items():
+                            yield Reference.from_string(reader.value()['recipe']['id'],
+                                                        session=session)
+                    else:
+                        reader.value()
+
+
+def iter_info(path_or_ref: str, remote: Optional[str] = None, profiles: List[str] = [],
+              options: Dict[str, str] = {},
+              session: Optional[ConanSession] = None) -> Iterator[dict]:
+    """Like :func:`graph` but parses the result incrementally and yields one node at a time."""
+    args = fmt_build_args("info", [path_or_ref], remote=remote, profiles=profiles, build=[],
+                          options=options, session=session)
+    with _json_output(args, session=session) as f:
+        reader = _JsonReader(f)
+        for _ in reader.items():
+            yield reader.value()
+
+
+def info(path_or_ref: str, remote: Optional[str] = None,
+         session: Optional[ConanSession] = None):
     # NOTE: Conan implicitely downloads the recipe if it is not available locally.
-    json_result = _run_json(["info", path_or_ref] + fmt_arg_list(remote or [], "--remote"))
+    remote = resolve_remote(remote)
+    json_result = _run_json(["info", path_or_ref] + fmt_arg_list(remote or [], "--remote"),
+                            session=session)
     assert len(json_result) == 1
     return json_result[0]
 
 
 def inspect(path_or_ref: str, attribute: Optional[str] = None,
             default: Any = None,
-            remote: Optional[str] = None) -> Union[dict, Any]:
+            remote: Optional[str] = None,
+            session: Optional[ConanSession] = None) -> Union[dict, Any]:
     json_result = _run_json(["inspect", path_or_ref] +
                             fmt_arg_list(attribute or [], "--attribute") +
-                            fmt_arg_list(remote or [], "--remote"))
+                            fmt_arg_list(resolve_remote(remote) or [], "--remote"),
+                            session=session)
     if attribute:
         # conan returns an empty string if the attribute is not defined.
         # We replace this sentinel with the user defined default value.
@@ -566,3 +1493,167 @@ def inspect(path_or_ref: str, attribute: Optional[str] = None,
             return default
         return res
     return json_result
+
+
+def graph(path_or_ref: str, remote: Optional[str] = None, profiles: List[str] = [],
+          options: Dict[str, str] = {}, session: Optional[ConanSession] = None) -> List[dict]:
+    """Resolves the dependency graph for the profiles and returns the nodes from conan info."""
+    args = fmt_build_args("info", [path_or_ref], remote=remote, profiles=profiles, build=[],
+                          options=options, session=session)
+    return _run_json(args, session=session)
+
+
+def _configuration_key(profiles: List[str], options: Dict[str, str],
+                       session: Optional[ConanSession] = None) -> tuple:
+    # Profiles are compared by their flattened content to detect equivalent configurations
+    # that are spelled differently (e.g., different include chains).
+    from ConanTools import Profile
+    paths = [Profile.resolve_path(x, session=session) for x in profiles]
+    if None in paths:
+        profile_key = tuple(profiles)
+    else:
+        profile = Profile.Profile()
+        for path in paths:
+            profile.merge(Profile.Profile.load(path, session=session))
+        profile_key = profile.digest()
+    return (profile_key, tuple(sorted(options.items())))
+
+
+def build_config(profiles: List[str], options: Dict[str, str], user: str, channel: str,
+                 session: Optional[ConanSession] = None) -> str:
+    """Returns a fingerprint of the build configuration for :meth:`Workspace.record_state`."""
+    key = _configuration_key(profiles, options, session=session) + (user, channel)
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def _files_digest(folder: str, paths: List[str]) -> str:
+    # Hashes the names and contents of the files. Deleted files only contribute their name.
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        h.update(os.path.relpath(path, folder).encode() + b"\0")
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+        except OSError:
+            h.update(b"\0missing")
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def package_ids(path_or_ref: str, configurations: List[Tuple[List[str], Dict[str, str]]],
+                remote: Optional[str] = None, max_workers: Optional[int] = None,
+                session: Optional[ConanSession] = None) -> List[str]:
+    """Computes the package id of the root package for every configuration.
+
+    Equivalent configurations are resolved only once and the remaining conan info calls are
+    executed in parallel.
+
+    :param configurations: List of (profiles, options) tuples.
+    :returns: The package ids in the order of the configurations.
+    """
+    remote = resolve_remote(remote)
+    keys = [_configuration_key(profiles, options, session=session)
+            for profiles, options in configurations]
+    unique = OrderedDict()
+    for key, config in zip(keys, configurations):
+        unique.setdefault(key, config)
+
+    def package_id(config):
+        profiles, options = config
+        args = fmt_build_args("info", [path_or_ref, "--only", "id"], remote=remote,
+                              profiles=profiles, build=[], options=options, lockfile=False,
+                              session=session)
+        for node in _run_json(args, session=session):
+            if not node.get("is_ref", True) or node.get("reference") == str(path_or_ref):
+                return node["id"]
+        raise ValueError("Package id of {} could not be determined!".format(path_or_ref))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        ids = dict(zip(unique.keys(), executor.map(package_id, unique.values())))
+    return [ids[key] for key in keys]
+
+
+def group_by_package_id(path_or_ref: str,
+                        configurations: List[Tuple[List[str], Dict[str, str]]],
+                        remote: Optional[str] = None,
+                        max_workers: Optional[int] = None,
+                        session: Optional[ConanSession] = None) -> Dict[str, List[int]]:
+    """Groups the configurations that result in the same binary package.
+
+    :returns: The indices of the configurations for each package id (in order of appearance).
+    """
+    groups = OrderedDict()
+    ids = package_ids(path_or_ref, configurations, remote=remote, max_workers=max_workers,
+                      session=session)
+    for index, package_id in enumerate(ids):
+        groups.setdefault(package_id, []).append(index)
+    return groups
+
+
+# Binary states of conan info nodes that can be downloaded from a remote.
+_DOWNLOADABLE_BINARIES = ("Download", "Update")
+
+
+def prefetch(refs: List[Union[Reference, str]] = [], nodes: List[dict] = [],
+             remote: Optional[str] = None, profiles: Optional[List[str]] = None,
+             options: Dict[str, str] = {}, max_workers: Optional[int] = None,
+             cancel: Optional[CancellationToken] = None,
+             session: Optional[ConanSession] = None) -> List[str]:
+    """Downloads recipes and binaries concurrently into the local cache.
+
+    Without profiles, only the recipes of the references are downloaded. With profiles, the
+    graphs of all references are resolved (in parallel) which already fetches the recipes. Then,
+    the binaries of all nodes, as determined by their package ids, are downloaded. Alternatively,
+    already known graph nodes (e.g., from :func:`graph`) can be passed directly. A following
+    install can then resolve everything from the local cache.
+
+    Nodes whose binary is already in the cache or is not available at all (e.g., ``Missing`` or
+    ``Build``) are skipped. Binaries that fail to download are tolerated. Both are reported as
+    misses to the log sink of the session, the install then has to build them.
+
+    :param cancel: Optional token to abort the remaining downloads when one of them fails.
+    :returns: The downloaded targets (i.e., references optionally followed by ":package_id").
+    """
+    nodes = list(nodes)
+    remote = resolve_remote(remote)
+    targets = OrderedDict()
+    misses = OrderedDict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if profiles is None:
+            for ref in refs:
+                targets[str(ref)] = None
+        else:
+            for result in executor.map(lambda x: graph(str(x), remote=remote, profiles=profiles,
+                                                       options=options, session=session), refs):
+                nodes.extend(result)
+        for node in nodes:
+            # Skip the root node when a conanfile has been inspected instead of a reference.
+            if not node.get("is_ref", True) or not node.get("reference"):
+                continue
+            target = node["reference"]
+            if node.get("id"):
+                target += ":" + node["id"]
+            binary = node.get("binary")
+            if binary == "Cache":
+                continue
+            if binary is not None and binary not in _DOWNLOADABLE_BINARIES:
+                misses[target] = binary
+                continue
+            targets[target] = None
+
+        def download(target):
+            ref, _, package_id = target.partition(":")
+            args = ["download", ref] + (["--package", package_id] if package_id else ["--recipe"])
+            # Binaries might not exist on the remote, recipes are required.
+            result = run(args + fmt_arg_list(remote or [], "--remote"), cancel=cancel,
+                         session=session, check=not package_id)
+            return result.returncode == 0
+
+        for target, ok in zip(targets, executor.map(download, targets)):
+            if not ok:
+                misses[target] = "failed"
+    if misses:
+        log("Prefetching skipped {} binaries: {}".format(len(misses), ", ".join(
+            "{} ({})".format(k, v) for k, v in misses.items())), session=session)
+    return [x for x in targets.keys() if x not in misses]
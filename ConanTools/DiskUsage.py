@@ -0,0 +1,190 @@
+"""Support module for analyzing the disk usage of package layouts and the local conan cache.
+
+The :class:`Scanner` walks several folders at once with a thread pool where every ``os.scandir``
+call is a separate task. Hardlinked files are counted only once across the whole scan. Their
+size is attributed to the first of the analyzed folders (in the order in which the folders are
+passed, e.g., the order of the recipes in a workspace) that contains the file. Nested folders that
+are analyzed on their own (e.g., the ``_build`` folder inside of the recipe folder) are excluded
+from the enclosing folder. All sizes are apparent file sizes in bytes.
+"""
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+from typing import Dict, Hashable, List, Optional, Set, Tuple, Union
+
+from ConanTools import Conan
+
+STAGES = ("source", "build", "package")
+
+
+class Scanner():
+    def __init__(self, max_workers: Optional[int] = None):
+        """Creates the scanner.
+
+        :param max_workers: Number of concurrent scandir calls. (None -> 4 per CPU, at most 32)
+        """
+        self._max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        self._inodes = set()
+
+    def _scan_dir(self, folder: str, exclude: Set[str]) -> Tuple[int, List[str], Dict[tuple, int]]:
+        size = 0
+        subdirs = []
+        links = {}
+        try:
+            it = os.scandir(folder)
+        except OSError:
+            return 0, [], {}
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in exclude:
+                            subdirs.append(entry.path)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if st.st_nlink > 1:
+                    # Hardlinks are attributed after the scan to be independent of the timing.
+                    links[(st.st_dev, st.st_ino)] = st.st_size
+                    continue
+                size += st.st_size
+        return size, subdirs, links
+
+    def scan(self, folders: Dict[Hashable, str]) -> Dict[Hashable, int]:
+        """Determines the size of all folders in parallel.
+
+        Hardlinks that have already been counted by previous scans of this scanner are skipped.
+        Missing folders have a size of zero.
+
+        :param folders: Maps arbitrary keys to the analyzed folders.
+        :returns: The size of the folder for every key.
+        """
+        roots = {key: os.path.abspath(path) for key, path in folders.items()}
+        order = {key: index for index, key in enumerate(roots)}
+        exclude = set(roots.values())
+        sizes = {key: 0 for key in roots}
+        # Maps the hardlinked inodes to their size and the first key that contains them.
+        owners = {}
+        seen = set()
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            pending = {}
+            for key, root in roots.items():
+                # The same folder might be analyzed under several keys. Count it only once.
+                if root in seen:
+                    continue
+                seen.add(root)
+                pending[executor.submit(self._scan_dir, root, exclude)] = key
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    size, subdirs, links = future.result()
+                    sizes[key] += size
+                    for inode, link_size in links.items():
+                        if inode not in owners or order[key] < order[owners[inode][0]]:
+                            owners[inode] = (key, link_size)
+                    for subdir in subdirs:
+                        pending[executor.submit(self._scan_dir, subdir, exclude)] = key
+        for inode, (key, size) in owners.items():
+            if inode not in self._inodes:
+                self._inodes.add(inode)
+                sizes[key] += size
+        return sizes
+
+
+def _nest(sizes: Dict[Tuple[str, str], int]) -> Dict[str, Dict[str, int]]:
+    result = {}
+    for (name, part), size in sizes.items():
+        result.setdefault(name, {})[part] = size
+    return result
+
+
+def layout_usage(recipes: List[Conan.Recipe], layout: Optional[Conan.PkgLayout] = None,
+                 max_workers: Optional[int] = None) -> Dict[str, Dict[str, int]]:
+    """Determines the disk usage of the source, build, and package folder of every recipe.
+
+    Hardlinks shared by several recipes are attributed to the first of them.
+
+    :param layout: The analyzed layout. (None -> the layout of each recipe)
+    :returns: Maps the recipe names to the sizes of the stages (see :data:`STAGES`).
+    """
+    def resolve(recipe):
+        # Each recipe is inspected only once, the layout reuses the name for its folders.
+        name = recipe.get_field("name")
+        pkg_layout = layout or recipe.layout
+        if isinstance(pkg_layout, Conan.RelativePkgLayout):
+            pkg_layout = pkg_layout.with_name(name)
+        return name, [pkg_layout.src_folder(recipe), pkg_layout.build_folder(recipe),
+                      pkg_layout.pkg_folder(recipe)]
+
+    folders = OrderedDict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for name, paths in executor.map(resolve, recipes):
+            for stage, path in zip(STAGES, paths):
+                folders[(name, stage)] = path
+    return _nest(Scanner(max_workers).scan(folders))
+
+
+def cache_usage(storage: Optional[str] = None, max_workers: Optional[int] = None,
+                session: Optional[Conan.ConanSession] = None) -> Dict[str, Dict[str, int]]:
+    """Determines the disk usage of every reference in the local cache.
+
+    The size of each reference is split into its cache folders (e.g., export, export_source,
+    source, build, and package). Files directly in the reference folder are reported as
+    ``metadata``.
+
+    :param storage: The storage folder of the cache. (None -> queried via conan)
+    :returns: Maps the references to the sizes of the cache folders.
+    """
+    from ConanTools import Cache
+    storage = storage or Cache.storage_path(session)
+    folders = {}
+    for ref in Cache.list_references(storage):
+        path = os.path.join(storage, ref.name, ref.version, ref.user, ref.channel)
+        folders[(str(ref), "metadata")] = path
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    folders[(str(ref), entry.name)] = entry.path
+    return _nest(Scanner(max_workers).scan(folders))
+
+
+def analyze(target: Union[Conan.PkgLayout, Conan.Workspace, str],
+            recipes: Optional[List[Conan.Recipe]] = None, max_workers: Optional[int] = None,
+            session: Optional[Conan.ConanSession] = None) -> Dict[str, Dict[str, int]]:
+    """Determines the disk usage of a package layout, a workspace, or the local conan cache.
+
+    :param target: A layout (requires recipes), a workspace, or the storage folder of the cache.
+    :param recipes: The recipes that are analyzed with the layout.
+    """
+    if isinstance(target, Conan.Workspace):
+        return layout_usage(target.recipes, max_workers=max_workers)
+    if isinstance(target, Conan.PkgLayout):
+        if recipes is None:
+            raise ValueError("Analyzing a layout requires the recipes!")
+        return layout_usage(recipes, layout=target, max_workers=max_workers)
+    return cache_usage(target, max_workers=max_workers, session=session)
+
+
+def totals(usage: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+    """Sums up the sizes per part (e.g., stage or cache folder) over all entries."""
+    result = {}
+    for parts in usage.values():
+        for part, size in parts.items():
+            result[part] = result.get(part, 0) + size
+    return result
+
+
+def format_report(usage: Dict[str, Dict[str, int]]) -> str:
+    """Formats the usage as table with the largest entries first."""
+    sums = totals(usage)
+    # Stages are listed in their natural order followed by the other parts (e.g., cache folders).
+    parts = [x for x in STAGES if x in sums] + sorted(x for x in sums if x not in STAGES)
+    lines = ["".join("{:>14}".format(x) for x in parts + ["total"]) + "  name"]
+    for name, sizes in sorted(usage.items(), key=lambda x: (-sum(x[1].values()), x[0])):
+        row = [sizes.get(x, 0) for x in parts] + [sum(sizes.values())]
+        lines.append("".join("{:>14}".format(x) for x in row) + "  " + name)
+    row = [sums[x] for x in parts] + [sum(sums.values())]
+    lines.append("".join("{:>14}".format(x) for x in row) + "  total")
+    return "\n".join(lines)
@@ -73,3 +73,36 @@ def tag(cwd: Optional[str] = None) -> Optional[str]:
     if res.returncode == 0:
         return res.stdout.strip()
     return None
+
+
+def toplevel(cwd: Optional[str] = None) -> Optional[str]:
+    res = run(["git", "rev-parse", "--show-toplevel"],
+              stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL, universal_newlines=True, cwd=cwd)
+    if res.returncode == 0:
+        return os.path.normpath(res.stdout.strip())
+    return None
+
+
+def changed_files(base: str, cwd: Optional[str] = None) -> Optional[List[str]]:
+    """Lists the files that differ between the base revision and the working tree.
+
+    Untracked (but not ignored) files are considered as changed too.
+
+    :param base: The revision to compare against.
+    :param cwd: A directory inside the repository. (None -> current dir)
+    :returns: The absolute paths of the changed files or None if the comparison failed.
+    """
+    top = toplevel(cwd)
+    if top is None:
+        return None
+    # NUL-separated output keeps unusual file names (e.g., with quotes or newlines) intact.
+    diff = run(["git", "diff", "--name-only", "--no-renames", "-z", base, "--"],
+               stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL, universal_newlines=True, cwd=top)
+    if diff.returncode != 0:
+        return None
+    untracked = run(["git", "ls-files", "--others", "--exclude-standard", "-z"],
+                    stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL, universal_newlines=True, cwd=top)
+    if untracked.returncode != 0:
+        return None
+    names = diff.stdout.split("\0") + untracked.stdout.split("\0")
+    return [os.path.normpath(os.path.join(top, x)) for x in names if x != ""]
@@ -0,0 +1,308 @@
+"""Support module for distributing the builds of a workspace across worker processes.
+
+A :class:`Coordinator` hands out the recipes of a :class:`ConanTools.Conan.Workspace` whose
+dependencies have already been built to registered workers and collects the results including
+the captured logs. Workers execute the build, package, and (if no pkg_folder is given) export-pkg
+stage of a recipe and may run on other hosts as long as they share the file system with the
+coordinator. Jobs of workers that disconnect (e.g., because they died), stop sending heartbeats
+(e.g., because they hang), or exceed the optional job timeout are handed out again.
+
+The protocol consists of newline-delimited JSON messages over TCP. A worker registers itself and
+then repeatedly requests a job and reports its result until it receives a shutdown message.
+While executing a job, the worker sends heartbeats in the interval requested by the job.
+Workers can be started via ``python3 -m ConanTools.JobServer HOST:PORT``.
+
+Note that the install and source steps of the workspace (see
+:meth:`ConanTools.Conan.Workspace.install` and :meth:`ConanTools.Conan.Workspace.source`) have to
+be executed before the coordinator is started.
+"""
+import argparse
+from collections import OrderedDict
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+from ConanTools import Conan
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+def _send(wfile, msg: dict):
+    wfile.write((json.dumps(msg) + "\n").encode())
+    wfile.flush()
+
+
+def _recv(rfile) -> Optional[dict]:
+    line = rfile.readline()
+    if not line:
+        return None
+    return json.loads(line.decode())
+
+
+class _Job():
+    def __init__(self, recipe: Conan.Recipe, payload: dict):
+        self.recipe = recipe
+        self.payload = payload
+        self.deps = []
+        self.state = PENDING
+        self.attempts = 0
+        self.worker = None
+        self.log = ""
+        self.deadline = None
+
+    def result(self) -> dict:
+        return {"state": self.state, "attempts": self.attempts, "worker": self.worker,
+                "log": self.log}
+
+
+class Coordinator():
+    def __init__(self, ws: Conan.Workspace, user: str, channel: str, profiles: List[str] = [],
+                 options: Dict[str, str] = {}, pkg_folder: Optional[str] = None,
+                 pkg_folder_override: Dict[Conan.Recipe, str] = {},
+                 address: Tuple[str, int] = ("127.0.0.1", 0), max_attempts: int = 3,
+                 heartbeat_timeout: Optional[float] = 60.0, job_timeout: Optional[float] = None):
+        """Creates the jobs for the workspace and opens the server socket.
+
+        :param ws: The workspace whose recipes should be built.
+        :param address: Host and port the server listens on. (port 0 -> any free port)
+        :param max_attempts: How often a job is handed out before it is considered failed when
+                             the workers executing it disconnect or time out.
+        :param heartbeat_timeout: Number of seconds without message after which a worker that
+                                  executes a job is considered dead. (None -> wait forever)
+        :param job_timeout: Number of seconds a worker may spend on a job. (None -> no limit)
+        """
+        self._max_attempts = max_attempts
+        self._heartbeat_timeout = heartbeat_timeout
+        self._job_timeout = job_timeout
+        self._jobs = OrderedDict()
+        for recipe in ws.recipes:
+            if not isinstance(recipe.layout, Conan.RelativePkgLayout):
+                raise ValueError("Only RelativePkgLayouts can be shared with workers!")
+            self._jobs[recipe] = _Job(recipe, {
+                "type": "job", "id": len(self._jobs), "recipe": recipe.path,
+                "external_source": recipe.external_source, "layout": recipe.layout.to_dict(),
+                "user": user, "channel": channel, "profiles": profiles, "options": options,
+                "pkg_folder": pkg_folder_override.get(recipe, pkg_folder),
+                "heartbeat": heartbeat_timeout / 4 if heartbeat_timeout else None})
+        for recipe, deps in ws.dependencies().items():
+            self._jobs[recipe].deps = [self._jobs[x] for x in deps]
+
+        self._cond = threading.Condition()
+        self._stopped = False
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                coordinator._serve(self.rfile, self.wfile, self.connection)
+
+        self._server = socketserver.ThreadingTCPServer(address, Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def _finished(self) -> bool:
+        return all(job.state in (DONE, FAILED, SKIPPED) for job in self._jobs.values())
+
+    def _next_job(self, worker: Optional[str]) -> Optional[_Job]:
+        with self._cond:
+            while not self._stopped and not self._finished():
+                for job in self._jobs.values():
+                    if job.state == PENDING and all(x.state == DONE for x in job.deps):
+                        job.state = RUNNING
+                        job.attempts += 1
+                        job.worker = worker
+                        if self._job_timeout is not None:
+                            job.deadline = time.monotonic() + self._job_timeout
+                        return job
+                self._cond.wait()
+            return None
+
+    def _set_state(self, job: _Job, state: str, log: str):
+        with self._cond:
+            job.state = state
+            job.log = log
+            if state == FAILED:
+                # Skip everything that (transitively) depends on the failed job.
+                changed = True
+                while changed:
+                    changed = False
+                    for x in self._jobs.values():
+                        if x.state == PENDING and any(d.state in (FAILED, SKIPPED) for d in x.deps):
+                            x.state = SKIPPED
+                            changed = True
+            self._cond.notify_all()
+
+    def _requeue(self, job: _Job):
+        with self._cond:
+            if job.state != RUNNING:
+                return
+            if job.attempts >= self._max_attempts:
+                self._set_state(job, FAILED, "Worker {} disconnected or timed out {} times!".format(
+                    job.worker, job.attempts))
+            else:
+                self._set_state(job, PENDING, "")
+
+    def _timeout(self, job: Optional[_Job]) -> Optional[float]:
+        # Idle workers are not expected to send anything while they wait for the next job.
+        if job is None:
+            return None
+        timeout = self._heartbeat_timeout
+        if job.deadline is not None:
+            remaining = max(0.01, job.deadline - time.monotonic())
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    def _serve(self, rfile, wfile, connection: Optional[socket.socket] = None):
+        worker = None
+        job = None
+        try:
+            while True:
+                if connection is not None:
+                    # Raises socket.timeout (an OSError) which requeues the job.
+                    connection.settimeout(self._timeout(job))
+                msg = _recv(rfile)
+                if msg is None:
+                    break
+                if msg["type"] == "heartbeat":
+                    continue
+                if msg["type"] == "register":
+                    worker = msg.get("name")
+                elif msg["type"] == "request":
+                    job = self._next_job(worker)
+                    if job is None:
+                        _send(wfile, {"type": "shutdown"})
+                        break
+                    _send(wfile, job.payload)
+                elif msg["type"] == "result" and job is not None and \
+                        msg.get("id") == job.payload["id"]:
+                    self._set_state(job, DONE if msg["ok"] else FAILED, msg.get("log", ""))
+                    job = None
+        except (OSError, ValueError):
+            pass
+        finally:
+            if job is not None:
+                self._requeue(job)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits until all jobs are finished and returns False when the timeout expired."""
+        with self._cond:
+            return self._cond.wait_for(self._finished, timeout)
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def results(self) -> Dict[Conan.Recipe, dict]:
+        """Returns the state, number of attempts, worker name, and log of every recipe."""
+        with self._cond:
+            return OrderedDict((recipe, job.result()) for recipe, job in self._jobs.items())
+
+    def run(self, timeout: Optional[float] = None) -> Dict[Conan.Recipe, dict]:
+        """Serves the workers until all jobs are finished and returns the results."""
+        self.start()
+        try:
+            if not self.wait(timeout):
+                raise TimeoutError("Distributed workspace build did not finish in time!")
+        finally:
+            self.shutdown()
+        return self.results()
+
+
+def execute(job: dict) -> Tuple[bool, str]:
+    """Executes the job and returns whether it succeeded together with the captured output."""
+    recipe = Conan.Recipe(job["recipe"], external_source=job["external_source"],
+                          layout=Conan.RelativePkgLayout(**job["layout"]))
+    with tempfile.TemporaryFile() as log:
+        # Redirect the file descriptors to capture the output of the conan processes too.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved = [os.dup(1), os.dup(2)]
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            recipe.build(pkg_folder=job["pkg_folder"])
+            recipe.package(pkg_folder=job["pkg_folder"])
+            if job["pkg_folder"] is None:
+                recipe.export_pkg(user=job["user"], channel=job["channel"],
+                                  profiles=job["profiles"], options=job["options"])
+            ok = True
+        except Exception:
+            traceback.print_exc()
+            ok = False
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+        log.seek(0)
+        return ok, log.read().decode(errors="replace")
+
+
+def _heartbeat(wfile, lock: threading.Lock, interval: float, done: threading.Event):
+    while not done.wait(interval):
+        try:
+            with lock:
+                _send(wfile, {"type": "heartbeat"})
+        except (OSError, ValueError):
+            return
+
+
+def work(host: str, port: int, name: Optional[str] = None) -> int:
+    """Connects to the coordinator and executes jobs until it requests the shutdown.
+
+    :returns: The number of executed jobs.
+    """
+    name = name or "{}:{}".format(socket.gethostname(), os.getpid())
+    count = 0
+    lock = threading.Lock()
+    with socket.create_connection((host, port)) as sock, \
+            sock.makefile('rb') as rfile, sock.makefile('wb') as wfile:
+        _send(wfile, {"type": "register", "name": name})
+        while True:
+            _send(wfile, {"type": "request"})
+            msg = _recv(rfile)
+            if msg is None or msg["type"] != "job":
+                return count
+            done = threading.Event()
+            if msg.get("heartbeat"):
+                threading.Thread(target=_heartbeat, args=(wfile, lock, msg["heartbeat"], done),
+                                 daemon=True).start()
+            try:
+                ok, log = execute(msg)
+            finally:
+                done.set()
+            with lock:
+                _send(wfile, {"type": "result", "id": msg["id"], "ok": ok, "log": log})
+            count += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ConanTools workspace build worker.")
+    parser.add_argument("address", help="HOST:PORT of the coordinator")
+    parser.add_argument("--name", help="name of the worker (default: hostname:pid)")
+    args = parser.parse_args()
+    host, port = args.address.rsplit(":", 1)
+    work(host, int(port), name=args.name)
@@ -0,0 +1,220 @@
+"""Support module for describing and synchronizing folder contents via manifests.
+
+A manifest records the relative path, size, mtime, and sha256 hash of each file in a folder.
+Hashes are computed in parallel and can be reused from a previous manifest when size and mtime of
+a file did not change. Based on that, :func:`sync_folder` updates a destination folder by only
+writing the files whose content actually changed which keeps the timestamps of all other files
+intact (e.g., for incremental builds of downstream consumers). Additionally,
+:func:`deduplicate` replaces identical files across several folders (e.g., package folders of
+different configurations) by hardlinks.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import shutil
+import stat
+from typing import Dict, List, Optional, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path: str) -> str:
+    """Computes the sha256 hash of the file without loading it into memory at once."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def walk_files(folder: str) -> List[str]:
+    """Returns the paths, relative to the folder, of all files and symlinks in the folder."""
+    result = []
+    for root, dirs, files in os.walk(folder):
+        for name in dirs:
+            # Symlinks to directories are recorded as links and not traversed.
+            if os.path.islink(os.path.join(root, name)):
+                files.append(name)
+        for name in files:
+            result.append(os.path.relpath(os.path.join(root, name), folder))
+    return sorted(result)
+
+
+class Manifest():
+    def __init__(self, entries: Optional[Dict[str, dict]] = None):
+        self._entries = entries or {}
+
+    @property
+    def entries(self) -> Dict[str, dict]:
+        return self._entries
+
+    @classmethod
+    def from_folder(cls, folder: str, previous: Optional['Manifest'] = None,
+                    max_workers: Optional[int] = None) -> 'Manifest':
+        """Creates the manifest of the folder by hashing all files in parallel.
+
+        :param folder: Folder that should be described.
+        :param previous: Older manifest of the folder whose hashes are reused for all files with
+                         unchanged size and mtime.
+        :param max_workers: Maximum number of threads used for hashing.
+        """
+        entries = {}
+        to_hash = []
+        for path in walk_files(folder):
+            fullpath = os.path.join(folder, path)
+            st = os.lstat(fullpath)
+            if stat.S_ISLNK(st.st_mode):
+                entries[path] = {"link": os.readlink(fullpath)}
+                continue
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            old = previous.entries.get(path) if previous is not None else None
+            if old is not None and all(old.get(k) == v for k, v in entry.items()):
+                entry["sha256"] = old["sha256"]
+            else:
+                to_hash.append(path)
+            entries[path] = entry
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            hashes = executor.map(file_hash, [os.path.join(folder, x) for x in to_hash])
+            for path, digest in zip(to_hash, hashes):
+                entries[path]["sha256"] = digest
+        return cls(entries)
+
+    @classmethod
+    def load(cls, path: str) -> 'Manifest':
+        """Loads a stored manifest and returns an empty one if the file is missing or broken."""
+        try:
+            with open(path) as f:
+                return cls(json.load(f))
+        except (OSError, ValueError):
+            return cls()
+
+    def save(self, path: str):
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def same_content(self, other: 'Manifest', path: str) -> bool:
+        a = self._entries.get(path)
+        b = other.entries.get(path)
+        if a is None or b is None:
+            return False
+        if "link" in a or "link" in b:
+            return a.get("link") == b.get("link")
+        return a["size"] == b["size"] and a["sha256"] == b["sha256"]
+
+    def diff(self, other: 'Manifest') -> Tuple[List[str], List[str]]:
+        """Compares this manifest with an older one.
+
+        :returns: The paths that are new or changed and the paths that no longer exist.
+        """
+        changed = [x for x in sorted(self._entries) if not self.same_content(other, x)]
+        removed = [x for x in sorted(other.entries) if x not in self._entries]
+        return changed, removed
+
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        if not os.access(path, os.W_OK) and not os.path.islink(path):
+            os.chmod(path, stat.S_IWRITE)
+        os.remove(path)
+
+
+def sync_folder(src: str, dst: str, manifest_path: Optional[str] = None,
+                max_workers: Optional[int] = None) -> Tuple[List[str], List[str]]:
+    """Makes the content of dst identical to src while only touching changed files.
+
+    :param src: Folder with the new content.
+    :param dst: Folder that gets updated.
+    :param manifest_path: Optional file where the manifest of dst is stored between invocations
+                          to avoid rehashing unchanged files.
+    :param max_workers: Maximum number of threads used for hashing.
+    :returns: The relative paths that have been written and the ones that have been removed.
+    """
+    previous = Manifest.load(manifest_path) if manifest_path else None
+    src_manifest = Manifest.from_folder(src, max_workers=max_workers)
+    dst_manifest = Manifest.from_folder(dst, previous=previous, max_workers=max_workers) \
+        if os.path.isdir(dst) else Manifest()
+    changed, removed = src_manifest.diff(dst_manifest)
+
+    for path in removed:
+        _remove(os.path.join(dst, path))
+    for path in changed:
+        s = os.path.join(src, path)
+        d = os.path.join(dst, path)
+        _remove(d)
+        os.makedirs(os.path.dirname(d), exist_ok=True)
+        if os.path.islink(s):
+            os.symlink(os.readlink(s), d)
+        else:
+            shutil.copy2(s, d)
+
+    # Mirror the directory structure, including empty directories, of the source folder.
+    for root, dirs, files in os.walk(src):
+        os.makedirs(os.path.join(dst, os.path.relpath(root, src)), exist_ok=True)
+    for root, dirs, files in os.walk(dst, topdown=False):
+        if not os.path.isdir(os.path.join(src, os.path.relpath(root, dst))):
+            os.rmdir(root)
+
+    if manifest_path:
+        # Reuse the known hashes. Copied files have the same mtime as their source.
+        hints = dict(dst_manifest.entries)
+        hints.update({x: src_manifest.entries[x] for x in changed})
+        Manifest.from_folder(dst, previous=Manifest(hints), max_workers=max_workers).save(
+            manifest_path)
+    return changed, removed
+
+
+def deduplicate(folders: List[str], max_workers: Optional[int] = None,
+                dry_run: bool = False) -> int:
+    """Replaces identical files in the folders by hardlinks to a single copy.
+
+    Only regular files with the same size, permissions, and owner on the same device are
+    considered. Candidates are hashed in parallel. Note that hardlinked files share their
+    metadata (e.g., the mtime) and that modifying one of them modifies all.
+
+    :param folders: Folders (e.g., package folders) that should be deduplicated together.
+    :param max_workers: Maximum number of threads used for hashing.
+    :param dry_run: Only compute the reclaimable space without modifying anything.
+    :returns: The number of bytes that have been (or would be) reclaimed.
+    """
+    groups = {}
+    for folder in folders:
+        for path in walk_files(folder):
+            fullpath = os.path.join(folder, path)
+            st = os.lstat(fullpath)
+            if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                continue
+            key = (st.st_dev, st.st_size, st.st_mode, st.st_uid, st.st_gid)
+            groups.setdefault(key, []).append((fullpath, st))
+
+    # Only files that do not share their inode with all other candidates have to be hashed.
+    candidates = [x for files in groups.values() if len(set(st.st_ino for _, st in files)) > 1
+                  for x in files]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashes = list(executor.map(file_hash, [path for path, _ in candidates]))
+
+    identical = {}
+    for (path, st), digest in zip(candidates, hashes):
+        identical.setdefault((st.st_dev, st.st_size, st.st_mode, st.st_uid, st.st_gid, digest),
+                             []).append((path, st))
+
+    reclaimed = 0
+    for files in identical.values():
+        canonical, canonical_st = files[0]
+        replaced = {}
+        for path, st in files[1:]:
+            if st.st_ino == canonical_st.st_ino:
+                continue
+            if not dry_run:
+                tmp_path = "{}.ct_dedup.{}".format(path, os.getpid())
+                os.link(canonical, tmp_path)
+                os.replace(tmp_path, path)
+            replaced.setdefault(st.st_ino, [st, 0])[1] += 1
+        # Space is only reclaimed when all links to an inode have been replaced.
+        reclaimed += sum(st.st_size for st, count in replaced.values() if count == st.st_nlink)
+    return reclaimed
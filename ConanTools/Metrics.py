@@ -0,0 +1,150 @@
+"""Support module for collecting metrics about conan invocations, recipe stages, and caches.
+
+The process-wide :data:`REGISTRY` holds counters and latency histograms which are fed by
+:func:`ConanTools.Conan.run`, the :class:`ConanTools.Conan.Recipe` stages, and the various
+ConanTools caches. When the ``CT_METRICS_FILE`` environment variable is defined, the metrics are
+written to this file in the Prometheus text format (e.g., for the node exporter textfile
+collector) when the process exits. Setting ``CT_METRICS_OPENMETRICS`` switches to the OpenMetrics
+format instead.
+"""
+import atexit
+from contextlib import contextmanager
+import functools
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def _fmt_labels(labels: tuple, extra: Optional[tuple] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+               for k, v in items]
+    return "{" + ",".join("{}=\"{}\"".format(k, v) for k, v in escaped) + "}"
+
+
+def _fmt_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry():
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def inc(self, name: str, labels: Dict[str, str] = {}, value: float = 1):
+        """Increments the counter with the given name (without ``_total`` suffix)."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: Dict[str, str] = {}, value: float = 0.0):
+        """Records a value (e.g., a duration in seconds) in the histogram with the given name."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts, total, count = self._histograms.get(key, ([0] * len(self._buckets), 0.0, 0))
+            counts = [c + 1 if value <= b else c for c, b in zip(counts, self._buckets)]
+            self._histograms[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, name: str, labels: Dict[str, str] = {}):
+        """Context manager that records the duration of the block in the histogram."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, labels, time.monotonic() - start)
+
+    def counter(self, name: str, labels: Dict[str, str] = {}) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram_count(self, name: str, labels: Dict[str, str] = {}) -> int:
+        with self._lock:
+            return self._histograms.get((name, tuple(sorted(labels.items()))), (0, 0, 0))[2]
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def dumps(self, openmetrics: bool = False) -> str:
+        """Formats all metrics in the Prometheus text or OpenMetrics format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        last = None
+        for (name, labels), value in counters:
+            if name != last:
+                if name in self._help:
+                    lines.append("# HELP {} {}".format(
+                        name if openmetrics else name + "_total", self._help[name]))
+                lines.append("# TYPE {} counter".format(name if openmetrics else name + "_total"))
+                last = name
+            lines.append("{}_total{} {}".format(name, _fmt_labels(labels), _fmt_value(value)))
+        for (name, labels), (counts, total, count) in histograms:
+            if name != last:
+                if name in self._help:
+                    lines.append("# HELP {} {}".format(name, self._help[name]))
+                lines.append("# TYPE {} histogram".format(name))
+                last = name
+            for bound, c in zip(self._buckets, counts):
+                lines.append("{}_bucket{} {}".format(
+                    name, _fmt_labels(labels, ("le", _fmt_value(float(bound)))), c))
+            lines.append("{}_bucket{} {}".format(name, _fmt_labels(labels, ("le", "+Inf")), count))
+            lines.append("{}_sum{} {}".format(name, _fmt_labels(labels), _fmt_value(total)))
+            lines.append("{}_count{} {}".format(name, _fmt_labels(labels), count))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, openmetrics: bool = False):
+        """Writes the metrics atomically to avoid exposing partial files to collectors."""
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(self.dumps(openmetrics))
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+REGISTRY.describe("ct_conan_commands", "Number of executed conan commands.")
+REGISTRY.describe("ct_conan_command_duration_seconds", "Duration of conan commands.")
+REGISTRY.describe("ct_recipe_stage_duration_seconds", "Duration of ConanTools recipe stages.")
+REGISTRY.describe("ct_cache_requests", "Number of lookups in ConanTools caches.")
+
+
+def count_cache(cache: str, hit: bool):
+    """Records a hit or miss of one of the ConanTools caches."""
+    REGISTRY.inc("ct_cache_requests", {"cache": cache, "result": "hit" if hit else "miss"})
+
+
+def timed_stage(stage: str):
+    """Decorator which records the duration of a recipe stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with REGISTRY.time("ct_recipe_stage_duration_seconds", {"stage": stage}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _write_at_exit():
+    path = os.environ.get("CT_METRICS_FILE")
+    if path:
+        from ConanTools import env_flag
+        REGISTRY.write(path, openmetrics=env_flag("CT_METRICS_OPENMETRICS"))
+
+
+atexit.register(_write_at_exit)
@@ -0,0 +1,233 @@
+"""Support module for reading, merging, and writing conan profiles.
+
+Passing several profiles (e.g., the ones returned by :func:`ConanTools.Hack.get_cl_profiles`) to
+every conan command forces conan to re-parse and re-merge the whole include chain each time. This
+module resolves the includes and merges the profiles once in Python. The result is written as a
+single flattened profile whose file name is derived from its content which permits reusing it
+across all commands of a pipeline. Setting the ``CT_MERGE_PROFILES`` environment variable makes
+:func:`ConanTools.Conan.fmt_build_args` use the flattened profile automatically.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from ConanTools import Metrics
+
+if TYPE_CHECKING:
+    from ConanTools import Conan  # noqa
+
+# Sections which contain plain entries instead of key=value pairs.
+_LIST_SECTIONS = ("build_requires",)
+
+_include_regex = re.compile(r'include\((.*)\)$')
+
+
+def conan_folder(session: Optional['Conan.ConanSession'] = None) -> str:
+    """Returns the ``.conan`` folder in the CONAN_USER_HOME of the session (or the process)."""
+    home = session.user_home if session is not None else None
+    home = home or os.environ.get("CONAN_USER_HOME", os.path.expanduser("~"))
+    return os.path.join(home, ".conan")
+
+
+def profiles_folder(session: Optional['Conan.ConanSession'] = None) -> str:
+    """Returns the folder where conan stores the profiles that are referenced by name."""
+    return os.path.join(conan_folder(session), "profiles")
+
+
+def resolve_path(name: str, cwd: Optional[str] = None,
+                 session: Optional['Conan.ConanSession'] = None) -> Optional[str]:
+    """Searches the profile file like conan does, relative to cwd first and by name second.
+
+    :param name: Path or name of the profile.
+    :param cwd: Directory that is used to resolve relative paths. (None -> current dir)
+    :param session: Session whose CONAN_USER_HOME contains the named profiles.
+    :returns: The absolute path of the profile file or None if it could not be found.
+    """
+    if os.path.isabs(name):
+        return name if os.path.isfile(name) else None
+    if cwd is None and session is not None:
+        cwd = session.cwd
+    for base in [cwd or os.getcwd(), profiles_folder(session)]:
+        path = os.path.normpath(os.path.join(base, name))
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _substitute(text: str, variables: Dict[str, str]) -> str:
+    # Replace longer names first to avoid clashes between variables sharing a prefix.
+    for name in sorted(variables.keys(), key=len, reverse=True):
+        text = text.replace("$" + name, variables[name])
+    return text
+
+
+def _split(line: str) -> Tuple[str, str]:
+    if "=" not in line:
+        raise ValueError("Invalid profile line \"{}\"!".format(line))
+    key, value = line.split("=", 1)
+    return key.strip(), value.strip()
+
+
+class Profile():
+    def __init__(self):
+        self._variables = OrderedDict()
+        self._sections = OrderedDict()
+        self._files = []
+
+    @classmethod
+    def load(cls, path: str, variables: Optional[Dict[str, str]] = None,
+             session: Optional['Conan.ConanSession'] = None) -> 'Profile':
+        """Parses the profile file and recursively resolves all included profiles."""
+        path = os.path.abspath(path)
+        variables = dict(variables or {})
+        variables["PROFILE_DIR"] = os.path.dirname(path)
+        profile = cls()
+        profile._files.append(path)
+        section = None
+        with open(path) as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1].strip()
+                profile._section(section)
+                continue
+            line = _substitute(line, variables)
+            if section in _LIST_SECTIONS:
+                profile.set(section, line, None)
+                continue
+            if section is not None:
+                profile.set(section, *_split(line))
+                continue
+
+            match = _include_regex.match(line)
+            if match:
+                include_path = resolve_path(match.group(1).strip(), cwd=os.path.dirname(path),
+                                            session=session)
+                if include_path is None:
+                    raise ValueError("Included profile \"{}\" of \"{}\" not found!".format(
+                        match.group(1), path))
+                included = cls.load(include_path, variables, session=session)
+                profile.merge(included)
+                variables.update(included._variables)
+                continue
+            key, value = _split(line)
+            variables[key] = value
+            profile._variables[key] = value
+        return profile
+
+    @property
+    def files(self) -> List[str]:
+        """Paths of all profile files which have been read to construct this profile."""
+        return list(self._files)
+
+    def _section(self, name: str) -> Dict[str, Optional[str]]:
+        return self._sections.setdefault(name, OrderedDict())
+
+    def get(self, section: str, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self._sections.get(section, {}).get(key, default)
+
+    def set(self, section: str, key: str, value: Optional[str]):
+        self._section(section)[key] = value
+
+    def add_build_requires(self, refs: List[str]):
+        for ref in refs:
+            self.set("build_requires", ref, None)
+
+    def merge(self, other: 'Profile'):
+        """Merges the other profile into this one. Entries of the other profile take priority."""
+        self._variables.update(other._variables)
+        settings = self._sections.get("settings", {})
+        for key, value in other._sections.get("settings", {}).items():
+            if "." in key or settings.get(key) in (None, value):
+                continue
+            # Like conan, drop the subsettings (e.g., compiler.version) of the base profile when
+            # the other profile changes the parent setting.
+            for x in [x for x in settings if x.startswith(key + ".")]:
+                del settings[x]
+        for name, entries in other._sections.items():
+            self._section(name)
+            for key, value in entries.items():
+                self.set(name, key, value)
+        self._files.extend(x for x in other._files if x not in self._files)
+
+    def dumps(self) -> str:
+        lines = []
+        for name, entries in self._sections.items():
+            lines.append("[{}]".format(name))
+            for key, value in entries.items():
+                lines.append(key if name in _LIST_SECTIONS else "{}={}".format(key, value))
+            lines.append("")
+        return "\n".join(lines)
+
+    def digest(self) -> str:
+        return hashlib.sha256(self.dumps().encode()).hexdigest()
+
+    def save(self, path: str):
+        """Writes the flattened profile but leaves the file untouched when nothing changed."""
+        content = self.dumps()
+        if os.path.isfile(path):
+            with open(path) as f:
+                if f.read() == content:
+                    return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+def _stamp(files: List[str]):
+    stamps = []
+    for path in files:
+        st = os.stat(path)
+        stamps.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(stamps)
+
+
+_merged_cache = {}
+_merged_lock = threading.Lock()
+
+
+def merged(profiles: List[str], folder: Optional[str] = None, cwd: Optional[str] = None,
+           session: Optional['Conan.ConanSession'] = None) -> List[str]:
+    """Merges the profiles into a single flattened profile file.
+
+    The flattened file is named after the hash of its content and the result is cached as long as
+    none of the involved profile files changes. When one of the profiles can not be found on disk,
+    the profile list is returned unchanged and conan has to resolve it.
+
+    :param profiles: Paths or names of the profiles in command line order.
+    :param folder: Folder where the flattened profile is stored. (None -> ``ct_profiles`` in the
+                   ``.conan`` folder of the session)
+    :param cwd: Directory that is used to resolve relative profile paths. (None -> current dir)
+    :param session: Session whose CONAN_USER_HOME contains the named profiles.
+    :returns: The profile list that should be passed to conan instead.
+    """
+    paths = [resolve_path(x, cwd=cwd, session=session) for x in profiles]
+    if len(paths) == 0 or None in paths:
+        return profiles
+    folder = folder or os.path.join(conan_folder(session), "ct_profiles")
+    key = (tuple(paths), folder)
+    with _merged_lock:
+        cached = _merged_cache.get(key)
+        try:
+            if cached is not None and _stamp(cached[0]) == cached[1]:
+                Metrics.count_cache("profile", True)
+                return [cached[2]]
+        except OSError:
+            pass
+        Metrics.count_cache("profile", False)
+
+        profile = Profile()
+        for path in paths:
+            profile.merge(Profile.load(path, session=session))
+        outpath = os.path.join(folder, "profile-{}".format(profile.digest()[:16]))
+        profile.save(outpath)
+        _merged_cache[key] = (profile.files, _stamp(profile.files), outpath)
+        return [outpath]
@@ -0,0 +1,91 @@
+"""Support module for selecting the fastest of several mirrored remotes.
+
+A :class:`RemoteSelector` measures how long a cheap search takes on each remote and remembers the
+results for a configurable time. The selector can be passed instead of a remote name to the
+functions of :mod:`ConanTools.Conan` (e.g., ``install``, ``search``, ``download_recipe``, or
+``in_remote``) which then use the fastest healthy remote.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import subprocess as sp
+import threading
+import time
+from typing import Dict, List, Optional
+
+from ConanTools import Conan
+
+# Pattern for the probe search. It is not expected to match anything to keep the response small.
+PROBE_PATTERN = "ct-latency-probe-*"
+
+
+class RemoteSelector():
+    def __init__(self, remotes: List[str], ttl: float = 300.0, timeout: float = 30.0,
+                 conan_cmd: Optional[str] = None, session: Optional[Conan.ConanSession] = None):
+        """Creates the selector for the mirrors.
+
+        :param remotes: Names of the remotes that mirror the same packages.
+        :param ttl: Number of seconds a measurement remains valid.
+        :param timeout: Remotes that do not respond within this number of seconds are unhealthy.
+        :param conan_cmd: The conan command that is used for probing (None -> CT_CONAN_CMD).
+        :param session: Execution context of the probes (takes precedence over conan_cmd).
+        """
+        if len(remotes) == 0:
+            raise ValueError("At least one remote is required!")
+        self._remotes = list(remotes)
+        self._ttl = ttl
+        self._timeout = timeout
+        self._session = session or Conan.ConanSession(conan_cmd=conan_cmd or Conan.CONAN_CMD)
+        self._measurements = {}
+        self._lock = threading.Lock()
+
+    @property
+    def remotes(self) -> List[str]:
+        return list(self._remotes)
+
+    def probe(self, remote: str) -> Optional[float]:
+        """Measures the response time of the remote and returns None if it is unhealthy."""
+        start = time.monotonic()
+        try:
+            result = Conan.run(["search", PROBE_PATTERN, "--remote", remote], stdout=sp.PIPE,
+                               stderr=sp.PIPE, check=False, timeout=self._timeout,
+                               session=self._session)
+        except ValueError:
+            latency = None
+        else:
+            latency = time.monotonic() - start if result.returncode == 0 else None
+        with self._lock:
+            self._measurements[remote] = (time.monotonic(), latency)
+        return latency
+
+    def latencies(self) -> Dict[str, Optional[float]]:
+        """Returns the response times of all remotes and reprobes expired ones in parallel."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [x for x in self._remotes
+                       if x not in self._measurements or now - self._measurements[x][0] > self._ttl]
+        if expired:
+            with ThreadPoolExecutor(max_workers=len(expired)) as executor:
+                list(executor.map(self.probe, expired))
+        with self._lock:
+            return {x: self._measurements[x][1] for x in self._remotes}
+
+    def ranking(self) -> List[str]:
+        """Returns the healthy remotes ordered by their response time followed by the others."""
+        latencies = self.latencies()
+        healthy = sorted([x for x in self._remotes if latencies[x] is not None],
+                         key=lambda x: latencies[x])
+        return healthy + [x for x in self._remotes if latencies[x] is None]
+
+    def fastest(self) -> str:
+        """Returns the fastest healthy remote (or the first one if none responds)."""
+        return self.ranking()[0]
+
+    def invalidate(self, remote: Optional[str] = None):
+        """Forgets the measurement of the remote (None -> all), e.g., after a failure."""
+        with self._lock:
+            if remote is None:
+                self._measurements.clear()
+            else:
+                self._measurements.pop(remote, None)
+
+    def __str__(self):
+        return self.fastest()
@@ -1,11 +1,20 @@
-import configparser
+from collections import deque
+from contextlib import contextmanager
+import fnmatch
 import glob
+import posixpath
+import shutil
 import tempfile
-from typing import List
+from typing import Callable, List, Optional, Tuple, TYPE_CHECKING
 import os
 
 import ConanTools.Conan as Conan
 
+# The archive and compression modules are only imported when archives are actually processed to
+# keep the import (e.g., the star import of recipes) cheap.
+if TYPE_CHECKING:
+    import tarfile  # noqa
+
 
 class ConanImportTxtFile:
     def __init__(self, file_name=None, cwd=None):
@@ -34,7 +43,9 @@ class ConanImportTxtFile:
         for ref in refs:
             self.add_package(ref)
 
-    def install(self, remote=None, profiles=[], options={}, build=["outdated"], cwd=None):
+    def install(self, remote=None, profiles=[], options={}, build=["outdated"], cwd=None,
+                session: Optional[Conan.ConanSession] = None):
+        import configparser
         # write a conanfile in txt format with the package ids the imports
         config = configparser.ConfigParser(allow_no_value=True)
         config.optionxform = str
@@ -46,11 +57,13 @@ class ConanImportTxtFile:
             config.write(configfile)
 
         args = Conan.fmt_build_args("install", [self._file_name], remote=remote, profiles=profiles,
-                                    options=options, build=build)
-        Conan.run(args, cwd=cwd)
+                                    options=options, build=build, session=session)
+        Conan.run(args, cwd=cwd, session=session)
 
         # remove conan packaging metadata files
-        cwd = os.path.abspath(cwd if cwd is not None else os.getcwd())
+        if cwd is None:
+            cwd = (session.cwd if session is not None else None) or os.getcwd()
+        cwd = os.path.abspath(cwd)
         files = glob.glob(os.path.join(cwd, "conan*"))
         files += glob.glob(os.path.join(cwd, "graph_info.json"))
         for f in files:
@@ -58,10 +71,356 @@ class ConanImportTxtFile:
 
 
 def extend_profile(inpath, outpath, build_requires):
-    config = configparser.ConfigParser(allow_no_value=True)
-    config.optionxform = str
-    config.read([inpath])
-    for x in build_requires:
-        config["build_requires"][x] = None
-    with open(outpath, 'w') as configfile:
-        config.write(configfile)
+    from ConanTools.Profile import Profile
+    profile = Profile.load(inpath)
+    profile.add_build_requires(build_requires)
+    profile.save(outpath)
+
+
+# Archive suffixes and the compression that is used for them.
+ARCHIVE_SUFFIXES = [(".tar.zst", "zst"), (".tzst", "zst"), (".tar.xz", "xz"), (".txz", "xz"),
+                    (".tar.gz", "gz"), (".tgz", "gz"), (".tar", None)]
+
+
+def archive_compression(path: str) -> Optional[str]:
+    """Determines the compression of an archive from its file name."""
+    for suffix, compression in ARCHIVE_SUFFIXES:
+        if path.endswith(suffix):
+            return compression
+    raise ValueError("Unsupported archive type of '{}'!".format(path))
+
+
+def _compressor(compression: str, level: Optional[int]) -> Callable[[bytes], bytes]:
+    if compression == "xz":
+        import lzma
+        preset = 6 if level is None else level
+        return lambda data: lzma.compress(data, format=lzma.FORMAT_XZ, preset=preset)
+    if compression == "gz":
+        import zlib
+
+        def compress_gz(data):
+            # wbits=31 produces a gzip member with a zero timestamp in its header.
+            c = zlib.compressobj(9 if level is None else level, zlib.DEFLATED, 31)
+            return c.compress(data) + c.flush()
+        return compress_gz
+    if compression == "zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression requires the zstandard package!")
+        import threading
+        # Compressor instances are not thread-safe. Hence, every worker thread uses its own.
+        local = threading.local()
+
+        def compress_zst(data):
+            if not hasattr(local, "compressor"):
+                local.compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+            return local.compressor.compress(data)
+        return compress_zst
+    raise ValueError("Unsupported compression '{}'!".format(compression))
+
+
+class _ParallelCompressor():
+    """Write-only file object that compresses fixed-size chunks of the stream concurrently.
+
+    Every chunk becomes an independent xz stream, gzip member, or zstd frame. Concatenations of
+    these are valid files for the respective decompressors. Since the chunk boundaries only
+    depend on the data, the output is identical for any number of threads.
+    """
+    def __init__(self, fileobj, compress: Callable[[bytes], bytes], threads: int,
+                 chunk_size: int):
+        from concurrent.futures import ThreadPoolExecutor
+        self._fileobj = fileobj
+        self._compress = compress
+        self._chunk_size = chunk_size
+        self._max_pending = 2 * threads
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self._chunk_size:
+            self._submit(bytes(self._buffer[:self._chunk_size]))
+            del self._buffer[:self._chunk_size]
+        return len(data)
+
+    def _submit(self, chunk: bytes):
+        self._pending.append(self._executor.submit(self._compress, chunk))
+        # Bound the memory usage by waiting for the oldest chunk when too many are in flight.
+        while len(self._pending) > self._max_pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+    def close(self):
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._fileobj.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown()
+
+
+def _tarinfo(path: str, arcname: str, mtime: int) -> 'tarfile.TarInfo':
+    import tarfile
+    # Only the content, the type, and the executable bit are recorded to get reproducible
+    # archives.
+    st = os.lstat(path)
+    info = tarfile.TarInfo(arcname)
+    info.mtime = mtime
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    if os.path.islink(path):
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.readlink(path)
+        info.mode = 0o777
+    elif os.path.isdir(path):
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    else:
+        info.type = tarfile.REGTYPE
+        info.size = st.st_size
+        info.mode = 0o755 if st.st_mode & 0o111 else 0o644
+    return info
+
+
+def _add_folder(tar: 'tarfile.TarFile', folder: str, prefix: str, mtime: int):
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        info = _tarinfo(path, prefix + name, mtime)
+        if info.isreg():
+            with open(path, 'rb') as f:
+                tar.addfile(info, f)
+        else:
+            tar.addfile(info)
+        if info.isdir():
+            _add_folder(tar, path, info.name + "/", mtime)
+
+
+def create_archive(folder: str, path: str, compression: Optional[str] = "auto",
+                   level: Optional[int] = None, threads: Optional[int] = None,
+                   chunk_size: int = 8 * 1024 * 1024, mtime: Optional[int] = None):
+    """Packs the content of a folder (e.g., a pkg_folder) into a reproducible tar archive.
+
+    The entries are added in sorted order with normalized metadata (i.e., fixed owner,
+    timestamp, and permissions) and file contents are streamed into the archive. Compression
+    happens chunk-wise in parallel, bounding the memory usage to a few chunks per thread.
+
+    :param folder: Folder whose content is archived.
+    :param path: Path of the created archive.
+    :param compression: "zst", "xz", "gz", or None. ("auto" -> derived from the path)
+    :param level: Compression level. (None -> default of the compression)
+    :param threads: Number of compression threads. (None -> number of CPUs)
+    :param chunk_size: Size of the independently compressed chunks.
+    :param mtime: Timestamp of all entries. (None -> ``SOURCE_DATE_EPOCH`` or 0)
+    """
+    import tarfile
+    if compression == "auto":
+        compression = archive_compression(path)
+    compress = _compressor(compression, level) if compression is not None else None
+    if mtime is None:
+        mtime = int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+    path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            out = f
+            if compress is not None:
+                out = _ParallelCompressor(f, compress, threads or os.cpu_count() or 1, chunk_size)
+            try:
+                with tarfile.open(fileobj=out, mode="w|", format=tarfile.GNU_FORMAT) as tar:
+                    _add_folder(tar, folder, "", mtime)
+            finally:
+                if compress is not None:
+                    out.close()
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+_BUFSIZE = 1024 * 1024
+
+
+@contextmanager
+def _open_archive(path: str, compression: Optional[str]):
+    import mmap
+    import tarfile
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Empty files and special files (e.g., pipes) can not be mapped.
+            data = None
+        src = data if data is not None else f
+        try:
+            if compression is None:
+                stream = src
+            elif compression == "xz":
+                import lzma
+                stream = lzma.LZMAFile(src)
+            elif compression == "gz":
+                import gzip
+                stream = gzip.GzipFile(fileobj=src, mode='rb')
+            elif compression == "zst":
+                try:
+                    import zstandard
+                except ImportError:
+                    raise ValueError("zstd compression requires the zstandard package!")
+                stream = zstandard.ZstdDecompressor().stream_reader(src, read_across_frames=True)
+            else:
+                raise ValueError("Unsupported compression '{}'!".format(compression))
+            # Uncompressed archives permit random access while the others are read sequentially.
+            with tarfile.open(fileobj=stream, mode="r:" if compression is None else "r|") as tar:
+                yield tar
+        finally:
+            if data is not None:
+                data.close()
+
+
+def _selected(name: str, filters: Optional[List[str]]) -> bool:
+    if not filters:
+        return True
+    for pattern in filters:
+        pattern = pattern.strip("/")
+        if name == pattern or name.startswith(pattern + "/") or fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
+
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def _copy_bytes(src, dst, count: int):
+    while count > 0:
+        chunk = src.read(min(count, _BUFSIZE))
+        if not chunk:
+            break
+        dst.write(chunk)
+        count -= len(chunk)
+
+
+def _extract_file(src, size: int, dst: str) -> bool:
+    """Writes the member content to dst unless dst already has the same content.
+
+    The content of an existing file with matching size is compared chunk-wise while streaming
+    the member. On the first difference, the identical prefix is taken from the old file.
+
+    :returns: True if the file has been written.
+    """
+    tmp_path = "{}.{}.ct_tmp".format(dst, os.getpid())
+    offset = 0
+    chunk = b""
+    if os.path.isfile(dst) and not os.path.islink(dst) and os.path.getsize(dst) == size:
+        with open(dst, 'rb') as f:
+            while True:
+                chunk = src.read(_BUFSIZE)
+                if not chunk:
+                    return False
+                if f.read(len(chunk)) != chunk:
+                    break
+                offset += len(chunk)
+    try:
+        with open(tmp_path, 'wb') as out:
+            if offset > 0:
+                with open(dst, 'rb') as f:
+                    _copy_bytes(f, out, offset)
+            out.write(chunk)
+            shutil.copyfileobj(src, out, _BUFSIZE)
+        _remove(dst)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return True
+
+
+def extract_archive(path: str, pkg_folder: str, filters: Optional[List[str]] = None,
+                    compression: Optional[str] = "auto") -> Tuple[List[str], List[str]]:
+    """Extracts an archive (e.g., from :func:`create_archive`) into the pkg_folder.
+
+    The archive is read through a memory map where possible and decompressed while streaming.
+    Existing files whose size and content already match the archive are not rewritten which
+    preserves their timestamps and makes updating a folder incremental. Files that are not part
+    of the archive are kept.
+
+    :param path: Path of the archive.
+    :param pkg_folder: Folder that receives the content.
+    :param filters: Paths or glob patterns of the subtrees that should be extracted.
+                    (None -> everything)
+    :param compression: "zst", "xz", "gz", or None. ("auto" -> derived from the path)
+    :returns: Names of the written entries and names of the files that have been skipped.
+    """
+    import tarfile
+    if compression == "auto":
+        compression = archive_compression(path)
+    pkg_folder = os.path.abspath(pkg_folder)
+    os.makedirs(pkg_folder, exist_ok=True)
+    root = os.path.realpath(pkg_folder)
+    written = []
+    skipped = []
+    # Regular files of this archive that are in the pkg_folder (targets of hardlink members).
+    extracted = {}
+    with _open_archive(path, compression) as tar:
+        for member in tar:
+            name = posixpath.normpath(member.name)
+            if name == ".":
+                continue
+            if posixpath.isabs(name) or name == ".." or name.startswith("../"):
+                raise ValueError("Archive member '{}' is outside of the pkg_folder!".format(
+                    member.name))
+            if not _selected(name, filters):
+                continue
+            dst = os.path.join(pkg_folder, *name.split("/"))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            # Refuse to write through symlinks that point outside of the pkg_folder.
+            if os.path.commonpath([root, os.path.realpath(os.path.dirname(dst))]) != root:
+                raise ValueError("Archive member '{}' is outside of the pkg_folder!".format(
+                    member.name))
+            if member.isdir():
+                if not os.path.isdir(dst) or os.path.islink(dst):
+                    _remove(dst)
+                    os.makedirs(dst)
+                    written.append(name)
+            elif member.issym():
+                if not os.path.islink(dst) or os.readlink(dst) != member.linkname:
+                    _remove(dst)
+                    os.symlink(member.linkname, dst)
+                    written.append(name)
+                else:
+                    skipped.append(name)
+            elif member.isreg() or member.islnk():
+                if member.islnk():
+                    target = posixpath.normpath(member.linkname)
+                    if posixpath.isabs(target) or target == ".." or target.startswith("../"):
+                        raise ValueError("Archive member '{}' links outside of the "
+                                         "pkg_folder!".format(member.name))
+                    if target in extracted:
+                        with open(extracted[target], 'rb') as src:
+                            changed = _extract_file(src, os.path.getsize(extracted[target]), dst)
+                    else:
+                        # The target has been filtered out. Random access archives still
+                        # provide its data while sequentially read ones already skipped it.
+                        try:
+                            src = tar.extractfile(member)
+                        except (KeyError, tarfile.StreamError):
+                            src = None
+                        if src is None:
+                            raise ValueError("Archive member '{}' links to '{}' which is not "
+                                             "extracted (e.g., excluded by the filters)!".format(
+                                                 member.name, member.linkname))
+                        with src:
+                            changed = _extract_file(src, tar.getmember(target).size, dst)
+                else:
+                    changed = _extract_file(tar.extractfile(member), member.size, dst)
+                extracted[name] = dst
+                (written if changed else skipped).append(name)
+                if os.stat(dst).st_mode & 0o777 != member.mode & 0o777:
+                    os.chmod(dst, member.mode & 0o777)
+    return written, skipped
@@ -0,0 +1,133 @@
+"""Support module for sharing fetched recipe sources between layouts.
+
+The store keeps one copy of the sources per recipe revision in a common root folder (e.g.,
+``CT_SOURCE_STORE``). The key of an entry is derived from the content of the recipe file, the
+``conandata.yml`` next to it (which usually holds the source URLs and checksums), the exported
+files, and the fields which influence the source step. Layouts get populated by hardlinking the
+files from the store, falling back to copies when linking is not possible (e.g., across file
+systems). Hence, the sources in the layouts must be treated as read-only since modifications
+would propagate into the store.
+"""
+import fnmatch
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Callable, List, Optional
+
+from ConanTools import Metrics
+
+STORE_ENV_VAR = "CT_SOURCE_STORE"
+
+
+def link_tree(src: str, dst: str):
+    """Recreates the directory structure of src in dst and hardlinks all files."""
+    for root, dirs, files in os.walk(src):
+        dst_root = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(dst_root, exist_ok=True)
+        for name in dirs + files:
+            s = os.path.join(root, name)
+            d = os.path.join(dst_root, name)
+            if os.path.islink(s):
+                os.symlink(os.readlink(s), d)
+            elif os.path.isfile(s):
+                try:
+                    os.link(s, d)
+                except OSError:
+                    shutil.copy2(s, d)
+
+
+class SourceStore():
+    def __init__(self, root: Optional[str] = None, fields: List[str] = ["name", "version"]):
+        """Creates a store in the root folder (``CT_SOURCE_STORE`` by default).
+
+        :param root: Folder which contains the store entries.
+        :param fields: Recipe fields which are, in addition to the recipe file, part of the key.
+        """
+        root = root or os.environ.get(STORE_ENV_VAR)
+        if root is None:
+            raise ValueError("No source store root has been specified!")
+        self._root = os.path.abspath(root)
+        self._fields = fields
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    def _exported_files(self, recipe) -> List[str]:
+        # Conan matches the exports and exports_sources patterns against the paths relative to
+        # the recipe folder where "*" also matches "/". Exclusion patterns ("!...") are ignored
+        # which at most adds more files to the key.
+        patterns = []
+        for field in ("exports", "exports_sources"):
+            value = recipe.get_field(field)
+            if isinstance(value, str):
+                value = [value]
+            patterns += [x for x in value or [] if isinstance(x, str) and not x.startswith("!")]
+        recipe_dir = os.path.dirname(recipe.path)
+        files = set()
+        conandata = os.path.join(recipe_dir, "conandata.yml")
+        if os.path.isfile(conandata):
+            files.add(conandata)
+        if not patterns:
+            return sorted(files)
+        # Do not descend into the store or into folders that are written by the flow (e.g., the
+        # source folder that receives the sources).
+        layout = recipe.layout
+        skip = set(os.path.abspath(x) for x in [
+            self._root, layout.src_folder(recipe), layout.build_folder(recipe),
+            layout.pkg_folder(recipe)])
+        for root, dirs, names in os.walk(recipe_dir):
+            dirs[:] = sorted(x for x in dirs if not x.startswith(".") and
+                             os.path.abspath(os.path.join(root, x)) not in skip)
+            for name in names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, recipe_dir).replace(os.sep, "/")
+                if path != recipe.path and any(fnmatch.fnmatch(rel, x) for x in patterns):
+                    files.add(path)
+        return sorted(files)
+
+    def key(self, recipe) -> str:
+        h = hashlib.sha256()
+        with open(recipe.path, 'rb') as f:
+            h.update(f.read())
+        recipe_dir = os.path.dirname(recipe.path)
+        for path in self._exported_files(recipe):
+            h.update("\0{}\0".format(os.path.relpath(path, recipe_dir)).encode())
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(block)
+        for field in self._fields:
+            h.update("\0{}={}".format(field, recipe.get_field(field)).encode())
+        return h.hexdigest()
+
+    def entry(self, recipe) -> str:
+        return os.path.join(self._root, self.key(recipe))
+
+    def populate(self, recipe, src_folder: str, fetch: Callable[[str], None]) -> bool:
+        """Fills the src_folder from the store and fetches the sources on a miss.
+
+        :param recipe: The recipe whose sources are requested.
+        :param src_folder: Folder that should receive the sources.
+        :param fetch: Callback which retrieves the sources into the passed folder.
+        :returns: True if the sources have been found in the store.
+        """
+        entry = self.entry(recipe)
+        hit = os.path.isdir(entry)
+        Metrics.count_cache("source_store", hit)
+        if not hit:
+            # Fetch into a temporary folder first and move it into place atomically. This
+            # ensures that aborted fetches never end up in the store.
+            os.makedirs(self._root, exist_ok=True)
+            tmp_folder = tempfile.mkdtemp(prefix=os.path.basename(entry) + ".", dir=self._root)
+            try:
+                fetch(tmp_folder)
+                os.rename(tmp_folder, entry)
+            except OSError:
+                # Another process has populated the entry concurrently.
+                if not os.path.isdir(entry):
+                    raise
+            finally:
+                shutil.rmtree(tmp_folder, ignore_errors=True)
+        link_tree(entry, src_folder)
+        return hit
@@ -0,0 +1,353 @@
+"""Support module for automatically rebuilding a recipe with the local flow on changes.
+
+:func:`watch` monitors the source folder of a recipe, the recipe file, and the profiles. After a
+burst of changes has settled down (debouncing), only the affected stages are executed again.
+Source edits only require the build and package stage while changes of the recipe or the
+profiles restart the flow with the install stage. On Linux, changes are detected via inotify
+which is accessed through ctypes. Other platforms (or file systems without inotify support)
+fall back to polling the timestamps of the watched files.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+from typing import Dict, Iterable, List, Optional, Set
+
+import ConanTools
+from ConanTools import Conan
+
+INSTALL_STAGES = ["install", "source", "build", "package"]
+SOURCE_STAGES = ["build", "package"]
+# Helper scripts that are (re)written into the layout root by every cycle.
+SCRIPTS = ["install", "source", "build", "package", "export-pkg"]
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+            _IN_CREATE | _IN_DELETE)
+_EVENT = struct.Struct("iIII")
+
+
+class _Watcher():
+    def __init__(self, paths: Iterable[str], ignore: Iterable[str] = [],
+                 folders: Iterable[str] = []):
+        """Sorts the watched paths into files and (recursively watched) folders.
+
+        :param paths: Files and folders that are watched.
+        :param ignore: Folders below the watched folders that are not watched (e.g., the build
+                       folder). Additionally, hidden files and backup files (``*~``) are ignored.
+        :param folders: Folders that are watched recursively even if they do not exist yet
+                        (e.g., the source folder of a recipe with external sources).
+        """
+        self._files = set()
+        self._folders = set(os.path.abspath(x) for x in folders)
+        for path in paths:
+            path = os.path.abspath(path)
+            (self._folders if os.path.isdir(path) else self._files).add(path)
+        self._ignore = set(os.path.abspath(x) for x in ignore)
+
+    def ignored(self, path: str) -> bool:
+        name = os.path.basename(path)
+        return path in self._ignore or name.startswith(".") or name.endswith("~")
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(_Watcher):
+    def __init__(self, paths: Iterable[str], ignore: Iterable[str] = [], interval: float = 0.5,
+                 folders: Iterable[str] = []):
+        """Watches the paths by periodically comparing the timestamps of all files.
+
+        :param interval: Number of seconds between two scans.
+        """
+        super().__init__(paths, ignore, folders)
+        self._interval = interval
+        self._snapshot = self._scan()
+
+    def _stat(self, path: str, result: Dict[str, tuple]):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        result[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _scan(self) -> Dict[str, tuple]:
+        result = {}
+        for path in self._files:
+            self._stat(path, result)
+        for folder in self._folders:
+            for root, dirs, files in os.walk(folder):
+                dirs[:] = [x for x in dirs if not self.ignored(os.path.join(root, x))]
+                for name in files:
+                    path = os.path.join(root, name)
+                    if not self.ignored(path):
+                        self._stat(path, result)
+        return result
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """Waits until something changed and returns the changed paths (empty on timeout)."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            snapshot = self._scan()
+            changed = set(x for x in set(snapshot) | set(self._snapshot)
+                          if snapshot.get(x) != self._snapshot.get(x))
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            remaining = deadline - time.monotonic() if deadline is not None else self._interval
+            time.sleep(max(0.0, min(self._interval, remaining)))
+
+
+class InotifyWatcher(_Watcher):
+    def __init__(self, paths: Iterable[str], ignore: Iterable[str] = [],
+                 folders: Iterable[str] = []):
+        """Watches the paths via inotify (Linux only).
+
+        Files are watched via their parent folder to also notice editors that replace the file
+        instead of writing it in place. Folders that do not exist yet are watched via their
+        closest existing parent until they get created.
+        """
+        super().__init__(paths, ignore, folders)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        self._missing = set()
+        try:
+            for path in self._files:
+                self._add_watch(os.path.dirname(path))
+            for folder in self._folders:
+                self._add_folder(folder)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, folder: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), _IN_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", folder)
+        self._watches[wd] = folder
+
+    def _add_tree(self, folder: str):
+        for root, dirs, _ in os.walk(folder):
+            dirs[:] = [x for x in dirs if not self.ignored(os.path.join(root, x))]
+            self._add_watch(root)
+
+    def _add_folder(self, folder: str) -> bool:
+        """Watches the folder recursively or its closest existing parent if it is missing.
+
+        :returns: True if the folder exists and is watched.
+        """
+        if os.path.isdir(folder):
+            self._missing.discard(folder)
+            self._add_tree(folder)
+            return True
+        self._missing.add(folder)
+        parent = os.path.dirname(folder)
+        while not os.path.isdir(parent) and os.path.dirname(parent) != parent:
+            parent = os.path.dirname(parent)
+        self._add_watch(parent)
+        return False
+
+    def _relevant(self, path: str) -> bool:
+        if path in self._files:
+            return True
+        if self.ignored(path):
+            return False
+        return any(path.startswith(x + os.sep) for x in self._folders)
+
+    def _read(self) -> Set[str]:
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                # Events got lost. Report everything as changed to be on the safe side.
+                changed |= self._files | self._folders
+                continue
+            if wd not in self._watches or not name:
+                continue
+            path = os.path.join(self._watches[wd], name)
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                # A missing folder (or one of its parents) appeared. Files might have been
+                # created before the watch was added, hence the whole folder is reported.
+                for folder in [x for x in self._missing
+                               if x == path or x.startswith(path + os.sep)]:
+                    if self._add_folder(folder):
+                        changed.add(folder)
+            if not self._relevant(path):
+                continue
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._add_tree(path)
+            changed.add(path)
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            remaining = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                return set()
+            changed = self._read()
+            if changed:
+                return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(paths: Iterable[str], ignore: Iterable[str] = [],
+                   polling: Optional[bool] = None, folders: Iterable[str] = []):
+    """Creates an inotify-based watcher and falls back to polling when it is not available.
+
+    :param polling: Force (True) or disable (False) polling. (None -> ``CT_WATCH_POLLING``)
+    :param folders: Folders that are watched recursively even if they do not exist yet.
+    """
+    paths = list(paths)
+    folders = list(folders)
+    if polling is None:
+        polling = ConanTools.env_flag("CT_WATCH_POLLING")
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths, ignore, folders=folders)
+        except (OSError, AttributeError):
+            # E.g., exhausted watch limits or a libc without inotify.
+            pass
+    return PollingWatcher(paths, ignore, folders=folders)
+
+
+def debounce(watcher, delay: float = 0.3, timeout: Optional[float] = None) -> Set[str]:
+    """Waits for changes and collects further ones until none occurred for delay seconds."""
+    changed = watcher.wait(timeout)
+    while changed:
+        more = watcher.wait(delay)
+        if not more:
+            break
+        changed |= more
+    return changed
+
+
+def affected_stages(changed: Set[str], config_files: Iterable[str]) -> List[str]:
+    """Determines the stages that have to be executed again after the paths changed."""
+    if changed & set(os.path.abspath(x) for x in config_files):
+        return list(INSTALL_STAGES)
+    return list(SOURCE_STAGES)
+
+
+def _profile_files(profiles: List[str],
+                   session: Optional[Conan.ConanSession] = None) -> List[str]:
+    from ConanTools import Profile
+    files = []
+    for name in profiles:
+        path = Profile.resolve_path(name, session=session)
+        if path is not None:
+            # Watch the whole include chain of the profile.
+            files.extend(Profile.Profile.load(path, session=session).files)
+    return files
+
+
+def watch(recipe: Conan.Recipe, user: str, channel: str, profiles: List[str] = [],
+          options: Dict[str, str] = {}, build: List[Optional[str]] = ["outdated"],
+          remote: Optional[str] = None, pkg_folder: Optional[str] = None,
+          export_pkg: bool = False, delay: float = 0.3, polling: Optional[bool] = None,
+          cancel: Optional[Conan.CancellationToken] = None,
+          max_cycles: Optional[int] = None) -> int:
+    """Builds the recipe with the local flow and rebuilds it whenever something changes.
+
+    Failing stages are reported but do not stop watching. The next cycle then starts at least
+    with the first stage of the failed cycle. Watching ends when the cancellation token gets
+    cancelled, after max_cycles build cycles, or on a KeyboardInterrupt.
+
+    :param export_pkg: Also execute export-pkg after every successful package stage.
+    :param delay: Number of seconds without further changes before a cycle starts.
+    :returns: The number of executed build cycles.
+    """
+    layout = recipe.layout
+    src_folder = layout.src_folder(recipe)
+    config_files = [recipe.path] + _profile_files(profiles, session=recipe.session)
+    # Ignore everything the flow writes itself. Otherwise, the watcher would notice its own
+    # output (e.g., the helper scripts in the recipe folder) and rebuild forever.
+    root = layout.root(recipe)
+    ignore = [layout.build_folder(recipe), pkg_folder or layout.pkg_folder(recipe)]
+    ignore += [Conan.conan_sh_file_path(root, x) for x in SCRIPTS]
+
+    def start_watcher():
+        return create_watcher(config_files, ignore=ignore, polling=polling, folders=[src_folder])
+
+    # The source folder of a recipe with external sources is only created by the first cycle.
+    # Start watching afterwards such that the fetched sources do not trigger a rebuild.
+    watcher = start_watcher() if os.path.isdir(src_folder) else None
+
+    def run_cycle(stages: List[str]) -> bool:
+        Conan.log("[watch] Executing {}".format(", ".join(stages)), session=recipe.session)
+        try:
+            if "install" in stages:
+                recipe.install(profiles=profiles, options=options, build=build, remote=remote,
+                               add_script=True)
+            if "source" in stages and recipe.external_source:
+                recipe.source(add_script=True)
+            recipe.build(pkg_folder=pkg_folder, add_script=True)
+            recipe.package(pkg_folder=pkg_folder, add_script=True)
+            if export_pkg:
+                recipe.export_pkg(user=user, channel=channel, profiles=profiles,
+                                  options=options, pkg_folder=pkg_folder, add_script=True)
+            return True
+        except Exception:
+            traceback.print_exc()
+            return False
+
+    cycles = 0
+    try:
+        stages = list(INSTALL_STAGES)
+        while True:
+            ok = run_cycle(stages)
+            cycles += 1
+            # Keep the earlier stages of a failed cycle for the next attempt.
+            pending = [] if ok else stages
+            if max_cycles is not None and cycles >= max_cycles:
+                break
+            if watcher is None:
+                watcher = start_watcher()
+            Conan.log("[watch] Waiting for changes in {}".format(src_folder),
+                      session=recipe.session)
+            changed = set()
+            while not changed:
+                if cancel is not None and cancel.cancelled:
+                    return cycles
+                changed = debounce(watcher, delay, timeout=0.5)
+            stages = affected_stages(changed, config_files)
+            if len(pending) > len(stages):
+                stages = pending
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.close()
+    return cycles
@@ -1,10 +1,34 @@
+import importlib
 import os
 import string
-from typing import Dict, List, Optional
+import sys
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
 
-import ConanTools.Conan as Conan
-import ConanTools.Repack
-import ConanTools.Version
+if TYPE_CHECKING:
+    from ConanTools import Conan  # noqa
+
+# The submodules are loaded lazily on first access to keep the import cheap for recipes that only
+# need, for example, ``slug`` or ``env_flag``. For backwards compatibility, ``from ConanTools
+# import *`` still exports the modules that used to be imported eagerly (i.e., it loads them).
+__all__ = ["slug", "env_flag", "pkg_create", "pkg_create_matrix", "pkg_import", "ws_import",
+           "write_helper_scripts", "Conan", "ConanTools", "Repack", "Version"]
+
+_SUBMODULES = ("Cache", "Conan", "DiskUsage", "Git", "Hack", "JobServer", "Manifest", "Metrics",
+               "Profile", "Remotes", "Repack", "SourceStore", "Version", "Watch")
+
+
+def __getattr__(name: str):
+    """Imports the submodules on first attribute access (see PEP 562)."""
+    if name in _SUBMODULES:
+        return importlib.import_module("{}.{}".format(__name__, name))
+    if name == "ConanTools":
+        # Former star imports also exported the package itself.
+        return sys.modules[__name__]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(_SUBMODULES))
 
 
 def slug(input: Optional[str]) -> Optional[str]:
@@ -45,29 +69,74 @@ def env_flag(name: str, default: bool = False) -> bool:
     return True
 
 
-def pkg_create(recipe: Conan.Recipe, user: str, channel: str, name: Optional[str] = None,
+def pkg_create(recipe: 'Conan.Recipe', user: str, channel: str, name: Optional[str] = None,
                version: Optional[str] = None, remote: Optional[str] = None,
                profiles: List[Optional[str]] = ["outdated"], options: Dict[str, str] = {},
                build: Optional[List[str]] = None, cwd: Optional[str] = None,
-               layout: Optional['Conan.PkgLayout'] = None, create_local: Optional[bool] = None):
+               layout: Optional['Conan.PkgLayout'] = None, create_local: Optional[bool] = None,
+               cpu_pool: Optional['Conan.CpuPool'] = None):
     """Creates a package from the recipe using either the local or cache-based workflow.
 
     The ``CT_CREATE_LOCAL`` environment variable is used to enable the local instead of the
     cache-based flow. By default, the local flow builds into fixed directories next to the recipe
     which is more comfortable during development and also better suited for build caching.
+
+    :param cpu_pool: Limits the build to a share of the cores when builds run concurrently.
     """
     if create_local is None:
         create_local = env_flag("CT_CREATE_LOCAL")
     if create_local:
         recipe.create_local(user=user, channel=channel, name=name, version=version, remote=remote,
                             profiles=profiles, options=options, build=build, layout=layout,
-                            add_script=True)
+                            add_script=True, cpu_pool=cpu_pool)
     else:
         recipe.create(user=user, channel=channel, name=name, version=version, remote=remote,
-                      profiles=profiles, options=options, build=build, cwd=cwd)
+                      profiles=profiles, options=options, build=build, cwd=cwd,
+                      cpu_pool=cpu_pool)
+
+
+def pkg_create_matrix(recipe: 'Conan.Recipe', user: str, channel: str,
+                      configurations: List[Tuple[List[str], Dict[str, str]]],
+                      name: Optional[str] = None, version: Optional[str] = None,
+                      remote: Optional[str] = None, build: Optional[List[str]] = None,
+                      cwd: Optional[str] = None, layout: Optional['Conan.PkgLayout'] = None,
+                      create_local: Optional[bool] = None,
+                      max_workers: Optional[int] = None) -> Dict[str, List[int]]:
+    """Creates the package for every (profiles, options) configuration of a build matrix.
+
+    Configurations that map to the same package id (e.g., because an option does not affect the
+    binary) are only built once, using the first configuration of each group. All commands are
+    executed in the session of the recipe.
+
+    :returns: The indices of the configurations grouped by their package id.
+    """
+    from ConanTools import Conan
+    groups = Conan.group_by_package_id(recipe.path, configurations, remote=remote,
+                                       max_workers=max_workers, session=recipe.session)
+    for package_id, indices in groups.items():
+        profiles, options = configurations[indices[0]]
+        Conan.log("Creating package {} for configurations {}".format(package_id, indices),
+                  session=recipe.session)
+        pkg_create(recipe=recipe, user=user, channel=channel, name=name, version=version,
+                   remote=remote, profiles=profiles, options=options, build=build, cwd=cwd,
+                   layout=layout, create_local=create_local)
+    return groups
+
+
+def _qualify_options(options: Dict[str, str], names: List[str]) -> Dict[str, str]:
+    # Unqualified options of a conanfile.txt consumer do not reach the imported packages. Hence,
+    # they are qualified with the package names.
+    full_opt = {}
+    for k, v in options.items():
+        if ":" in k:
+            full_opt[k] = v
+        else:
+            for name in names:
+                full_opt["{}:{}".format(name, k)] = v
+    return full_opt
 
 
-def pkg_import(recipe: Conan.Recipe, user: str, channel: str, name: Optional[str] = None,
+def pkg_import(recipe: 'Conan.Recipe', user: str, channel: str, name: Optional[str] = None,
                version: Optional[str] = None, remote: Optional[str] = None,
                profiles: List[str] = [], options: Dict[str, str] = {},
                build: List[Optional[str]] = ["outdated"], pkg_folder: Optional[str] = None,
@@ -83,14 +152,7 @@ def pkg_import(recipe: Conan.Recipe, user: str, channel: str, name: Optional[str
         enable_subpackages = env_flag("CT_ENABLE_SUBPACKAGES")
 
     reference = recipe.reference(user=user, channel=channel, name=name, version=version)
-
-    # qualify the options with the package name
-    full_opt = {}
-    for k, v in options.items():
-        if ":" in k:
-            full_opt[k] = v
-        else:
-            full_opt["{}:{}".format(reference.name, k)] = v
+    full_opt = _qualify_options(options, [reference.name])
 
     if not enable_subpackages:
         # Build package with the local flow but skip real package creation. Install
@@ -104,11 +166,12 @@ def pkg_import(recipe: Conan.Recipe, user: str, channel: str, name: Optional[str
         return
 
     # Try to import an already existing package but without building it.
-    importFile = ConanTools.Repack.ConanImportTxtFile()
+    from ConanTools import Repack
+    importFile = Repack.ConanImportTxtFile()
     importFile.add_package(reference)
     try:
         importFile.install(remote=remote, profiles=profiles, options=full_opt, build=[],
-                           cwd=pkg_folder)
+                           cwd=pkg_folder, session=recipe.session)
         return
     except ValueError:
         pass
@@ -116,21 +179,25 @@ def pkg_import(recipe: Conan.Recipe, user: str, channel: str, name: Optional[str
     # Build the package using the local or cache-based workflow and then import the content.
     pkg_create(recipe=recipe, user=user, channel=channel, name=name, version=version, remote=remote,
                profiles=profiles, options=full_opt, build=build)
-    importFile.install(remote=remote, profiles=profiles, options=full_opt, build=[], cwd=pkg_folder)
+    importFile.install(remote=remote, profiles=profiles, options=full_opt, build=[], cwd=pkg_folder,
+                       session=recipe.session)
 
 
-def ws_import(ws: Conan.Workspace, user: str, channel: str, name: Optional[str] = None,
+def ws_import(ws: 'Conan.Workspace', user: str, channel: str, name: Optional[str] = None,
               version: Optional[str] = None, remote: Optional[str] = None,
               profiles: List[str] = [], options: Dict[str, str] = {},
               build: List[Optional[str]] = ["outdated"], pkg_folder: Optional[str] = None,
               enable_subpackages: Optional[bool] = None, cwd=None,
-              pkg_folder_override: Dict[Conan.Recipe, str] = {}):
+              pkg_folder_override: Dict['Conan.Recipe', str] = {},
+              max_workers: Optional[int] = None):
     """Imports the workspace content, after building it if necessary, into the pkg_folder.
 
     By default, subpackages are built using the local flow and directly use the specified
     pkg_folder. This mode is similar to, for example, a superbuild using cmake. Alternatively,
     if the ``CT_ENABLE_SUBPACKAGES`` environment variable is defined, each subpackage is
-    created individually and gets subsequently imported into the pkg_folder.
+    created individually and gets subsequently imported into the pkg_folder. Subpackages that
+    are independent according to the conan graph of the configuration are created in parallel
+    (at most max_workers at once) and share the cores via a :class:`ConanTools.Conan.CpuPool`.
     """
     pkg_folder = pkg_folder or os.getcwd()
     if enable_subpackages is None:
@@ -144,16 +211,87 @@ def ws_import(ws: Conan.Workspace, user: str, channel: str, name: Optional[str]
                         pkg_folder_override=pkg_folder_override, add_script=True)
         return
 
-    assert False
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    from ConanTools import Conan, Repack
+    refs = ws.references(user, channel, max_workers=max_workers)
+    by_folder = {}
+    for recipe, ref in zip(ws.recipes, refs):
+        by_folder.setdefault(pkg_folder_override.get(recipe, pkg_folder), []).append(ref)
+
+    def import_all(build):
+        # One install per destination folder instead of one per package.
+        for folder, folder_refs in by_folder.items():
+            importFile = Repack.ConanImportTxtFile()
+            importFile.add_packages(folder_refs)
+            importFile.install(remote=remote, profiles=profiles, build=build, cwd=folder,
+                               options=_qualify_options(options, [x.name for x in folder_refs]),
+                               session=ws.session)
+
+    # Try to import already existing packages but without building them.
+    try:
+        import_all(build=[])
+        return
+    except ValueError:
+        pass
+
+    # Create the packages in parallel as soon as all their dependencies have been created.
+    deps = ws.graph_dependencies(refs, profiles=profiles, options=options, remote=remote,
+                                 max_workers=max_workers)
+    names = {recipe: ref.name for recipe, ref in zip(ws.recipes, refs)}
+    done = set()
+    running = {}
+    pending = list(ws.recipes)
+    error = None
+    workers = max_workers or max(1, min(len(pending), os.cpu_count() or 1))
+    cpu_pool = Conan.CpuPool(parallel=workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while (pending and error is None) or running:
+            if error is None:
+                for recipe in [x for x in pending if all(d in done for d in deps[x])]:
+                    pending.remove(recipe)
+                    running[executor.submit(
+                        pkg_create, recipe=recipe, user=user, channel=channel, remote=remote,
+                        profiles=profiles, build=build, cwd=cwd, cpu_pool=cpu_pool,
+                        options=_qualify_options(options, [names[recipe]]))] = recipe
+            # Later builds get larger shares of the cores while the queue drains.
+            cpu_pool.parallel = max(1, min(workers, len(pending) + len(running)))
+            if not running:
+                raise ValueError("Workspace contains circular dependencies!")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                recipe = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                else:
+                    done.add(recipe)
+    if error is not None:
+        raise error
+    import_all(build=[])
 
 
 def write_helper_scripts(filedir: str, recipe_path: str, src_folder: str = None,
-                         build_folder: str = None, pkg_folder: str = None):
+                         build_folder: str = None, pkg_folder: str = None,
+                         session: Optional['Conan.ConanSession'] = None):
     """Generate helper shell scripts for executing the build and package stage.
     """
+    from ConanTools import Conan
     Conan.write_conan_sh_file(filedir, "build",
                               ["build", recipe_path, "--source-folder=" + src_folder,
-                               "--package-folder=" + pkg_folder], build_folder)
+                               "--package-folder=" + pkg_folder], build_folder, session=session)
     Conan.write_conan_sh_file(filedir, "package",
                               ["package", recipe_path, "--package-folder=" + pkg_folder],
-                              build_folder)
+                              build_folder, session=session)
+
+
+def _load_eagerly():
+    # Importing a submodule binds it in the package namespace. The package itself has to be
+    # bound explicitly because it is part of __all__.
+    for name in _SUBMODULES:
+        importlib.import_module("{}.{}".format(__name__, name))
+    globals()["ConanTools"] = sys.modules[__name__]
+
+
+# Module level __getattr__ is only supported since Python 3.7. Fall back to eager loading for
+# older interpreters.
+if sys.version_info < (3, 7):
+    _load_eagerly()
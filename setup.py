@@ -46,6 +46,7 @@ setup(author='Mario Werner',
       description='Helpers and tools that make working with conan more convenient.',
       extras_require={
           'documentation': ['sphinx', 'sphinx-autodoc-typehints'],
+          'zstd': ['zstandard'],
       },
       license='MIT',
       long_description=readme(),
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def inspect_fields():
+    # Test modules override this fixture to add or replace fields of the inspected recipes.
+    return lambda name: {}
+
+
+@pytest.fixture
+def mock_inspect(mocker, inspect_fields):
+    # Derive the recipe name from the directory that contains the recipe.
+    def inspect(path_or_ref, attribute=None, default=None, remote=None, session=None):
+        name = os.path.basename(os.path.dirname(path_or_ref))
+        fields = {"name": name, "version": "1.0"}
+        fields.update(inspect_fields(name))
+        if attribute:
+            return fields.get(attribute, default)
+        return fields
+    return mocker.patch('ConanTools.Conan.inspect', side_effect=inspect)
@@ -0,0 +1,155 @@
+import os
+import sys
+import tarfile
+import threading
+import types
+import zlib
+
+import pytest
+
+from ConanTools import Repack
+
+
+def make_pkg_folder(folder):
+    os.makedirs(str(folder / "include" / "foo"))
+    os.makedirs(str(folder / "lib"))
+    (folder / "include" / "foo" / "foo.h").write_text("int foo();\n")
+    (folder / "lib" / "libfoo.a").write_bytes(os.urandom(300 * 1024))
+    (folder / "bin").write_text("#!/bin/sh\n")
+    os.chmod(str(folder / "bin"), 0o775)
+    os.symlink("libfoo.a", str(folder / "lib" / "libfoo.so"))
+
+
+@pytest.mark.parametrize("suffix", [".tar.xz", ".tar.gz", ".tar"])
+def test_create_archive_is_reproducible(tmp_path, suffix):
+    pkg = tmp_path / "pkg"
+    make_pkg_folder(pkg)
+    first = str(tmp_path / ("first" + suffix))
+    second = str(tmp_path / ("second" + suffix))
+    Repack.create_archive(str(pkg), first, threads=1, chunk_size=64 * 1024)
+    os.utime(str(pkg / "lib" / "libfoo.a"), (1234, 1234))
+    Repack.create_archive(str(pkg), second, threads=4, chunk_size=64 * 1024)
+    with open(first, 'rb') as f1, open(second, 'rb') as f2:
+        assert f1.read() == f2.read()
+
+    with tarfile.open(first) as tar:
+        members = tar.getmembers()
+        assert [x.name for x in members] == ["bin", "include", "include/foo", "include/foo/foo.h",
+                                             "lib", "lib/libfoo.a", "lib/libfoo.so"]
+        assert all(x.mtime == 0 and x.uid == 0 and x.uname == "" for x in members)
+        assert tar.getmember("bin").mode == 0o755
+        assert tar.getmember("lib/libfoo.so").linkname == "libfoo.a"
+        assert tar.extractfile("lib/libfoo.a").read() == (pkg / "lib" / "libfoo.a").read_bytes()
+
+
+def test_create_archive_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    pkg = tmp_path / "pkg"
+    make_pkg_folder(pkg)
+    archive = str(tmp_path / "pkg.tar.zst")
+    Repack.create_archive(str(pkg), archive, chunk_size=64 * 1024)
+    with open(archive, 'rb') as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            assert "lib/libfoo.a" in [x.name for x in tar]
+
+
+def test_create_archive_zstd_compressor_per_thread(tmp_path, mocker):
+    # zstandard compressors are not thread-safe. Check that no instance is shared between the
+    # compression threads (with a fake module to also run without zstandard).
+    owners = {}
+
+    class ZstdCompressor():
+        def __init__(self, level):
+            self.level = level
+
+        def compress(self, data):
+            owner = owners.setdefault(id(self), threading.get_ident())
+            assert owner == threading.get_ident()
+            return zlib.compress(data)
+    mocker.patch.dict(sys.modules, {"zstandard": types.SimpleNamespace(
+        ZstdCompressor=ZstdCompressor)})
+    pkg = tmp_path / "pkg"
+    make_pkg_folder(pkg)
+    Repack.create_archive(str(pkg), str(tmp_path / "pkg.tar.zst"), threads=4,
+                          chunk_size=16 * 1024)
+    assert len(owners) > 1
+
+
+def test_archive_compression():
+    assert Repack.archive_compression("a.tar.zst") == "zst"
+    assert Repack.archive_compression("a.tgz") == "gz"
+    assert Repack.archive_compression("a.tar") is None
+    with pytest.raises(ValueError):
+        Repack.archive_compression("a.zip")
+
+
+@pytest.mark.parametrize("suffix", [".tar.xz", ".tar"])
+def test_extract_archive_is_incremental(tmp_path, suffix):
+    pkg = tmp_path / "pkg"
+    make_pkg_folder(pkg)
+    archive = str(tmp_path / ("pkg" + suffix))
+    Repack.create_archive(str(pkg), archive, chunk_size=64 * 1024)
+
+    out = tmp_path / "out"
+    written, skipped = Repack.extract_archive(archive, str(out))
+    assert "lib/libfoo.a" in written and skipped == []
+    assert (out / "lib" / "libfoo.a").read_bytes() == (pkg / "lib" / "libfoo.a").read_bytes()
+    assert os.readlink(str(out / "lib" / "libfoo.so")) == "libfoo.a"
+    assert os.stat(str(out / "bin")).st_mode & 0o777 == 0o755
+
+    # Only modified and missing files are written again.
+    data = bytearray((out / "lib" / "libfoo.a").read_bytes())
+    data[-1] ^= 0xff
+    (out / "lib" / "libfoo.a").write_bytes(bytes(data))
+    os.unlink(str(out / "include" / "foo" / "foo.h"))
+    os.utime(str(out / "bin"), (1234, 1234))
+    written, skipped = Repack.extract_archive(archive, str(out))
+    assert sorted(written) == ["include/foo/foo.h", "lib/libfoo.a"]
+    assert sorted(skipped) == ["bin", "lib/libfoo.so"]
+    assert os.stat(str(out / "bin")).st_mtime == 1234
+    assert (out / "lib" / "libfoo.a").read_bytes() == (pkg / "lib" / "libfoo.a").read_bytes()
+
+
+def test_extract_archive_filters(tmp_path):
+    pkg = tmp_path / "pkg"
+    make_pkg_folder(pkg)
+    archive = str(tmp_path / "pkg.tar.gz")
+    Repack.create_archive(str(pkg), archive)
+    out = tmp_path / "out"
+    written, _ = Repack.extract_archive(archive, str(out), filters=["include/", "*.so"])
+    assert sorted(written) == ["include", "include/foo", "include/foo/foo.h", "lib/libfoo.so"]
+    assert not os.path.exists(str(out / "bin"))
+
+
+@pytest.mark.parametrize("suffix", [".tar", ".tar.gz"])
+def test_extract_archive_hardlinks(tmp_path, suffix):
+    (tmp_path / "data").write_bytes(b"shared content")
+    archive = str(tmp_path / ("links" + suffix))
+    with tarfile.open(archive, "w:gz" if suffix == ".tar.gz" else "w") as tar:
+        tar.add(str(tmp_path / "data"), "a/data")
+        link = tarfile.TarInfo("b/data")
+        link.type = tarfile.LNKTYPE
+        link.linkname = "a/data"
+        tar.addfile(link)
+    written, _ = Repack.extract_archive(archive, str(tmp_path / "all"))
+    assert written == ["a/data", "b/data"]
+    assert (tmp_path / "all" / "b" / "data").read_bytes() == b"shared content"
+
+    # The target is filtered out and only random access archives still provide its data.
+    out = str(tmp_path / "filtered")
+    if suffix == ".tar":
+        assert Repack.extract_archive(archive, out, filters=["b/"])[0] == ["b/data"]
+        assert (tmp_path / "filtered" / "b" / "data").read_bytes() == b"shared content"
+    else:
+        with pytest.raises(ValueError, match="not extracted"):
+            Repack.extract_archive(archive, out, filters=["b/"])
+
+
+def test_extract_archive_rejects_escaping_members(tmp_path):
+    archive = str(tmp_path / "evil.tar")
+    with tarfile.open(archive, "w") as tar:
+        tar.addfile(tarfile.TarInfo("../evil"))
+    with pytest.raises(ValueError, match="outside"):
+        Repack.extract_archive(archive, str(tmp_path / "out"))
+    assert not os.path.exists(str(tmp_path / "evil"))
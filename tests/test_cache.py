@@ -0,0 +1,66 @@
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+import io
+import os
+
+from ConanTools import Cache, Conan
+
+NOW = datetime(2020, 1, 10)
+
+
+def make_ref(storage, ref, days_old, size, now=NOW):
+    path = storage.joinpath(*ref.replace("@", "/").split("/"))
+    os.makedirs(str(path / "export"))
+    os.makedirs(str(path / "package" / "123"))
+    timestamp = int((now - timedelta(days=days_old)).timestamp())
+    (path / "export" / "conanmanifest.txt").write_text("{}\nconanfile.py: 1234\n".format(timestamp))
+    (path / "package" / "123" / "lib.a").write_bytes(b"x" * size)
+    # Hardlinked files are only counted once.
+    os.link(str(path / "package" / "123" / "lib.a"), str(path / "package" / "123" / "lib2.a"))
+
+
+def test_cache_entries_and_evictions(tmp_path):
+    make_ref(tmp_path, "a/1.0@user/stable", 9, 1000)
+    make_ref(tmp_path, "a/2.0@user/stable", 1, 2000)
+    make_ref(tmp_path, "b/1.0@_/_", 5, 4000)
+    entries = Cache.entries(str(tmp_path))
+    assert [str(x.ref) for x in entries] == ["a/1.0@user/stable", "a/2.0@user/stable",
+                                             "b/1.0@_/_"]
+    sizes = [x.size for x in entries]
+    assert 1000 < sizes[0] < 1500 and 2000 < sizes[1] < 2500 and 4000 < sizes[2] < 4500
+    assert entries[0].created == NOW - timedelta(days=9)
+
+    def evict(**kwargs):
+        return [str(x.ref) for x in Cache.select_evictions(entries, now=NOW, **kwargs)]
+    assert evict() == []
+    assert evict(max_age=timedelta(days=7)) == ["a/1.0@user/stable"]
+    assert evict(max_size=5000) == ["a/1.0@user/stable", "b/1.0@_/_"]
+    assert evict(max_size=1 << 20, max_age=timedelta(days=3)) == ["a/1.0@user/stable",
+                                                                  "b/1.0@_/_"]
+
+
+def test_cache_prune(tmp_path, mocker):
+    now = datetime.now()
+    make_ref(tmp_path, "a/1.0@user/stable", 9, 1000, now)
+    make_ref(tmp_path, "b/1.0@_/_", 8, 1000, now)
+    make_ref(tmp_path, "c/1.0@user/stable", 1, 1000, now)
+    popen = mocker.patch('ConanTools.Conan._run_cancellable',
+                         side_effect=lambda *args: mocker.Mock(returncode=0, stdout=b""))
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        evicted = Cache.prune(max_age=timedelta(days=7), dry_run=True, storage=str(tmp_path))
+    assert len(evicted) == 2
+    assert "Evicting 2 of 3 references" in output.getvalue()
+    assert popen.call_count == 0
+
+    # The report is written to the log sink of the session.
+    log = io.StringIO()
+    session = Conan.ConanSession(log=log)
+    with redirect_stdout(output):
+        Cache.prune(max_age=timedelta(days=7), storage=str(tmp_path), max_workers=2,
+                    session=session)
+    assert output.getvalue().count("Evicting 2 of 3 references") == 1
+    assert "Evicting 2 of 3 references" in log.getvalue()
+    removed = sorted(x[0][0][1:] for x in popen.call_args_list)
+    assert removed == [["remove", "-f", "a/1.0@user/stable"], ["remove", "-f", "b/1.0@"]]
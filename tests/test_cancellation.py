@@ -0,0 +1,61 @@
+from ConanTools import Conan
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+import io
+import os
+import pytest
+import sys
+import time
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="uses POSIX shell commands")
+
+
+def test_run_timeout(tmp_path):
+    start = time.monotonic()
+    with redirect_stdout(io.StringIO()):
+        with pytest.raises(ValueError, match="timeout"):
+            Conan.run(["-c", "sleep 30"], cwd=str(tmp_path), conan_cmd="sh", timeout=0.5)
+    assert time.monotonic() - start < 10
+
+
+def test_run_kills_process_group(tmp_path):
+    # The background process inherits the process group and has to be killed too.
+    pid_file = str(tmp_path / "pid")
+    token = Conan.CancellationToken(timeout=0.5)
+    with redirect_stdout(io.StringIO()):
+        with pytest.raises(ValueError, match="global timeout"):
+            Conan.run(["-c", "sleep 30 & echo $! > {}; wait".format(pid_file)],
+                      cwd=str(tmp_path), conan_cmd="sh", cancel=token)
+    with open(pid_file) as f:
+        pid = int(f.read())
+    for _ in range(50):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail("background process is still running")
+
+
+def test_run_fail_fast(tmp_path):
+    token = Conan.CancellationToken()
+
+    def run(script):
+        Conan.run(["-c", script], cwd=str(tmp_path), conan_cmd="sh", cancel=token)
+
+    start = time.monotonic()
+    with redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            slow = executor.submit(run, "sleep 30")
+            failing = executor.submit(run, "sleep 0.2; exit 3")
+            with pytest.raises(ValueError, match="returncode=3"):
+                failing.result()
+            with pytest.raises(Conan.CommandAborted, match="aborted"):
+                slow.result()
+    assert time.monotonic() - start < 10
+    assert token.cancelled
+
+    # Commands using a cancelled token are not started at all.
+    with pytest.raises(Conan.CommandAborted, match="aborted"):
+        Conan.run([sys.executable, "--version"], cancel=token)
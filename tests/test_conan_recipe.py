@@ -29,13 +29,9 @@ inspectJSON = """
 
 
 @pytest.fixture
-def mock_inspect(mocker):
-    # Mock the methods that are used internally to inspect a conanfile.
-    mocker.patch('tempfile.NamedTemporaryFile')
-    mocker.patch('subprocess.check_call')
-    mocker.patch('builtins.open')
-    mocker.patch('os.unlink')
-    mocker.patch('json.load', return_value=json.loads(inspectJSON))
+def inspect_fields():
+    # All recipes are inspected as the ConanTools recipe (see mock_inspect in conftest.py).
+    return lambda name: json.loads(inspectJSON)
 
 
 @pytest.fixture
@@ -69,6 +65,37 @@ def test_get_recipe_field(mocker, mock_inspect):
     assert Conan.get_recipe_field("a.py", "version") == "0.1.1-post7+ga21edb7f08"
 
 
+def test_recipe_field_cache(mocker, tmp_path):
+    inspect = mocker.patch('ConanTools.Conan.inspect',
+                           side_effect=lambda path, attribute, default, session=None:
+                           open(path).read() + ":" + attribute)
+    recipe_path = tmp_path / "conanfile.py"
+    recipe_path.write_text("a")
+    cache = Conan.RecipeFieldCache(maxsize=2)
+    assert cache.get(str(recipe_path), "name") == "a:name"
+    assert cache.get(str(recipe_path), "name") == "a:name"
+    assert inspect.call_count == 1
+    assert cache.info() == Conan.CacheInfo(hits=1, misses=1, maxsize=2, currsize=1)
+
+    # Changing the recipe invalidates the entry.
+    recipe_path.write_text("bb")
+    assert cache.get(str(recipe_path), "name") == "bb:name"
+    assert inspect.call_count == 2
+
+    # The least recently used entry is evicted.
+    cache.get(str(recipe_path), "version")
+    cache.get(str(recipe_path), "name")
+    cache.get(str(recipe_path), "license")
+    assert cache.info().currsize == 2
+    cache.get(str(recipe_path), "name")
+    cache.get(str(recipe_path), "version")
+    assert cache.info().hits == 3
+    assert inspect.call_count == 5
+
+    cache.clear()
+    assert cache.info() == Conan.CacheInfo(hits=0, misses=0, maxsize=2, currsize=0)
+
+
 def test_recipe_reference(mock_inspect):
     recipe = Conan.Recipe("foobar.py")
     ref = recipe.reference("foo", "testing")
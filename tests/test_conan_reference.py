@@ -157,3 +157,50 @@ def test_reference_upload_all(mock_run):
     with redirect_stdout(output):
         ref.upload_all(remote="baz")
     assert "$ conan upload foo/1.2.3@bar/testing --remote baz --all -c" in output.getvalue()
+
+
+def test_prefetch(mock_run, mocker):
+    mock_run.returncode = 0
+    graph = mocker.patch('ConanTools.Conan._run_json', return_value=[
+        {"reference": "conanfile.py (foo/1.0)", "is_ref": False, "id": "123"},
+        {"reference": "bar/1.0@a/b", "is_ref": True, "id": "456"},
+        {"reference": "baz/2.0@a/b", "is_ref": True, "id": "789"}])
+
+    # Only the recipes are downloaded when no profiles are given.
+    output = io.StringIO()
+    with redirect_stdout(output):
+        targets = Conan.prefetch([Conan.Reference("foo", "1.2.3", "bar", "testing")], remote="r")
+    assert targets == ["foo/1.2.3@bar/testing"]
+    assert "$ conan download foo/1.2.3@bar/testing --recipe --remote r" in output.getvalue()
+    assert graph.call_count == 0
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        targets = Conan.prefetch(["foo/1.0@a/b"], profiles=["p"])
+    graph.assert_called_once_with(["info", "foo/1.0@a/b", "--profile", "p"], session=None)
+    assert targets == ["bar/1.0@a/b:456", "baz/2.0@a/b:789"]
+    assert "$ conan download bar/1.0@a/b --package 456" in output.getvalue()
+    assert "$ conan download baz/2.0@a/b --package 789" in output.getvalue()
+
+
+def test_prefetch_skips_unavailable_binaries(mocker):
+    mocker.patch('os.makedirs')
+
+    def run(cmd, **kwargs):
+        # The binary of qux is not on the remote.
+        return mocker.Mock(returncode=1 if "qux/1.0@a/b" in cmd else 0)
+    run = mocker.patch('subprocess.run', side_effect=run)
+    nodes = [{"reference": "conanfile.py (foo/1.0)", "is_ref": False, "id": "123"},
+             {"reference": "bar/1.0@a/b", "is_ref": True, "id": "456", "binary": "Download"},
+             {"reference": "baz/1.0@a/b", "is_ref": True, "id": "789", "binary": "Missing"},
+             {"reference": "zlib/1.0@a/b", "is_ref": True, "id": "abc", "binary": "Cache"},
+             {"reference": "qux/1.0@a/b", "is_ref": True, "id": "def"}]
+    output = io.StringIO()
+    with redirect_stdout(output):
+        targets = Conan.prefetch(nodes=nodes)
+    assert targets == ["bar/1.0@a/b:456"]
+    downloads = sorted(x[0][0][1:] for x in run.call_args_list)
+    assert downloads == [["download", "bar/1.0@a/b", "--package", "456"],
+                         ["download", "qux/1.0@a/b", "--package", "def"]]
+    assert "Prefetching skipped 2 binaries: baz/1.0@a/b:789 (Missing), " \
+        "qux/1.0@a/b:def (failed)" in output.getvalue()
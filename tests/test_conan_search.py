@@ -0,0 +1,59 @@
+import io
+import json
+import tracemalloc
+
+import pytest
+
+from ConanTools import Conan
+
+
+def fake_conan_json(mocker, document):
+    # Write the document to the file that is passed via --json.
+    def check_call(cmd, **kwargs):
+        with open(cmd[cmd.index("--json") + 1], 'w') as f:
+            json.dump(document, f)
+    return mocker.patch('subprocess.check_call', side_effect=check_call)
+
+
+def test_json_reader():
+    document = {"a": [1, 2.5, "x\"y", None], "b": {"c": [], "d": {}}, "e": 12345678}
+    reader = Conan._JsonReader(io.StringIO(json.dumps(document)), chunk_size=3)
+    result = {}
+    for key in reader.keys():
+        if key == "a":
+            result[key] = [reader.value() for _ in reader.items()]
+        else:
+            result[key] = reader.value()
+    assert result == document
+
+    reader = Conan._JsonReader(io.StringIO("[1, 2"), chunk_size=3)
+    with pytest.raises(ValueError):
+        [reader.value() for _ in reader.items()]
+
+
+def test_iter_search(mocker):
+    count = 20000
+    document = {"error": False, "results": [{"remote": "r", "items": [
+        {"recipe": {"id": "pkg{}/1.0@user/channel".format(i)}} for i in range(count)]}]}
+    fake_conan_json(mocker, document)
+    mocker.patch('ConanTools.Conan.json.load', side_effect=AssertionError("not incremental"))
+
+    refs = Conan.iter_search("pkg*", remote="r")
+    first = next(refs)
+    assert str(first) == "pkg0/1.0@user/channel"
+    tracemalloc.start()
+    n = 1 + sum(1 for _ in refs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert n == count
+    # Only the read buffer and the current reference are alive at any time.
+    assert peak < 1024 * 1024
+
+
+def test_iter_info(mocker):
+    nodes = [{"reference": "conanfile.py (foo/1.0)", "is_ref": False, "id": "123"},
+             {"reference": "bar/1.0@a/b", "is_ref": True, "id": "456"}]
+    check_call = fake_conan_json(mocker, nodes)
+    assert list(Conan.iter_info("conanfile.py", profiles=["p"])) == nodes
+    assert check_call.call_args[0][0][:5] == [Conan.CONAN_CMD, "info", "conanfile.py",
+                                              "--profile", "p"]
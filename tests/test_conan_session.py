@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import stat
+import subprocess as sp
+
+import pytest
+
+from ConanTools import Conan
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="uses POSIX shell scripts")
+
+
+@pytest.fixture
+def fake_conan(tmp_path):
+    # Prints the arguments, the conan home, and the working directory.
+    path = tmp_path / "fake_conan"
+    path.write_text("#!/bin/sh\necho \"args=$* home=$CONAN_USER_HOME cwd=$(pwd)\"\n")
+    os.chmod(str(path), os.stat(str(path)).st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_concurrent_sessions(tmp_path, fake_conan):
+    sessions = []
+    for i in range(4):
+        cwd = tmp_path / "cwd{}".format(i)
+        sessions.append(Conan.ConanSession(conan_cmd=fake_conan, log=io.StringIO(), cwd=str(cwd),
+                                           user_home=str(tmp_path / "home{}".format(i))))
+
+    def work(session):
+        for _ in range(5):
+            session.run(["info", "x"])
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(work, sessions))
+
+    for i, session in enumerate(sessions):
+        lines = session._log.getvalue().splitlines()
+        assert len(lines) == 10
+        assert lines[0] == "[{}] $ {} info x".format(tmp_path / "cwd{}".format(i), fake_conan)
+        assert lines[1] == "args=info x home={} cwd={}".format(tmp_path / "home{}".format(i),
+                                                               tmp_path / "cwd{}".format(i))
+        assert lines[2:] == lines[:2] * 4
+
+
+def test_recipe_and_reference_use_session(tmp_path, fake_conan, mocker):
+    mocker.patch('ConanTools.Conan.inspect', return_value="1.0")
+    with open(str(tmp_path / "log.txt"), 'w') as log:
+        session = Conan.ConanSession(conan_cmd=fake_conan, log=log, env={"FOO": "bar"},
+                                     user_home=str(tmp_path / "home"), cwd=str(tmp_path))
+        recipe = Conan.Recipe("conanfile.py", session=session)
+        assert recipe.path == str(tmp_path / "conanfile.py")
+        ref = recipe.export("user", "channel")
+        assert ref.session is session
+        assert ref.clone(version="2.0").in_local_cache()
+    with open(str(tmp_path / "log.txt")) as f:
+        log = f.read()
+    assert "$ {} export {} 1.0/1.0@user/channel\n".format(fake_conan, recipe.path) in log
+    assert "args=search 1.0/2.0@user/channel home={}".format(tmp_path / "home") in log
+    assert session.env["FOO"] == "bar"
+    assert "FOO" not in os.environ
+
+
+def test_scripts_and_imports_use_session(tmp_path, fake_conan, mocker):
+    inspect = mocker.patch('ConanTools.Conan.inspect', return_value="1.0")
+    session = Conan.ConanSession(conan_cmd=fake_conan, log=io.StringIO(),
+                                 user_home=str(tmp_path / "home"), cwd=str(tmp_path))
+    recipe = Conan.Recipe("conanfile.py", session=session)
+    recipe.install(add_script=True)
+    # The helper script replays the command within the session.
+    with open(str(tmp_path / "ct_install.sh")) as f:
+        script = f.read()
+    assert "export CONAN_USER_HOME={}\n".format(tmp_path / "home") in script
+    assert "{} install {}".format(fake_conan, recipe.path) in script
+    output = sp.run([str(tmp_path / "ct_install.sh")], stdout=sp.PIPE, universal_newlines=True,
+                    check=True).stdout
+    assert "home={}".format(tmp_path / "home") in output
+
+    from ConanTools import Repack
+    import_file = Repack.ConanImportTxtFile(cwd=str(tmp_path))
+    import_file.add_package(Conan.Reference("a", "1.0", "user", "channel"))
+    import_file.install(cwd=str(tmp_path), session=session)
+    assert "args=install" in session._log.getvalue().splitlines()[-1]
+
+    (tmp_path / "conanfile.py").write_text("x")
+    Conan.get_recipe_field("conanfile.py", "license", session=session)
+    assert inspect.call_args[1]["session"] is session
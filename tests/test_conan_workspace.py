@@ -0,0 +1,171 @@
+from ConanTools import Conan
+from contextlib import redirect_stdout
+import io
+import os
+import pytest
+import subprocess as sp
+import time
+
+
+@pytest.fixture
+def mock_run(mocker):
+    # Mock the run method that is used internally to execute conan commands.
+    run_ret = mocker.Mock()
+    run_ret.returncode = 0
+    mocker.patch('subprocess.run', return_value=run_ret)
+    return run_ret
+
+
+def test_workspace_install(tmp_path, mock_run, mock_inspect):
+    recipes = [Conan.Recipe(str(tmp_path / x / "conanfile.py"), external_source=(x == "b"))
+               for x in ["a", "b", "c"]]
+    # Rooted layouts derive their offset from the already inspected name.
+    recipes[2] = Conan.Recipe(str(tmp_path / "c" / "conanfile.py"), external_source=True,
+                              layout=Conan.RelativePkgLayout(root=str(tmp_path / "out")))
+    ws = Conan.Workspace(recipes)
+    ws_build_folder = str(tmp_path / "ws")
+    output = io.StringIO()
+    with redirect_stdout(output):
+        ws.install("user", "channel", ws_build_folder=ws_build_folder)
+
+    # Every recipe is inspected exactly once.
+    assert mock_inspect.call_count == 3
+    assert "$ conan workspace install {} --build outdated".format(
+        os.path.join(ws_build_folder, "ws.yml")) in output.getvalue()
+
+    with open(os.path.join(ws_build_folder, "layout.txt")) as f:
+        layout = f.read()
+    assert "[a/1.0@user/channel:build_folder]\n{}\n".format(tmp_path / "a" / "_build") in layout
+    assert "[a/1.0@user/channel:source_folder]\n{}\n".format(tmp_path / "a") in layout
+    assert "[b/1.0@user/channel:source_folder]\n{}\n".format(tmp_path / "b" / "_source") in layout
+    assert "[c/1.0@user/channel:build_folder]\n{}\n".format(
+        tmp_path / "out" / "c" / "_build") in layout
+    assert "[c/1.0@user/channel:source_folder]\n{}\n".format(
+        tmp_path / "out" / "c" / "_source") in layout
+
+    with open(os.path.join(ws_build_folder, "ws.yml")) as f:
+        ws_yml = f.read()
+    assert ws_yml == ("editables:\n"
+                      "    a/1.0@user/channel:\n"
+                      "        path: {}\n"
+                      "    b/1.0@user/channel:\n"
+                      "        path: {}\n"
+                      "    c/1.0@user/channel:\n"
+                      "        path: {}\n"
+                      "layout: layout.txt\n"
+                      "root:\n"
+                      "  - a/1.0@user/channel\n"
+                      "  - b/1.0@user/channel\n"
+                      "  - c/1.0@user/channel\n").format(*[tmp_path / x for x in "abc"])
+
+
+def git(cwd, *args):
+    sp.run(["git", "-c", "user.name=test", "-c", "user.email=test@localhost"] + list(args),
+           cwd=str(cwd), check=True, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+
+
+@pytest.mark.parametrize("symlinked", [False, True])
+def test_workspace_outdated(tmp_path, mocker, symlinked):
+    requires = {"a": None, "b": "a/1.0@user/channel", "c": None}
+
+    def inspect(path_or_ref, attribute=None, default=None, remote=None, session=None):
+        name = os.path.basename(os.path.dirname(path_or_ref))
+        return {"name": name, "requires": requires[name]}.get(attribute, default)
+    mocker.patch('ConanTools.Conan.inspect', side_effect=inspect)
+
+    git(tmp_path, "init")
+    for x in requires:
+        os.makedirs(str(tmp_path / x))
+        (tmp_path / x / "conanfile.py").write_text("# " + x)
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-m", "initial")
+
+    checkout = tmp_path
+    if symlinked:
+        # Access the repository through a symlink while git reports the resolved paths.
+        checkout = tmp_path.parent / (tmp_path.name + "_link")
+        os.symlink(str(tmp_path), str(checkout))
+    ws = Conan.Workspace([Conan.Recipe(str(checkout / x / "conanfile.py")) for x in requires])
+    state_file = str(tmp_path / "state.json")
+    # Without recorded state, everything is outdated.
+    assert ws.outdated(state_file=state_file) == ws.recipes
+    ws.record_state(state_file)
+    assert ws.outdated(state_file=state_file) == []
+
+    # Changing a recipe also outdates its dependents.
+    (tmp_path / "a" / "main.c").write_text("int main() {}")
+    assert ws.outdated(state_file=state_file) == ws.recipes[:2]
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-m", "second")
+    assert ws.outdated(base="HEAD") == []
+    assert ws.outdated(base="HEAD~1") == ws.recipes[:2]
+
+    # Edits of already modified files and a different build configuration are noticed too.
+    (tmp_path / "c" / "main.c").write_text("int main() {}")
+    ws.record_state(state_file, config="release")
+    assert ws.outdated(state_file=state_file, config="release") == []
+    (tmp_path / "c" / "main.c").write_text("int main() { return 1; }")
+    assert ws.outdated(state_file=state_file, config="release") == ws.recipes[2:]
+    (tmp_path / "c" / "main.c").write_text("int main() {}")
+    assert ws.outdated(state_file=state_file, config="release") == []
+    assert ws.outdated(state_file=state_file, config="debug") == ws.recipes
+
+
+def test_build_config(tmp_path):
+    profile = str(tmp_path / "profile")
+    with open(profile, 'w') as f:
+        f.write("[settings]\nbuild_type=Release\n")
+    config = Conan.build_config([profile], {"a:shared": "True"}, "user", "channel")
+    assert Conan.build_config([profile], {"a:shared": "True"}, "user", "channel") == config
+    assert Conan.build_config([profile], {}, "user", "channel") != config
+    assert Conan.build_config([profile], {"a:shared": "True"}, "user", "testing") != config
+    with open(profile, 'w') as f:
+        f.write("[settings]\nbuild_type=Debug\n")
+    assert Conan.build_config([profile], {"a:shared": "True"}, "user", "channel") != config
+
+
+def test_changed_files_with_special_names(tmp_path):
+    from ConanTools import Git
+    git(tmp_path, "init")
+    (tmp_path / "tracked.c").write_text("a")
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-m", "initial")
+    (tmp_path / "tracked.c").write_text("b")
+    (tmp_path / "sp ace \"ü\".c").write_text("a")
+    assert sorted(Git.changed_files("HEAD", cwd=str(tmp_path))) == [
+        os.path.realpath(str(tmp_path / x)) for x in ["sp ace \"ü\".c", "tracked.c"]]
+    assert Git.changed_files("does-not-exist", cwd=str(tmp_path)) is None
+
+
+def test_workspace_source_parallel(tmp_path, mocker):
+    mocker.patch('ConanTools.Conan.inspect', return_value=None)
+    running = set()
+    overlap = []
+
+    def fetch(cmd, stdout, stderr, cwd, env, timeout, cancel):
+        name = os.path.basename(os.path.dirname(cmd[2]))
+        running.add(name)
+        overlap.append(len(running))
+        while name == "slow" and not cancel.cancelled:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        running.discard(name)
+        if cancel.cancelled:
+            raise Conan.CommandAborted("Executing command has been aborted!")
+        os.makedirs(cmd[3][len("--source-folder="):])
+        return sp.CompletedProcess(cmd, 1 if name == "aborted_broken" else 0)
+    mocker.patch('ConanTools.Conan._run_cancellable', side_effect=fetch)
+
+    recipes = [Conan.Recipe(str(tmp_path / x / "conanfile.py"), external_source=True)
+               for x in ["ok", "slow", "aborted_broken"]]
+    ws = Conan.Workspace(recipes)
+    # The error of the failing command is raised even if its message mentions "aborted".
+    with redirect_stdout(io.StringIO()):
+        with pytest.raises(ValueError, match="returncode=1"):
+            ws.source(max_workers=3)
+    assert max(overlap) > 1
+    # Only the successful fetch is stamped.
+    assert os.path.isfile(str(tmp_path / "ok" / "_source" / ".ct_source_finished"))
+    assert not os.path.exists(str(tmp_path / "slow" / "_source" / ".ct_source_finished"))
+    assert not os.path.exists(str(tmp_path / "aborted_broken" / "_source" /
+                                  ".ct_source_finished"))
@@ -0,0 +1,96 @@
+from ConanTools import Conan
+from contextlib import redirect_stdout
+import io
+import os
+import threading
+
+
+def test_cpu_pool_shares():
+    pool = Conan.CpuPool(total=8, parallel=2)
+    with pool.acquire() as a:
+        assert a == 4
+        with pool.acquire() as b:
+            assert b == 4
+            assert pool.free == 0
+        # Cores of finished builds are handed to the next build.
+        with pool.acquire() as c:
+            assert c == 4
+    assert pool.free == 8
+
+    # Without other builds running, a single build gets all cores.
+    with Conan.CpuPool(total=8, parallel=1).acquire() as share:
+        assert share == 8
+
+
+def test_cpu_pool_concurrent_builds_overlap():
+    pool = Conan.CpuPool(total=8, parallel=4)
+    # Every build has to hold its share while the others acquire theirs.
+    barrier = threading.Barrier(4, timeout=10)
+    shares = []
+
+    def build():
+        with pool.acquire() as share:
+            shares.append(share)
+            barrier.wait()
+    threads = [threading.Thread(target=build) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not barrier.broken
+    assert sorted(shares) == [2, 2, 2, 2]
+    assert pool.free == 8
+
+
+def test_cpu_pool_parallel_adapts():
+    pool = Conan.CpuPool(total=8, parallel=4)
+    with pool.acquire() as a:
+        assert a == 2
+        # The caller lowers the expected concurrency while its queue drains.
+        pool.parallel = 2
+        with pool.acquire() as b:
+            assert b == 6
+
+
+def test_cpu_pool_blocks_when_exhausted():
+    pool = Conan.CpuPool(total=1, parallel=2)
+    acquired = threading.Event()
+
+    def build():
+        with pool.acquire():
+            acquired.set()
+
+    with pool.acquire() as share:
+        assert share == 1
+        thread = threading.Thread(target=build)
+        thread.start()
+        assert not acquired.wait(0.1)
+    thread.join(10)
+    assert acquired.is_set()
+
+
+def test_recipe_build_with_cpu_pool(mocker):
+    mocker.patch('os.makedirs')
+    run = mocker.patch('subprocess.run', return_value=mocker.Mock(returncode=0))
+    mocker.patch('ConanTools.Conan.inspect', return_value=True)
+    recipe = Conan.Recipe("/foobar.py")
+    with redirect_stdout(io.StringIO()):
+        recipe.build(src_folder="/src", build_folder="/build", pkg_folder="/pkg",
+                     cpu_pool=Conan.CpuPool(total=6, parallel=3))
+    env = run.call_args[1]["env"]
+    assert env["CONAN_CPU_COUNT"] == "2"
+    assert "PATH" in env
+
+
+def test_workspace_create_local_with_cpu_pool(tmp_path, mocker, mock_inspect):
+    run = mocker.patch('subprocess.run', return_value=mocker.Mock(returncode=0))
+    mocker.patch('ConanTools.Conan.Workspace.dependencies', return_value={})
+    os.makedirs(str(tmp_path / "a"))
+    layout = Conan.RelativePkgLayout(root=str(tmp_path / "out"))
+    ws = Conan.Workspace([Conan.Recipe(str(tmp_path / "a" / "conanfile.py"), layout=layout)])
+    with redirect_stdout(io.StringIO()):
+        ws.create_local("user", "channel", ws_build_folder=str(tmp_path / "ws"),
+                        pkg_folder=str(tmp_path / "pkg"),
+                        cpu_pool=Conan.CpuPool(total=6, parallel=2))
+    builds = [x for x in run.call_args_list if x[0][0][1] == "build"]
+    assert builds[0][1]["env"]["CONAN_CPU_COUNT"] == "3"
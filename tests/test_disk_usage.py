@@ -0,0 +1,74 @@
+from collections import OrderedDict
+import os
+
+import pytest
+
+from ConanTools import Conan
+from ConanTools import DiskUsage
+
+
+def write(path, size):
+    os.makedirs(str(path.parent), exist_ok=True)
+    path.write_bytes(b"x" * size)
+
+
+def test_scanner_hardlinks(tmp_path):
+    write(tmp_path / "a" / "sub" / "big.bin", 1000)
+    write(tmp_path / "a" / "small.bin", 10)
+    write(tmp_path / "b" / "other.bin", 100)
+    os.link(str(tmp_path / "a" / "sub" / "big.bin"), str(tmp_path / "a" / "big2.bin"))
+    os.link(str(tmp_path / "a" / "sub" / "big.bin"), str(tmp_path / "b" / "big3.bin"))
+    folders = [("a", str(tmp_path / "a")), ("b", str(tmp_path / "b")),
+               ("missing", str(tmp_path / "missing"))]
+    # Hardlinks are attributed to the first folder that contains them.
+    for _ in range(3):
+        sizes = DiskUsage.Scanner(max_workers=4).scan(OrderedDict(folders))
+        assert sizes == {"a": 1010, "b": 100, "missing": 0}
+        sizes = DiskUsage.Scanner(max_workers=4).scan(OrderedDict(reversed(folders)))
+        assert sizes == {"a": 10, "b": 1100, "missing": 0}
+
+    # Hardlinks counted by a previous scan of the same scanner are skipped.
+    scanner = DiskUsage.Scanner()
+    assert scanner.scan({"a": str(tmp_path / "a")}) == {"a": 1010}
+    assert scanner.scan({"b": str(tmp_path / "b")}) == {"b": 100}
+
+
+def test_layout_usage(tmp_path, mock_inspect):
+    write(tmp_path / "libA" / "conanfile.py", 10)
+    write(tmp_path / "libA" / "_build" / "lib.o", 200)
+    write(tmp_path / "libA" / "_install" / "lib.a", 300)
+    write(tmp_path / "libB" / "conanfile.py", 20)
+    write(tmp_path / "libB" / "_source" / "main.c", 400)
+    recipes = [Conan.Recipe(str(tmp_path / "libA" / "conanfile.py")),
+               Conan.Recipe(str(tmp_path / "libB" / "conanfile.py"), external_source=True)]
+    expected = {"libA": {"source": 10, "build": 200, "package": 300},
+                "libB": {"source": 400, "build": 0, "package": 0}}
+    assert DiskUsage.analyze(Conan.Workspace(recipes)) == expected
+
+    layout = Conan.RelativePkgLayout(root=str(tmp_path / "out"))
+    write(tmp_path / "out" / "libA" / "_build" / "lib.o", 50)
+    usage = DiskUsage.analyze(layout, recipes=recipes, max_workers=2)
+    # The folders of the default layout are now part of the recipe (i.e., source) folder.
+    assert usage["libA"] == {"source": 510, "build": 50, "package": 0}
+    with pytest.raises(ValueError):
+        DiskUsage.analyze(layout)
+
+    # Every recipe is inspected only once to determine its name and folders.
+    mock_inspect.reset_mock()
+    DiskUsage.analyze(layout, recipes=recipes)
+    assert mock_inspect.call_count == 2
+
+    report = DiskUsage.format_report(usage).splitlines()
+    assert report[0].split() == ["source", "build", "package", "total", "name"]
+    assert report[1].split() == ["510", "50", "0", "560", "libA"]
+    assert report[-1].split() == ["510", "50", "0", "560", "total"]
+
+
+def test_cache_usage(tmp_path):
+    ref = tmp_path / "zlib" / "1.2" / "_" / "_"
+    write(ref / "metadata.json", 5)
+    write(ref / "export" / "conanfile.py", 10)
+    write(ref / "package" / "123" / "lib.a", 100)
+    write(ref / "build" / "123" / "lib.o", 20)
+    usage = DiskUsage.analyze(str(tmp_path))
+    assert usage == {"zlib/1.2@_/_": {"metadata": 5, "export": 10, "package": 100, "build": 20}}
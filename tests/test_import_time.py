@@ -0,0 +1,72 @@
+import os
+import subprocess as sp
+import sys
+
+import pytest
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.dirname(script_dir)
+
+
+def import_times(statement: str):
+    """Executes the statement in a fresh interpreter and returns the -X importtime results.
+
+    The first result maps the module names to their cumulative import time in microseconds. The
+    second one lists the ConanTools modules that have been loaded after executing the statement.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([package_dir, env.get("PYTHONPATH", "")])
+    statement += "; import sys; print(' '.join(x for x in sys.modules if 'ConanTools' in x))"
+    res = sp.run([sys.executable, "-X", "importtime", "-c", statement], stdout=sp.PIPE,
+                 stderr=sp.PIPE, universal_newlines=True, env=env, check=True)
+    times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [x.strip() for x in line[len("import time:"):].split("|")]
+        times[name] = int(cumulative)
+    return times, res.stdout.split()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="requires -X importtime and PEP 562")
+def test_import_time_of_helpers():
+    times, modules = import_times("from ConanTools import slug, env_flag")
+    print("ConanTools import time: {} us".format(times["ConanTools"]))
+    # None of the submodules should be loaded when only the helpers are used.
+    assert modules == ["ConanTools"]
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="requires -X importtime and PEP 562")
+def test_lazy_submodule_access():
+    times, modules = import_times("import ConanTools; ConanTools.Repack.ConanImportTxtFile")
+    assert sorted(modules) == ["ConanTools", "ConanTools.Conan", "ConanTools.Metrics",
+                               "ConanTools.Repack"]
+    print("ConanTools.Conan import time: {} us".format(times["ConanTools.Conan"]))
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="requires -X importtime and PEP 562")
+def test_star_import_exports_modules():
+    # Recipes relying on the star import exporting the formerly eager modules keep working.
+    _, modules = import_times("from ConanTools import *; Conan.Recipe; ConanTools.slug; "
+                              "Repack.ConanImportTxtFile; Version.semantic")
+    assert "ConanTools.Conan" in modules
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="requires -X importtime and PEP 562")
+def test_star_import_skips_archive_modules():
+    # The archive modules are only needed once an archive is created or extracted.
+    times, _ = import_times("from ConanTools import *; Repack.ConanImportTxtFile")
+    assert not {"tarfile", "gzip", "mmap", "configparser"} & set(times)
+
+
+def test_star_import_without_module_getattr():
+    # Emulates interpreters without PEP 562 which load all submodules eagerly.
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([package_dir, env.get("PYTHONPATH", "")])
+    statement = ("import ConanTools; ConanTools._load_eagerly(); del ConanTools.__getattr__; "
+                 "from ConanTools import *; print(Conan.__name__, ConanTools.__name__, "
+                 "Repack.__name__, Version.__name__)")
+    res = sp.run([sys.executable, "-c", statement], stdout=sp.PIPE, universal_newlines=True,
+                 env=env, check=True)
+    assert res.stdout.split() == ["ConanTools.Conan", "ConanTools", "ConanTools.Repack",
+                                  "ConanTools.Version"]
@@ -0,0 +1,143 @@
+from ConanTools import Conan, JobServer
+import os
+import socket
+import subprocess as sp
+import sys
+import pytest
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.dirname(script_dir)
+
+# Minimal conan stand-in that answers inspect queries, logs all other commands, and fails for
+# recipes in a folder called "broken".
+fake_conan = """#!{}
+import json, os, sys
+args = sys.argv[1:]
+if args[0] == "inspect":
+    attr = args[args.index("--attribute") + 1]
+    name = os.path.basename(os.path.dirname(args[1]))
+    with open(args[args.index("--json") + 1], 'w') as f:
+        json.dump({{attr: {{"name": name, "version": "1.0"}}.get(attr, True)}}, f)
+    sys.exit(0)
+with open(os.environ["FAKE_CONAN_LOG"], 'a') as f:
+    f.write(args[0] + " " + os.path.basename(os.path.dirname(args[1])) + "\\n")
+print("fake conan " + " ".join(args))
+sys.exit(1 if "broken" in args[1] else 0)
+"""
+
+
+@pytest.fixture
+def fake_conan_env(tmp_path, monkeypatch):
+    conan = tmp_path / "conan"
+    conan.write_text(fake_conan.format(sys.executable))
+    conan.chmod(0o755)
+    env = dict(os.environ)
+    env["CT_CONAN_CMD"] = str(conan)
+    env["FAKE_CONAN_LOG"] = str(tmp_path / "conan.log")
+    env["PYTHONPATH"] = os.pathsep.join([package_dir, env.get("PYTHONPATH", "")])
+    return env
+
+
+@pytest.fixture
+def inspect_fields():
+    requires = {"a": None, "b": "a/1.0@user/channel", "c": ["b/1.0@user/channel"],
+                "broken": None, "d": ("broken/1.0@user/channel",)}
+    return lambda name: {"requires": requires[name]}
+
+
+def make_workspace(tmp_path, names):
+    return Conan.Workspace([Conan.Recipe(str(tmp_path / x / "conanfile.py")) for x in names])
+
+
+def start_workers(coordinator, env, count):
+    address = "{}:{}".format(*coordinator.address)
+    return [sp.Popen([sys.executable, "-m", "ConanTools.JobServer", address,
+                      "--name", "worker{}".format(i)], env=env) for i in range(count)]
+
+
+def test_workspace_dependencies(tmp_path, mock_inspect):
+    ws = make_workspace(tmp_path, ["c", "b", "a"])
+    deps = ws.dependencies()
+    assert deps[ws.recipes[0]] == [ws.recipes[1]]
+    assert deps[ws.recipes[1]] == [ws.recipes[2]]
+    assert deps[ws.recipes[2]] == []
+
+
+def test_coordinator_with_local_workers(tmp_path, mock_inspect, fake_conan_env):
+    ws = make_workspace(tmp_path, ["c", "b", "a", "broken", "d"])
+    coordinator = JobServer.Coordinator(ws, "user", "channel", pkg_folder=str(tmp_path / "pkg"))
+    coordinator.start()
+    workers = start_workers(coordinator, fake_conan_env, 3)
+    assert coordinator.wait(timeout=60)
+    coordinator.shutdown()
+    for worker in workers:
+        assert worker.wait(timeout=60) == 0
+
+    results = list(coordinator.results().values())
+    assert [x["state"] for x in results] == ["done", "done", "done", "failed", "skipped"]
+    assert "fake conan build" in results[0]["log"]
+    assert "ValueError" in results[3]["log"]
+    with open(fake_conan_env["FAKE_CONAN_LOG"]) as f:
+        log = [x for x in f.read().splitlines() if "broken" not in x]
+    # The dependencies have been completely built before the dependents.
+    assert log == ["build a", "package a", "build b", "package b", "build c", "package c"]
+
+
+def test_coordinator_requeues_jobs_of_dead_workers(tmp_path, mock_inspect, fake_conan_env):
+    ws = make_workspace(tmp_path, ["a"])
+    coordinator = JobServer.Coordinator(ws, "user", "channel", pkg_folder=str(tmp_path / "pkg"))
+    coordinator.start()
+
+    # Take a job and disconnect without reporting a result.
+    with socket.create_connection(coordinator.address) as sock:
+        rfile = sock.makefile('rb')
+        wfile = sock.makefile('wb')
+        JobServer._send(wfile, {"type": "request"})
+        assert JobServer._recv(rfile)["recipe"] == ws.recipes[0].path
+        rfile.close()
+        wfile.close()
+
+    workers = start_workers(coordinator, fake_conan_env, 1)
+    assert coordinator.wait(timeout=60)
+    coordinator.shutdown()
+    assert workers[0].wait(timeout=60) == 0
+    result = coordinator.results()[ws.recipes[0]]
+    assert result["state"] == "done"
+    assert result["attempts"] == 2
+    assert result["worker"] == "worker0"
+
+
+@pytest.mark.parametrize("heartbeat", [True, False])
+def test_coordinator_requeues_jobs_of_hung_workers(tmp_path, mock_inspect, fake_conan_env,
+                                                   heartbeat):
+    ws = make_workspace(tmp_path, ["a"])
+    # Without heartbeats, the hung worker is detected by the heartbeat timeout. Otherwise, the
+    # job timeout takes effect.
+    coordinator = JobServer.Coordinator(ws, "user", "channel", pkg_folder=str(tmp_path / "pkg"),
+                                        heartbeat_timeout=1.0 if not heartbeat else 30.0,
+                                        job_timeout=1.0 if heartbeat else None)
+    coordinator.start()
+
+    # Take a job and stay connected without reporting a result.
+    with socket.create_connection(coordinator.address) as sock, \
+            sock.makefile('rb') as rfile, sock.makefile('wb', buffering=0) as wfile:
+        JobServer._send(wfile, {"type": "request"})
+        job = JobServer._recv(rfile)
+        assert job["recipe"] == ws.recipes[0].path
+        assert job["heartbeat"] > 0
+        if heartbeat:
+            # Keep sending heartbeats until the coordinator drops the connection.
+            with pytest.raises(OSError):
+                for _ in range(100):
+                    JobServer._send(wfile, {"type": "heartbeat"})
+                    time.sleep(0.1)
+
+        workers = start_workers(coordinator, fake_conan_env, 1)
+        assert coordinator.wait(timeout=60)
+    coordinator.shutdown()
+    assert workers[0].wait(timeout=60) == 0
+    result = coordinator.results()[ws.recipes[0]]
+    assert result["state"] == "done"
+    assert result["attempts"] == 2
+    assert result["worker"] == "worker0"
@@ -0,0 +1,66 @@
+from ConanTools import Conan
+from contextlib import redirect_stdout
+import io
+import os
+
+
+def test_lockfile_create_and_use(tmp_path, mocker):
+    def conan_lock(cmd, **kwargs):
+        lockfile_out = cmd[-1].split("=", 1)[1]
+        with open(lockfile_out, 'w') as f:
+            f.write("{}")
+        return mocker.Mock(returncode=0)
+    run = mocker.patch('subprocess.run', side_effect=conan_lock)
+
+    recipe_path = str(tmp_path / "conanfile.py")
+    with open(recipe_path, 'w') as f:
+        f.write("# recipe")
+    profile = str(tmp_path / "profile")
+    with open(profile, 'w') as f:
+        f.write("[settings]\nos=Linux\n")
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        lock = Conan.Lockfile.create(recipe_path, profiles=[profile], options={"a:shared": True},
+                                     folder=str(tmp_path))
+        # The cached lockfile is reused for identical inputs.
+        assert Conan.Lockfile.create(recipe_path, profiles=[profile],
+                                     options={"a:shared": True},
+                                     folder=str(tmp_path)).path == lock.path
+    assert run.call_count == 1
+    assert "$ conan lock create {} --profile {} -o a:shared=True --lockfile-out={}.".format(
+        recipe_path, profile, lock.path) in output.getvalue()
+    assert os.path.isfile(lock.path)
+
+    # Changing the profile invalidates the lockfile.
+    assert Conan.Lockfile.fingerprint(recipe_path, [profile], {"a:shared": True})[:16] in lock.path
+    with open(profile, 'a') as f:
+        f.write("build_type=Release\n")
+    assert Conan.Lockfile.fingerprint(recipe_path, [profile], {"a:shared": True})[:16] \
+        not in lock.path
+
+    session = Conan.ConanSession()
+    other = Conan.ConanSession()
+    args = Conan.fmt_build_args("install", ["."], remote="r", profiles=[profile], build=["missing"],
+                                options={"a:shared": True}, session=session)
+    assert "--lockfile" not in args
+    with Conan.use_lockfile(lock, session):
+        args = Conan.fmt_build_args("install", ["."], remote="r", profiles=[profile],
+                                    build=["missing"], options={"a:shared": True},
+                                    session=session)
+        # Other sessions are not affected.
+        assert "--lockfile" not in Conan.fmt_build_args("install", ["."], remote="r",
+                                                        profiles=[profile], build=["missing"],
+                                                        options={}, session=other)
+    assert args == ["install", ".", "--lockfile", lock.path, "--build", "missing", "--remote", "r"]
+    assert session.lockfile is None
+
+    # The lockfile of a session reaches the commands of its recipes.
+    recipe = Conan.Recipe(recipe_path, session=Conan.ConanSession(lockfile=lock))
+    run.side_effect = None
+    run.return_value = mocker.Mock(returncode=0)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        recipe.install(build_folder=str(tmp_path / "build"), profiles=[profile])
+    assert "$ conan install {} --lockfile {} --build outdated".format(
+        recipe_path, lock.path) in output.getvalue()
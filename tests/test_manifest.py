@@ -0,0 +1,96 @@
+from ConanTools import Conan, Manifest
+from contextlib import redirect_stdout
+import io
+import os
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_manifest_from_folder(tmp_path):
+    folder = str(tmp_path)
+    write(os.path.join(folder, "include", "a.h"), "a")
+    os.symlink("a.h", os.path.join(folder, "include", "b.h"))
+    manifest = Manifest.Manifest.from_folder(folder)
+    assert sorted(manifest.entries) == [os.path.join("include", "a.h"),
+                                        os.path.join("include", "b.h")]
+    entry = manifest.entries[os.path.join("include", "a.h")]
+    assert entry["size"] == 1
+    assert entry["sha256"] == Manifest.file_hash(os.path.join(folder, "include", "a.h"))
+    assert manifest.entries[os.path.join("include", "b.h")] == {"link": "a.h"}
+
+    # Hashes are reused from the previous manifest when size and mtime match.
+    manifest.entries[os.path.join("include", "a.h")]["sha256"] = "cached"
+    again = Manifest.Manifest.from_folder(folder, previous=manifest)
+    assert again.entries[os.path.join("include", "a.h")]["sha256"] == "cached"
+
+
+def test_sync_folder(tmp_path):
+    src = str(tmp_path / "src")
+    dst = str(tmp_path / "dst")
+    manifest_path = str(tmp_path / "manifest.json")
+    write(os.path.join(src, "same.txt"), "same")
+    write(os.path.join(src, "changed.txt"), "new")
+    write(os.path.join(dst, "same.txt"), "same")
+    write(os.path.join(dst, "changed.txt"), "old")
+    write(os.path.join(dst, "stale", "file.txt"), "stale")
+    os.utime(os.path.join(dst, "same.txt"), ns=(1000000000, 1000000000))
+
+    changed, removed = Manifest.sync_folder(src, dst, manifest_path=manifest_path)
+    assert changed == ["changed.txt"]
+    assert removed == [os.path.join("stale", "file.txt")]
+    assert sorted(os.listdir(dst)) == ["changed.txt", "same.txt"]
+    assert os.stat(os.path.join(dst, "same.txt")).st_mtime_ns == 1000000000
+    with open(os.path.join(dst, "changed.txt")) as f:
+        assert f.read() == "new"
+
+    # A second sync does not touch anything.
+    assert Manifest.sync_folder(src, dst, manifest_path=manifest_path) == ([], [])
+    assert os.path.isfile(manifest_path)
+
+
+def test_recipe_package_incremental(tmp_path, mocker):
+    build_folder = str(tmp_path / "build")
+    pkg_folder = str(tmp_path / "pkg")
+    write(os.path.join(pkg_folder, "stale.txt"), "stale")
+
+    def conan_package(cmd, **kwargs):
+        out_folder = cmd[-1].split("=", 1)[1]
+        write(os.path.join(out_folder, "lib", "foo.a"), "foo")
+        return mocker.Mock(returncode=0)
+    mocker.patch('subprocess.run', side_effect=conan_package)
+
+    recipe = Conan.Recipe("/foobar.py")
+    output = io.StringIO()
+    with redirect_stdout(output):
+        recipe.package(build_folder=build_folder, pkg_folder=pkg_folder, incremental=True)
+    assert "--package-folder={}".format(
+        os.path.join(build_folder, "_ct_package_staging")) in output.getvalue()
+    assert os.listdir(pkg_folder) == ["lib"]
+    assert not os.path.exists(os.path.join(build_folder, "_ct_package_staging"))
+    assert os.path.isfile(os.path.join(build_folder, ".ct_package_manifest.json"))
+
+
+def test_deduplicate(tmp_path):
+    a = str(tmp_path / "a")
+    b = str(tmp_path / "b")
+    write(os.path.join(a, "include", "foo.h"), "foo" * 100)
+    write(os.path.join(b, "include", "foo.h"), "foo" * 100)
+    write(os.path.join(b, "include", "bar.h"), "bar" * 100)
+    write(os.path.join(b, "include", "baz.h"), "baz" * 100)
+    os.chmod(os.path.join(b, "include", "baz.h"), 0o600)
+    write(os.path.join(a, "include", "baz.h"), "baz" * 100)
+    os.chmod(os.path.join(a, "include", "baz.h"), 0o644)
+
+    assert Manifest.deduplicate([a, b], dry_run=True) == 300
+    assert os.stat(os.path.join(a, "include", "foo.h")).st_nlink == 1
+    assert Manifest.deduplicate([a, b]) == 300
+    foo_a = os.stat(os.path.join(a, "include", "foo.h"))
+    foo_b = os.stat(os.path.join(b, "include", "foo.h"))
+    assert foo_a.st_ino == foo_b.st_ino
+    # Files with different permissions are kept separate.
+    assert os.stat(os.path.join(b, "include", "baz.h")).st_nlink == 1
+    assert Manifest.deduplicate([a, b]) == 0
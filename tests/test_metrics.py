@@ -0,0 +1,73 @@
+import os
+import subprocess as sp
+import sys
+
+import pytest
+
+from ConanTools import Conan
+from ConanTools import Metrics
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.dirname(script_dir)
+
+
+def test_registry_dumps():
+    registry = Metrics.Registry(buckets=(1.0, 10.0))
+    registry.describe("ct_jobs", "Number of jobs.")
+    registry.inc("ct_jobs", {"result": "ok"})
+    registry.inc("ct_jobs", {"result": "ok"}, 2)
+    registry.inc("ct_jobs", {"result": "with \"quotes\""})
+    registry.observe("ct_duration_seconds", {"stage": "build"}, 5.0)
+    assert registry.counter("ct_jobs", {"result": "ok"}) == 3
+    assert registry.histogram_count("ct_duration_seconds", {"stage": "build"}) == 1
+
+    assert registry.dumps() == (
+        "# HELP ct_jobs_total Number of jobs.\n"
+        "# TYPE ct_jobs_total counter\n"
+        "ct_jobs_total{result=\"ok\"} 3\n"
+        "ct_jobs_total{result=\"with \\\"quotes\\\"\"} 1\n"
+        "# TYPE ct_duration_seconds histogram\n"
+        "ct_duration_seconds_bucket{stage=\"build\",le=\"1.0\"} 0\n"
+        "ct_duration_seconds_bucket{stage=\"build\",le=\"10.0\"} 1\n"
+        "ct_duration_seconds_bucket{stage=\"build\",le=\"+Inf\"} 1\n"
+        "ct_duration_seconds_sum{stage=\"build\"} 5.0\n"
+        "ct_duration_seconds_count{stage=\"build\"} 1\n")
+    openmetrics = registry.dumps(openmetrics=True)
+    assert "# TYPE ct_jobs counter\n" in openmetrics
+    assert openmetrics.endswith("# EOF\n")
+
+
+def test_command_and_stage_metrics(mocker, tmp_path):
+    Metrics.REGISTRY.clear()
+    results = iter([0, 1])
+
+    def run(*args, **kwargs):
+        ret = mocker.Mock()
+        ret.returncode = next(results)
+        return ret
+    mocker.patch('subprocess.run', side_effect=run)
+
+    recipe = Conan.Recipe(str(tmp_path / "conanfile.py"))
+    recipe.install(build_folder=str(tmp_path))
+    with pytest.raises(ValueError):
+        recipe.install(build_folder=str(tmp_path))
+
+    registry = Metrics.REGISTRY
+    assert registry.counter("ct_conan_commands",
+                            {"subcommand": "install", "result": "success"}) == 1
+    assert registry.counter("ct_conan_commands",
+                            {"subcommand": "install", "result": "failure"}) == 1
+    assert registry.histogram_count("ct_conan_command_duration_seconds",
+                                    {"subcommand": "install"}) == 2
+    assert registry.histogram_count("ct_recipe_stage_duration_seconds", {"stage": "install"}) == 2
+
+
+def test_metrics_file_at_exit(tmp_path):
+    metrics_file = str(tmp_path / "conantools.prom")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([package_dir, env.get("PYTHONPATH", "")])
+    env["CT_METRICS_FILE"] = metrics_file
+    statement = "from ConanTools import Metrics; Metrics.count_cache('profile', True)"
+    sp.run([sys.executable, "-c", statement], env=env, check=True)
+    with open(metrics_file) as f:
+        assert "ct_cache_requests_total{cache=\"profile\",result=\"hit\"} 1\n" in f.read()
@@ -0,0 +1,49 @@
+from contextlib import redirect_stdout
+import io
+
+import ConanTools
+from ConanTools import Conan
+
+
+def test_group_by_package_id(tmp_path, mocker):
+    (tmp_path / "base").write_text("[settings]\nos=Linux\n")
+    (tmp_path / "alias").write_text("include(base)\n")
+    (tmp_path / "debug").write_text("include(base)\n[settings]\nbuild_type=Debug\n")
+
+    def info(args, session=None):
+        # The "docs" option does not influence the binary.
+        debug = any("debug" in x for x in args)
+        return [{"reference": "conanfile.py (foo/1.0)", "is_ref": False,
+                 "id": "dbg" if debug else "rel"},
+                {"reference": "bar/1.0@a/b", "is_ref": True, "id": "456"}]
+    run_json = mocker.patch('ConanTools.Conan._run_json', side_effect=info)
+
+    configs = [([str(tmp_path / "base")], {}),
+               ([str(tmp_path / "alias")], {}),
+               ([str(tmp_path / "base")], {"docs": "True"}),
+               ([str(tmp_path / "debug")], {})]
+    groups = Conan.group_by_package_id("conanfile.py", configs)
+    assert groups == {"rel": [0, 1, 2], "dbg": [3]}
+    # Profiles with the same flattened content are only resolved once.
+    assert run_json.call_count == 3
+    run_json.assert_any_call(["info", "conanfile.py", "--only", "id", "--profile",
+                              str(tmp_path / "base"), "-o", "docs=True"], session=None)
+
+
+def test_pkg_create_matrix(mocker):
+    package_ids = mocker.patch('ConanTools.Conan.package_ids', return_value=["a", "b", "a"])
+    create = mocker.patch('ConanTools.pkg_create')
+    log = io.StringIO()
+    session = Conan.ConanSession(log=log)
+    recipe = Conan.Recipe("/src/conanfile.py", session=session)
+    configs = [(["p1"], {}), (["p2"], {}), (["p1"], {"docs": "True"})]
+    output = io.StringIO()
+    with redirect_stdout(output):
+        groups = ConanTools.pkg_create_matrix(recipe, "user", "channel", configs)
+    assert groups == {"a": [0, 2], "b": [1]}
+    # The package ids are resolved and reported in the session of the recipe.
+    assert package_ids.call_args[1]["session"] is session
+    assert output.getvalue() == ""
+    assert "Creating package a for configurations [0, 2]" in log.getvalue()
+    assert create.call_count == 2
+    assert [x[1]["profiles"] for x in create.call_args_list] == [["p1"], ["p2"]]
@@ -0,0 +1,110 @@
+from ConanTools import Conan, Profile
+import os
+
+
+def write(path, content):
+    with open(str(path), 'w') as f:
+        f.write(content)
+    return str(path)
+
+
+def test_profile_include_and_merge(tmp_path):
+    write(tmp_path / "base", "CC=gcc\n"
+                             "[settings]\n"
+                             "os=Linux\n"
+                             "compiler=$CC\n"
+                             "compiler.version=9\n"
+                             "[build_requires]\n"
+                             "cmake/3.16.0@foo/stable\n")
+    path = write(tmp_path / "derived", "include(base)\n"
+                                       "[settings]\n"
+                                       "build_type=Release\n"
+                                       "[env]\n"
+                                       "CXXFLAGS=-O2\n")
+    profile = Profile.Profile.load(path)
+    assert profile.get("settings", "compiler") == "gcc"
+    assert profile.files == [path, str(tmp_path / "base")]
+    assert profile.dumps() == ("[settings]\n"
+                               "os=Linux\n"
+                               "compiler=gcc\n"
+                               "compiler.version=9\n"
+                               "build_type=Release\n"
+                               "\n"
+                               "[build_requires]\n"
+                               "cmake/3.16.0@foo/stable\n"
+                               "\n"
+                               "[env]\n"
+                               "CXXFLAGS=-O2\n")
+
+    # Changing the compiler drops the subsettings of the previous compiler.
+    other = Profile.Profile.load(write(tmp_path / "clang", "[settings]\ncompiler=clang\n"))
+    profile.merge(other)
+    assert profile.get("settings", "compiler") == "clang"
+    assert profile.get("settings", "compiler.version") is None
+
+    # Setting the same compiler again keeps the subsettings.
+    profile.merge(Profile.Profile.load(write(tmp_path / "clang10", "[settings]\n"
+                                                                   "compiler.version=10\n")))
+    profile.merge(other)
+    assert profile.get("settings", "compiler.version") == "10"
+
+
+def test_profile_subsettings_before_parent(tmp_path):
+    # Subsettings listed before their parent setting are kept within a single profile file.
+    path = write(tmp_path / "gcc", "[settings]\ncompiler.version=9\ncompiler=gcc\n")
+    assert Profile.Profile.load(path).get("settings", "compiler.version") == "9"
+
+    from ConanTools import Repack
+    outpath = str(tmp_path / "out")
+    Repack.extend_profile(path, outpath, ["ninja/1.9.0@foo/stable"])
+    with open(outpath) as f:
+        assert f.read() == ("[settings]\ncompiler.version=9\ncompiler=gcc\n\n"
+                            "[build_requires]\nninja/1.9.0@foo/stable\n")
+
+
+def test_named_profiles_use_session_home(tmp_path):
+    home = tmp_path / "home"
+    (home / ".conan" / "profiles").mkdir(parents=True)
+    path = write(home / ".conan" / "profiles" / "default", "[settings]\nos=Linux\n")
+    session = Conan.ConanSession(user_home=str(home))
+    assert Profile.profiles_folder(session) == str(home / ".conan" / "profiles")
+    assert Profile.resolve_path("default", cwd=str(tmp_path), session=session) == path
+
+    # The flattened profile is stored below the conan folder of the session by default.
+    merged = Profile.merged(["default"], cwd=str(tmp_path), session=session)
+    assert os.path.dirname(merged[0]) == str(home / ".conan" / "ct_profiles")
+
+
+def test_merged_profile_is_cached(tmp_path, mocker, monkeypatch):
+    a = write(tmp_path / "a", "[settings]\nos=Linux\n")
+    b = write(tmp_path / "b", "[settings]\narch=x86_64\n")
+    folder = str(tmp_path / "out")
+    load = mocker.spy(Profile.Profile, "load")
+
+    merged = Profile.merged([a, b], folder=folder)
+    assert len(merged) == 1
+    assert os.path.dirname(merged[0]) == folder
+    with open(merged[0]) as f:
+        assert f.read() == "[settings]\nos=Linux\narch=x86_64\n"
+    assert Profile.merged([a, b], folder=folder) == merged
+    assert load.call_count == 2
+
+    # Unknown profiles are left to conan.
+    assert Profile.merged([a, "does_not_exist"], folder=folder) == [a, "does_not_exist"]
+
+    # The flattened profile is used by fmt_build_args when enabled.
+    monkeypatch.setenv("CT_MERGE_PROFILES", "1")
+    args = Conan.fmt_build_args("install", ["."], remote=None, profiles=[a, b], build=[],
+                                options={})
+    assert args[:3] == ["install", ".", "--profile"]
+    assert os.path.basename(args[3]) == os.path.basename(merged[0])
+    assert len(args) == 4
+
+
+def test_extend_profile(tmp_path):
+    from ConanTools import Repack
+    inpath = write(tmp_path / "in", "[settings]\nos=Linux\n")
+    outpath = str(tmp_path / "out")
+    Repack.extend_profile(inpath, outpath, ["ninja/1.9.0@foo/stable"])
+    with open(outpath) as f:
+        assert f.read() == "[settings]\nos=Linux\n\n[build_requires]\nninja/1.9.0@foo/stable\n"
@@ -0,0 +1,80 @@
+from ConanTools import Conan
+from ConanTools.Remotes import RemoteSelector
+from contextlib import redirect_stdout
+import io
+import os
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="uses an executable python script")
+
+# Stand-in for conan that simulates remotes with different response times. Every probe is
+# logged to be able to check the caching.
+fake_conan = """#!{}
+import sys, time
+remote = sys.argv[sys.argv.index("--remote") + 1]
+with open({!r}, 'a') as f:
+    f.write(remote + "\\n")
+delays = {{"slow": 0.5, "fast": 0.0, "medium": 0.2, "hanging": 30}}
+if remote not in delays:
+    sys.exit(1)
+time.sleep(delays[remote])
+"""
+
+
+@pytest.fixture
+def conan_cmd(tmp_path):
+    conan = tmp_path / "conan"
+    conan.write_text(fake_conan.format(sys.executable, str(tmp_path / "probes.log")))
+    conan.chmod(0o755)
+    return str(conan)
+
+
+def probes(tmp_path):
+    with open(str(tmp_path / "probes.log")) as f:
+        return sorted(f.read().split())
+
+
+def test_remote_selector_ranking(tmp_path, conan_cmd):
+    selector = RemoteSelector(["slow", "down", "fast", "medium", "hanging"], timeout=2,
+                              conan_cmd=conan_cmd)
+    with redirect_stdout(io.StringIO()):
+        assert selector.ranking() == ["fast", "medium", "slow", "down", "hanging"]
+        assert selector.fastest() == "fast"
+    # The measurements are cached until the TTL expires.
+    assert probes(tmp_path) == ["down", "fast", "hanging", "medium", "slow"]
+
+    selector.invalidate("slow")
+    with redirect_stdout(io.StringIO()):
+        selector.latencies()
+    assert probes(tmp_path) == ["down", "fast", "hanging", "medium", "slow", "slow"]
+
+
+def test_remote_selector_session(tmp_path, conan_cmd):
+    log = io.StringIO()
+    selector = RemoteSelector(["slow", "fast"], session=Conan.ConanSession(conan_cmd=conan_cmd,
+                                                                           log=log))
+    output = io.StringIO()
+    with redirect_stdout(output):
+        assert selector.fastest() == "fast"
+    assert output.getvalue() == ""
+    assert "--remote fast" in log.getvalue()
+
+
+def test_remote_selector_as_remote(tmp_path, conan_cmd, mocker):
+    selector = RemoteSelector(["slow", "fast"], conan_cmd=conan_cmd)
+    with redirect_stdout(io.StringIO()):
+        selector.latencies()
+
+    mocker.patch('os.makedirs')
+    mocker.patch('subprocess.run', return_value=mocker.Mock(returncode=0))
+    ref = Conan.Reference("foo", "1.2.3", "bar", "testing")
+    output = io.StringIO()
+    with redirect_stdout(output):
+        assert ref.in_remote(selector) is True
+        ref.download_recipe(selector)
+        ref.install(remote=selector)
+    assert "$ conan search foo/1.2.3@bar/testing --remote fast" in output.getvalue()
+    assert "$ conan download foo/1.2.3@bar/testing --recipe --remote fast" in output.getvalue()
+    assert "$ conan install foo/1.2.3@bar/testing --build outdated --remote fast" \
+        in output.getvalue()
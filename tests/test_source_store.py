@@ -0,0 +1,81 @@
+from ConanTools import Conan
+from ConanTools.SourceStore import SourceStore
+from contextlib import redirect_stdout
+import io
+import os
+import pytest
+
+
+@pytest.fixture
+def mock_conan_source(mocker):
+    # Simulate conan source by writing a file into the requested source folder.
+    def conan_source(cmd, **kwargs):
+        src_folder = cmd[-1].split("=", 1)[1]
+        os.makedirs(src_folder, exist_ok=True)
+        with open(os.path.join(src_folder, "main.c"), 'w') as f:
+            f.write("int main() {}")
+        return mocker.Mock(returncode=0)
+    mocker.patch('ConanTools.Conan.inspect', return_value="1.0")
+    return mocker.patch('subprocess.run', side_effect=conan_source)
+
+
+def test_source_store_shared_between_layouts(tmp_path, mock_conan_source):
+    recipe_path = str(tmp_path / "conanfile.py")
+    with open(recipe_path, 'w') as f:
+        f.write("# recipe")
+    store = SourceStore(str(tmp_path / "store"))
+    recipe = Conan.Recipe(recipe_path, external_source=True)
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        recipe.source(layout=Conan.RelativePkgLayout(root=str(tmp_path / "a")), store=store)
+        recipe.source(layout=Conan.RelativePkgLayout(root=str(tmp_path / "b")), store=store)
+    assert mock_conan_source.call_count == 1
+
+    a = os.stat(str(tmp_path / "a" / "1.0" / "_source" / "main.c"))
+    b = os.stat(str(tmp_path / "b" / "1.0" / "_source" / "main.c"))
+    assert a.st_ino == b.st_ino
+    assert os.path.isfile(str(tmp_path / "b" / "1.0" / "_source" / ".ct_source_finished"))
+    assert os.listdir(store.root) == [store.key(recipe)]
+
+
+def test_source_store_failed_fetch(tmp_path, mocker):
+    mocker.patch('ConanTools.Conan.inspect', return_value="1.0")
+    mocker.patch('subprocess.run', return_value=mocker.Mock(returncode=1))
+    recipe_path = str(tmp_path / "conanfile.py")
+    with open(recipe_path, 'w') as f:
+        f.write("# recipe")
+    store = SourceStore(str(tmp_path / "store"))
+    recipe = Conan.Recipe(recipe_path, external_source=True)
+
+    with redirect_stdout(io.StringIO()):
+        with pytest.raises(ValueError):
+            recipe.source(src_folder=str(tmp_path / "src"), store=store)
+    assert os.listdir(store.root) == []
+    assert not os.path.exists(str(tmp_path / "src" / ".ct_source_finished"))
+
+
+def test_source_store_key(tmp_path, mocker):
+    fields = {"name": "foo", "version": None, "exports_sources": ["src/*", "!src/*.bak"],
+              "exports": "patches/*.patch"}
+    mocker.patch('ConanTools.Conan.inspect',
+                 side_effect=lambda path, attribute, default=None, session=None:
+                 fields.get(attribute, default))
+    for name in ["conanfile.py", "conandata.yml", "src/sub/main.c", "patches/fix.patch",
+                 "unrelated.txt", "_source/fetched.c"]:
+        os.makedirs(str((tmp_path / name).parent), exist_ok=True)
+        (tmp_path / name).write_text(name)
+    store = SourceStore(str(tmp_path / "store"))
+    recipe = Conan.Recipe(str(tmp_path / "conanfile.py"), external_source=True)
+    key = store.key(recipe)
+
+    # Files that do not influence the sources keep the key.
+    (tmp_path / "unrelated.txt").write_text("changed")
+    (tmp_path / "_source" / "fetched.c").write_text("changed")
+    os.makedirs(str(tmp_path / "store" / key))
+    assert store.key(recipe) == key
+    # Source URLs, checksums, and exported files are part of the key.
+    for name in ["conandata.yml", "src/sub/main.c", "patches/fix.patch"]:
+        (tmp_path / name).write_text("changed")
+        assert store.key(recipe) != key
+        key = store.key(recipe)
@@ -0,0 +1,155 @@
+from contextlib import redirect_stdout
+import io
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from ConanTools import Conan
+from ConanTools import Watch
+
+watchers = [lambda paths, ignore, **kwargs: Watch.PollingWatcher(paths, ignore, interval=0.05,
+                                                                 **kwargs)]
+if sys.platform.startswith("linux"):
+    watchers.append(Watch.InotifyWatcher)
+
+
+@pytest.mark.parametrize("create", watchers)
+def test_watcher(tmp_path, create):
+    os.makedirs(str(tmp_path / "src" / "sub"))
+    os.makedirs(str(tmp_path / "src" / "_build"))
+    (tmp_path / "conanfile.py").write_text("a")
+    (tmp_path / "other.py").write_text("a")
+    watcher = create([str(tmp_path / "src"), str(tmp_path / "conanfile.py")],
+                     [str(tmp_path / "src" / "_build")])
+    try:
+        assert watcher.wait(0.2) == set()
+        time.sleep(0.02)
+        (tmp_path / "src" / "sub" / "main.c").write_text("int main() {}")
+        (tmp_path / "src" / "_build" / "main.o").write_text("ignored")
+        (tmp_path / "src" / ".main.c.swp").write_text("ignored")
+        (tmp_path / "other.py").write_text("ignored")
+        assert Watch.debounce(watcher, 0.2, timeout=5) == {str(tmp_path / "src" / "sub" / "main.c")}
+        (tmp_path / "conanfile.py").write_text("bb")
+        assert str(tmp_path / "conanfile.py") in Watch.debounce(watcher, 0.2, timeout=5)
+    finally:
+        watcher.close()
+
+
+@pytest.mark.parametrize("create", watchers)
+def test_watcher_missing_folder(tmp_path, create):
+    source = str(tmp_path / "recipe" / "_source")
+    watcher = create([], [], folders=[source])
+    try:
+        assert watcher.wait(0.2) == set()
+        os.makedirs(os.path.join(source, "sub"))
+        (tmp_path / "recipe" / "_source" / "sub" / "main.c").write_text("a")
+        changed = Watch.debounce(watcher, 0.2, timeout=5)
+        assert changed and all(x == source or x.startswith(source + os.sep) for x in changed)
+        # Later edits within the folder that appeared are noticed as well.
+        time.sleep(0.02)
+        (tmp_path / "recipe" / "_source" / "sub" / "main.c").write_text("bb")
+        assert Watch.debounce(watcher, 0.2, timeout=5) == {
+            os.path.join(source, "sub", "main.c")}
+    finally:
+        watcher.close()
+
+
+def test_affected_stages():
+    assert Watch.affected_stages({"/a/main.c"}, ["/a/conanfile.py"]) == ["build", "package"]
+    assert Watch.affected_stages({"/a/main.c", "/a/conanfile.py"},
+                                 ["/a/conanfile.py"]) == Watch.INSTALL_STAGES
+
+
+def test_watch_reruns_affected_stages(tmp_path, mocker):
+    (tmp_path / "conanfile.py").write_text("a")
+    (tmp_path / "main.c").write_text("a")
+    recipe = Conan.Recipe(str(tmp_path / "conanfile.py"))
+    executed = []
+    for stage in ["install", "build", "package"]:
+        mocker.patch.object(recipe, stage,
+                            side_effect=lambda *args, stage=stage, **kwargs: executed.append(stage))
+
+    def edit():
+        # Wait for the initial cycle before editing the files.
+        while len(executed) < 3:
+            time.sleep(0.01)
+        time.sleep(0.2)
+        (tmp_path / "main.c").write_text("b")
+        while len(executed) < 5:
+            time.sleep(0.01)
+        time.sleep(0.2)
+        (tmp_path / "conanfile.py").write_text("b")
+    thread = threading.Thread(target=edit)
+    thread.start()
+    with redirect_stdout(io.StringIO()):
+        cycles = Watch.watch(recipe, "user", "channel", delay=0.1, polling=True, max_cycles=3)
+    thread.join()
+    assert cycles == 3
+    assert executed == ["install", "build", "package", "build", "package",
+                        "install", "build", "package"]
+
+
+def test_watch_external_source(tmp_path, mocker):
+    (tmp_path / "conanfile.py").write_text("a")
+    recipe = Conan.Recipe(str(tmp_path / "conanfile.py"), external_source=True)
+    source = tmp_path / "_source"
+    executed = []
+
+    def fetch(*args, **kwargs):
+        os.makedirs(str(source))
+        (source / "main.c").write_text("a")
+        executed.append("source")
+    mocker.patch.object(recipe, "source", side_effect=fetch)
+    mocker.patch.object(recipe, "build", side_effect=lambda *args, **kwargs: executed.append(
+        "build " + (source / "main.c").read_text()))
+    for stage in ["install", "package"]:
+        mocker.patch.object(recipe, stage,
+                            side_effect=lambda *args, stage=stage, **kwargs: executed.append(stage))
+
+    def edit():
+        while len(executed) < 4:
+            time.sleep(0.01)
+        time.sleep(0.5)
+        (source / "main.c").write_text("b")
+    thread = threading.Thread(target=edit)
+    thread.start()
+    with redirect_stdout(io.StringIO()):
+        cycles = Watch.watch(recipe, "user", "channel", delay=0.1, polling=True, max_cycles=2)
+    thread.join()
+    # Fetching the sources does not trigger a rebuild but editing them does.
+    assert cycles == 2
+    assert executed == ["install", "source", "build a", "package", "build b", "package"]
+
+
+def test_watch_ignores_own_output(tmp_path):
+    # Fake conan which succeeds for every command. The recipe builds from its own folder
+    # without copying the sources (no_copy_source) and all other attributes are undefined.
+    conan = tmp_path / "fake_conan.py"
+    conan.write_text("\n".join([
+        "#!{}".format(sys.executable),
+        "import json, sys",
+        "args = sys.argv[1:]",
+        "if args[0] == 'inspect':",
+        "    attr = args[args.index('--attribute') + 1]",
+        "    value = True if attr == 'no_copy_source' else ''",
+        "    json.dump({attr: value}, open(args[args.index('--json') + 1], 'w'))",
+    ]) + "\n")
+    os.chmod(str(conan), 0o755)
+    recipe_dir = tmp_path / "recipe"
+    os.makedirs(str(recipe_dir))
+    (recipe_dir / "conanfile.py").write_text("a")
+    (recipe_dir / "main.c").write_text("a")
+    session = Conan.ConanSession(conan_cmd=str(conan))
+    recipe = Conan.Recipe(str(recipe_dir / "conanfile.py"), session=session)
+    cancel = Conan.CancellationToken()
+    timer = threading.Timer(2.0, cancel.cancel)
+    timer.start()
+    with redirect_stdout(io.StringIO()):
+        cycles = Watch.watch(recipe, "user", "channel", delay=0.1, polling=True, cancel=cancel,
+                             max_cycles=5)
+    timer.join()
+    assert os.path.isfile(str(recipe_dir / "ct_build.sh"))
+    assert cycles == 1
@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+
+import pytest
+
+import ConanTools
+from ConanTools import Conan
+
+
+@pytest.fixture
+def workspace(tmp_path, mocker, mock_inspect):
+    # d only requires b in its requirements() method, i.e., it is only visible in the graph.
+    requires = {"a": [], "b": ["a"], "c": [], "d": ["b"]}
+
+    def graph(path_or_ref, remote=None, profiles=[], options={}, session=None):
+        name = os.path.basename(os.path.dirname(path_or_ref))
+        nodes = [{"reference": "conanfile.py ({}/1.0)".format(name), "is_ref": False}]
+        pending = list(requires[name])
+        while pending:
+            dep = pending.pop()
+            nodes.append({"reference": "{}/1.0@user/channel".format(dep), "is_ref": True})
+            pending.extend(requires[dep])
+        return nodes
+    mocker.patch('ConanTools.Conan.graph', side_effect=graph)
+    mocker.patch('ConanTools.Conan.Recipe.export')
+    return Conan.Workspace([Conan.Recipe(str(tmp_path / x / "conanfile.py")) for x in requires])
+
+
+def test_graph_dependencies(workspace):
+    refs = workspace.references("user", "channel")
+    a, b, c, d = workspace.recipes
+    assert workspace.graph_dependencies(refs) == {a: [], b: [a], c: [], d: [a, b]}
+    # The recipes are exported such that conan can resolve the workspace requirements.
+    assert Conan.Recipe.export.call_count == 4
+
+
+def test_ws_import_subpackages(tmp_path, mocker, workspace):
+    installs = []
+
+    def install(self, remote=None, profiles=[], options={}, build=["outdated"], cwd=None,
+                session=None):
+        installs.append((sorted(self._package_ids.values()), build, cwd, options))
+        if len(installs) == 1:
+            raise ValueError("packages are missing")
+    mocker.patch('ConanTools.Repack.ConanImportTxtFile.install', autospec=True,
+                 side_effect=install)
+
+    lock = threading.Lock()
+    created = []
+    active = []
+    overlap = []
+
+    def pkg_create(recipe, **kwargs):
+        name = recipe.get_field("name")
+        # Options are qualified with the package name and the builds share the cores.
+        assert kwargs["options"] == {name + ":shared": "True", "zlib:shared": "False"}
+        assert isinstance(kwargs["cpu_pool"], Conan.CpuPool)
+        with lock:
+            active.append(name)
+            overlap.append(len(active))
+        time.sleep(0.1)
+        with lock:
+            active.remove(name)
+            created.append(name)
+    mocker.patch('ConanTools.pkg_create', side_effect=pkg_create)
+
+    pkg_folder = str(tmp_path / "pkg")
+    ConanTools.ws_import(workspace, "user", "channel", pkg_folder=pkg_folder,
+                         options={"shared": "True", "zlib:shared": "False"},
+                         enable_subpackages=True, max_workers=4)
+    # Dependencies are created before their dependents while independent recipes overlap.
+    assert created.index("a") < created.index("b") < created.index("d")
+    assert max(overlap) > 1
+    # All packages are imported with a single install.
+    refs = ["{}/1.0@user/channel".format(x) for x in "abcd"]
+    options = {"zlib:shared": "False"}
+    options.update({x + ":shared": "True" for x in "abcd"})
+    assert installs == [(refs, [], pkg_folder, options), (refs, [], pkg_folder, options)]
+
+
+def test_ws_import_subpackages_failure(tmp_path, mocker, workspace):
+    install = mocker.patch('ConanTools.Repack.ConanImportTxtFile.install',
+                           side_effect=ValueError("packages are missing"))
+
+    def pkg_create(recipe, **kwargs):
+        if recipe.get_field("name") == "a":
+            raise ValueError("build failed")
+    create = mocker.patch('ConanTools.pkg_create', side_effect=pkg_create)
+
+    with pytest.raises(ValueError, match="build failed"):
+        ConanTools.ws_import(workspace, "user", "channel", pkg_folder=str(tmp_path),
+                             enable_subpackages=True)
+    # The dependents of the failed recipe are not created anymore.
+    created = [x[1]["recipe"].get_field("name") for x in create.call_args_list]
+    assert "b" not in created and "d" not in created
+    assert install.call_count == 1